@@ -0,0 +1,135 @@
+import sys
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+import pandas as pd
+from sqlalchemy import text, Engine
+
+from db import engine_from_env, insert_ignore, upsert
+from question_bank import QuestionBank
+
+# 管理员看板的预聚合表（表结构见 migrations.py）：登录、交卷、结束学习会话时增量维护，看板只读这几张小表。
+REBUILD = [
+    "DELETE FROM rollup_daily_users",
+    "INSERT INTO rollup_daily_users (stat_date, username) SELECT DISTINCT DATE(login_time), username FROM login_logs",
+    "DELETE FROM rollup_daily_active",
+    "INSERT INTO rollup_daily_active (stat_date, user_count) SELECT stat_date, COUNT(*) FROM rollup_daily_users GROUP BY stat_date",
+    "DELETE FROM rollup_course_time",
+    "INSERT INTO rollup_course_time (course_name, total_seconds, session_count) SELECT course_name, SUM(duration_seconds), COUNT(*) FROM study_sessions WHERE duration_seconds IS NOT NULL GROUP BY course_name",
+    "DELETE FROM rollup_question_accuracy",
+]
+
+
+def record_logins(conn, rows: List[dict]):
+    """rows 为 login_logs 的写入参数 {"u": 用户名, "t": 登录时间}，在调用方事务内更新日活。"""
+    by_day: Dict[object, set] = defaultdict(set)
+    for row in rows:
+        by_day[row["t"].date()].add(row["u"])
+    for day, users in by_day.items():
+        res = conn.execute(text(insert_ignore(conn, "INTO rollup_daily_users (stat_date, username) VALUES (:d, :u)")),
+                           [{"d": day, "u": u} for u in users])
+        if res.rowcount > 0:
+            conn.execute(text(upsert(conn, "INSERT INTO rollup_daily_active (stat_date, user_count) VALUES (:d, :n)",
+                                     "stat_date", increment=("user_count",))),
+                         {"d": day, "n": res.rowcount})
+
+
+def on_log_flush(conn, table: str, rows: List[dict]):
+    if table == "login_logs":
+        record_logins(conn, rows)
+
+
+def record_submissions(conn, results: List[Tuple[str, int, bool]]):
+    """results 为 (课程, 题号, 是否正确)，未判定的题目不要传进来。"""
+    if not results:
+        return
+    conn.execute(text(upsert(
+        conn, "INSERT INTO rollup_question_accuracy (course_name, question_id, attempts, correct) VALUES (:c, :q, 1, :ok)",
+        "course_name, question_id", increment=("attempts", "correct"))),
+        [{"c": c, "q": q, "ok": int(ok)} for c, q, ok in results])
+
+
+def record_session_end(conn, course_name: str, seconds: int):
+    conn.execute(text(upsert(
+        conn, "INSERT INTO rollup_course_time (course_name, total_seconds, session_count) VALUES (:c, :s, 1)",
+        "course_name", increment=("total_seconds", "session_count"))),
+        {"c": course_name, "s": int(seconds or 0)})
+
+
+def drop_course(conn, course_name: str):
+    """删除自定义课程时在同一事务内清掉它的预聚合行。"""
+    conn.execute(text("DELETE FROM rollup_question_accuracy WHERE course_name = :c"), {"c": course_name})
+    conn.execute(text("DELETE FROM rollup_course_time WHERE course_name = :c"), {"c": course_name})
+
+
+def rename_course(conn, old_name: str, new_name: str):
+    """课程改名时在同一事务内改预聚合行；学习会话明细一并改名，rebuild 重算的结果与增量维护一致。"""
+    params = {"o": old_name, "n": new_name}
+    conn.execute(text("UPDATE rollup_question_accuracy SET course_name = :n WHERE course_name = :o"), params)
+    conn.execute(text("UPDATE rollup_course_time SET course_name = :n WHERE course_name = :o"), params)
+    conn.execute(text("UPDATE study_sessions SET course_name = :n WHERE course_name = :o"), params)
+
+
+def move_question(conn, qid: int, course_name: str):
+    """题目改到其他课程时，它的作答统计跟着转过去。qid 为统一题号。"""
+    conn.execute(text("UPDATE rollup_question_accuracy SET course_name = :c WHERE question_id = :q"),
+                 {"c": course_name, "q": qid})
+
+
+def drop_question(conn, qid: int):
+    conn.execute(text("DELETE FROM rollup_question_accuracy WHERE question_id = :q"), {"q": qid})
+
+
+def rebuild(engine: Engine, bank: QuestionBank):
+    """题目所属课程从 QuestionBank 读取，内置题库与自定义题目一起重算正确率。"""
+    with engine.connect() as conn:
+        for stmt in REBUILD:
+            conn.execute(text(stmt))
+        rows = conn.execute(text(
+            "SELECT qid, COUNT(*), SUM(is_correct) FROM interaction_logs WHERE kind = 'submission' AND is_correct IS NOT NULL AND qid IS NOT NULL GROUP BY qid")).fetchall()
+        questions = bank.get_many(r[0] for r in rows)
+        params = [{"c": questions[qid]["category"], "q": qid, "a": n, "ok": int(ok or 0)} for qid, n, ok in rows
+                  if qid in questions]
+        if params:
+            conn.execute(text(
+                "INSERT INTO rollup_question_accuracy (course_name, question_id, attempts, correct) VALUES (:c, :q, :a, :ok)"),
+                params)
+        # 已删除课程的学习时长不再计入（与 drop_course 一致）
+        known = set(bank.static_courses) | {r[0] for r in conn.execute(text("SELECT course_name FROM custom_courses"))}
+        stale = [{"c": r[0]} for r in conn.execute(text("SELECT course_name FROM rollup_course_time")) if r[0] not in known]
+        if stale:
+            conn.execute(text("DELETE FROM rollup_course_time WHERE course_name = :c"), stale)
+        conn.commit()
+
+
+def active_users_last_7_days(conn) -> pd.DataFrame:
+    return pd.read_sql(text(
+        "SELECT stat_date AS login_date, user_count FROM rollup_daily_active WHERE stat_date >= :since ORDER BY stat_date"),
+        conn, params={"since": date.today() - timedelta(days=7)})
+
+
+def course_durations(conn) -> pd.DataFrame:
+    return pd.read_sql(text("SELECT course_name, total_seconds FROM rollup_course_time WHERE total_seconds > 0"), conn)
+
+
+def course_accuracy(conn) -> pd.DataFrame:
+    return pd.read_sql(text(
+        "SELECT course_name, SUM(correct) * 1.0 / SUM(attempts) AS is_correct FROM rollup_question_accuracy GROUP BY course_name HAVING SUM(attempts) > 0"),
+        conn)
+
+
+if __name__ == "__main__":
+    # 用法：python analytics.py rebuild   —— 从明细表全量重算预聚合表（首次上线或数据修复时使用）
+    from dotenv import load_dotenv
+    import migrations
+    from question_index import QuestionIndex
+
+    load_dotenv()
+    if sys.argv[1:] != ["rebuild"]:
+        print("用法：python analytics.py rebuild")
+        sys.exit(1)
+    engine = engine_from_env()
+    migrations.upgrade(engine)
+    rebuild(engine, QuestionBank(QuestionIndex(engine)))
+    print("✅ 预聚合表重建完成")
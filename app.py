@@ -1,21 +1,42 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import os
 import random
 import time
 import hashlib
+import io
 import re
 import pandas as pd
 import plotly.express as px
 import logging
-import asyncio
+from contextlib import closing
+from functools import partial
 from typing import List, Dict, Optional, Any
-from sqlalchemy import create_engine, text, Engine
-from openai import OpenAI, AsyncOpenAI
+from sqlalchemy import text, Engine
 from dotenv import load_dotenv
 from datetime import datetime
 import pytz
-from werkzeug.security import generate_password_hash, check_password_hash
-from prompts import SYSTEM_INSTRUCTION, JUDGE_PROMPT_SYSTEM
+from prompts import (JUDGE_PROMPT_VERSION, SYSTEM_INSTRUCTION, SUMMARY_PROMPT_SYSTEM, judge_messages, batch_judge_messages, tutor_head,
+                     tutor_request)
+from judge_cache import VerdictCache
+from grading import GradingEngine, PASS, FAIL, UNGRADED, VERDICT_LABELS
+from prejudge import PreJudge
+from hint_cache import HintCache
+from config_store import ConfigStore
+from log_writer import LogWriter
+from db import database_url, make_engine, pool_stats, seconds_between, unit_of_work
+import analytics
+import auth
+import migrations
+import question_io
+from question_index import QuestionIndex
+from question_bank import QuestionBank, CUSTOM_ID_OFFSET
+from search_index import SearchIndex
+from stream_render import StreamRenderer
+from llm_runtime import LLMRuntime
+from tutor_context import ContextBuilder
+from telemetry import Telemetry, load_metrics, latency_percentiles, kind_summary
+from draft_store import DraftStore
 
 load_dotenv()
 logging.basicConfig(level=logging.ERROR, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -27,23 +48,246 @@ class AppConfig:
     DB_PASSWORD = st.secrets.get("DB_PASSWORD") or os.getenv("DB_PASSWORD")
     DB_HOST = st.secrets.get("DB_HOST") or os.getenv("DB_HOST")
     DB_NAME = st.secrets.get("DB_NAME") or os.getenv("DB_NAME")
-    BASE_URL = "https://api.deepseek.com"
+    DB_BACKEND = os.getenv("DB_BACKEND", "mysql")
+    SQLITE_PATH = os.getenv("SQLITE_PATH", "app.db")
+    SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "64"))
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+    BASE_URL = os.getenv("LLM_BASE_URL", "https://api.deepseek.com")
+    JUDGE_CACHE_SIZE = int(os.getenv("JUDGE_CACHE_SIZE", "4096"))
+    JUDGE_CACHE_TTL = int(os.getenv("JUDGE_CACHE_TTL", str(7 * 86400)))
+    JUDGE_MAX_CONCURRENCY = int(os.getenv("JUDGE_MAX_CONCURRENCY", "16"))
+    JUDGE_CALL_TIMEOUT = float(os.getenv("JUDGE_CALL_TIMEOUT", "20"))
+    JUDGE_MAX_RETRIES = int(os.getenv("JUDGE_MAX_RETRIES", "3"))
+    JUDGE_PAPER_DEADLINE = float(os.getenv("JUDGE_PAPER_DEADLINE", "60"))
+    JUDGE_BATCH_SIZE = int(os.getenv("JUDGE_BATCH_SIZE", "0"))
+    HINT_CACHE_SIZE = int(os.getenv("HINT_CACHE_SIZE", "2048"))
+    HINT_CACHE_TTL = int(os.getenv("HINT_CACHE_TTL", str(6 * 3600)))
+    HINT_CACHE_VARIANTS = int(os.getenv("HINT_CACHE_VARIANTS", "3"))
+    CONFIG_POLL_SECONDS = float(os.getenv("CONFIG_POLL_SECONDS", "5"))
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "500"))
+    LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+    LOG_SPILL_PATH = os.getenv("LOG_SPILL_PATH", "log_spill.jsonl")
+    CHAT_HISTORY_PAGE = int(os.getenv("CHAT_HISTORY_PAGE", "20"))
+    CHAT_HISTORY_MAX_QUESTIONS = int(os.getenv("CHAT_HISTORY_MAX_QUESTIONS", "5"))
+    ADMIN_CACHE_TTL = int(os.getenv("ADMIN_CACHE_TTL", "30"))
+    ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "50"))
+    # 页面导出要把整个文件放进内存交给下载按钮，超过该题数请用命令行 python question_io.py export
+    QUESTION_EXPORT_LIMIT = int(os.getenv("QUESTION_EXPORT_LIMIT", "20000"))
+    SEARCH_INDEX_MAX_AGE = float(os.getenv("SEARCH_INDEX_MAX_AGE", "600"))
+    STREAM_RENDER_INTERVAL = float(os.getenv("STREAM_RENDER_INTERVAL", "0.1"))
+    STREAM_RENDER_CHUNKS = int(os.getenv("STREAM_RENDER_CHUNKS", "40"))
+    LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+    LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+    LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+    TUTOR_CONTEXT_BUDGET = int(os.getenv("TUTOR_CONTEXT_BUDGET", "3000"))
+    TUTOR_SUMMARY_TOKENS = int(os.getenv("TUTOR_SUMMARY_TOKENS", "300"))
+    TUTOR_SUMMARY_SEGMENT = int(os.getenv("TUTOR_SUMMARY_SEGMENT", "4"))
+    TUTOR_SUMMARY_TIMEOUT = float(os.getenv("TUTOR_SUMMARY_TIMEOUT", "15"))
+    LLM_METRICS_RING_SIZE = int(os.getenv("LLM_METRICS_RING_SIZE", "2000"))
+    DRAFT_SAVE_INTERVAL = float(os.getenv("DRAFT_SAVE_INTERVAL", "5"))
+    AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+    AUTH_HASH_QUEUE = int(os.getenv("AUTH_HASH_QUEUE", "200"))
+    AUTH_HASH_TIMEOUT = float(os.getenv("AUTH_HASH_TIMEOUT", "15"))
+    AUTH_HASH_METHOD = os.getenv("AUTH_HASH_METHOD", "scrypt")
+    LOGIN_MAX_USER_FAILURES = int(os.getenv("LOGIN_MAX_USER_FAILURES", "5"))
+    LOGIN_MAX_IP_FAILURES = int(os.getenv("LOGIN_MAX_IP_FAILURES", "100"))
+    LOGIN_FAILURE_WINDOW = float(os.getenv("LOGIN_FAILURE_WINDOW", "300"))
 
 
-client = OpenAI(api_key=AppConfig.LLM_API_KEY, base_url=AppConfig.BASE_URL)
-aclient = AsyncOpenAI(api_key=AppConfig.LLM_API_KEY, base_url=AppConfig.BASE_URL)
+@st.cache_resource
+def get_llm_runtime() -> LLMRuntime:
+    return LLMRuntime(AppConfig.LLM_API_KEY, AppConfig.BASE_URL, max_connections=AppConfig.LLM_MAX_CONNECTIONS,
+                      max_keepalive=AppConfig.LLM_MAX_KEEPALIVE, keepalive_expiry=AppConfig.LLM_KEEPALIVE_EXPIRY,
+                      telemetry=get_telemetry())
+
+
+@st.cache_resource
+def get_telemetry() -> Telemetry:
+    return Telemetry(sink=partial(get_log_writer().write, "llm_call_metrics"), ring_size=AppConfig.LLM_METRICS_RING_SIZE)
 
 
 @st.cache_resource
 def get_database_engine() -> Engine:
-    connection_url = f"mysql+pymysql://{AppConfig.DB_USER}:{AppConfig.DB_PASSWORD}@{AppConfig.DB_HOST}/{AppConfig.DB_NAME}"
-    return create_engine(connection_url, pool_recycle=1800, pool_pre_ping=True)
+    engine = make_engine(database_url(AppConfig.DB_BACKEND, AppConfig.DB_USER, AppConfig.DB_PASSWORD, AppConfig.DB_HOST,
+                                      AppConfig.DB_NAME, AppConfig.SQLITE_PATH),
+                         pool_size=AppConfig.DB_POOL_SIZE, max_overflow=AppConfig.DB_MAX_OVERFLOW,
+                         pool_timeout=AppConfig.DB_POOL_TIMEOUT, pool_recycle=AppConfig.DB_POOL_RECYCLE,
+                         pre_ping=AppConfig.DB_POOL_PRE_PING, sqlite_cache_mb=AppConfig.SQLITE_CACHE_MB)
+    try:
+        migrations.upgrade(engine)
+    except Exception as e:
+        logging.error(f"Schema migration error: {e}")
+    return engine
+
+
+@st.cache_resource
+def get_log_writer() -> LogWriter:
+    return LogWriter(get_database_engine(), {
+        "login_logs": "INSERT INTO login_logs (username, login_time) VALUES (:u, :t)",
+        "interaction_logs": "INSERT INTO interaction_logs (question_id, qid, student_id, kind, is_correct, session_id, user_query, ai_response, is_leaking_answer, created_at) VALUES (:qid, :qid, :sid, :kind, :ok, :sess, :qry, :rsp, :leak, :time)",
+        "llm_call_metrics": "INSERT INTO llm_call_metrics (created_at, kind, course, prompt_version, model, latency_ms, ttft_ms, tokens_per_sec, prompt_tokens, completion_tokens, cached_tokens, retries, error) VALUES (:created_at, :kind, :course, :prompt_version, :model, :latency_ms, :ttft_ms, :tokens_per_sec, :prompt_tokens, :completion_tokens, :cached_tokens, :retries, :error)",
+    }, max_queue=AppConfig.LOG_QUEUE_SIZE, batch_size=AppConfig.LOG_BATCH_SIZE,
+        flush_interval=AppConfig.LOG_FLUSH_INTERVAL, spill_path=AppConfig.LOG_SPILL_PATH,
+        on_flush=analytics.on_log_flush,
+        defaults={"interaction_logs": {"kind": "other", "ok": None, "sess": None}})
+
+
+@st.cache_resource
+def get_draft_store() -> DraftStore:
+    return DraftStore(get_database_engine(), AppConfig.DRAFT_SAVE_INTERVAL)
+
+
+@st.cache_resource
+def get_password_hasher() -> auth.PasswordHasher:
+    return auth.PasswordHasher(AppConfig.AUTH_HASH_WORKERS, AppConfig.AUTH_HASH_QUEUE, AppConfig.AUTH_HASH_TIMEOUT,
+                               AppConfig.AUTH_HASH_METHOD)
+
+
+@st.cache_resource
+def get_login_throttle() -> auth.LoginThrottle:
+    return auth.LoginThrottle(AppConfig.LOGIN_MAX_USER_FAILURES, AppConfig.LOGIN_MAX_IP_FAILURES,
+                              AppConfig.LOGIN_FAILURE_WINDOW)
+
+
+@st.cache_resource
+def get_config_store() -> ConfigStore:
+    return ConfigStore(get_database_engine(), AppConfig.CONFIG_POLL_SECONDS)
+
+
+@st.cache_resource
+def get_verdict_cache() -> VerdictCache:
+    return VerdictCache(get_database_engine(), AppConfig.JUDGE_CACHE_SIZE, AppConfig.JUDGE_CACHE_TTL)
+
+
+@st.cache_resource
+def get_question_index() -> QuestionIndex:
+    return QuestionIndex(get_database_engine())
+
+
+@st.cache_resource
+def get_question_bank() -> QuestionBank:
+    return QuestionBank(get_question_index())
+
+
+@st.cache_resource
+def get_search_index() -> SearchIndex:
+    return SearchIndex(get_database_engine(), get_question_bank().static_records(), AppConfig.SEARCH_INDEX_MAX_AGE)
+
+
+def interrupt_if_rerun_requested():
+    """等待大模型期间检查本次脚本运行是否已被要求重跑或停止（学生点了别的按钮、关闭页面）。
+
+    有请求时调用一次 st.empty() 走到 Streamlit 的让出点，由它抛出 RerunException / StopException，
+    LLMRuntime.run 随之取消后台任务。请求状态没有公开接口，读不到时按未中断处理。
+    """
+    try:
+        state = getattr(getattr(get_script_run_ctx(), "script_requests", None), "_state", None)
+        rerun_requested = state is not None and getattr(state, "name", "CONTINUE") != "CONTINUE"
+    except Exception:
+        rerun_requested = False
+    if rerun_requested:
+        st.empty()
+
+
+def summarize_tutoring(prev_summary: str, turns: List[dict]) -> str:
+    convo = "\n".join(f"{'学生' if m['role'] == 'user' else '辅导'}：{m['content']}" for m in turns)
+    user_msg = (f"已有摘要：\n{prev_summary}\n\n" if prev_summary else "") + f"新增对话：\n{convo}"
+    runtime = get_llm_runtime()
+    resp = runtime.run(runtime.chat(
+        "summary", model="deepseek-chat", max_tokens=AppConfig.TUTOR_SUMMARY_TOKENS,
+        messages=[{"role": "system", "content": SUMMARY_PROMPT_SYSTEM}, {"role": "user", "content": user_msg}]),
+        timeout=AppConfig.TUTOR_SUMMARY_TIMEOUT, interrupt=interrupt_if_rerun_requested)
+    return resp.choices[0].message.content
+
+
+@st.cache_resource
+def get_context_builder() -> ContextBuilder:
+    return ContextBuilder(AppConfig.TUTOR_CONTEXT_BUDGET, AppConfig.TUTOR_SUMMARY_TOKENS,
+                          AppConfig.TUTOR_SUMMARY_SEGMENT, summarize_tutoring)
+
+
+def invalidate_question_caches(qid: int):
+    get_question_index().invalidate_question(qid)
+    get_verdict_cache().invalidate_question(qid)
+    get_hint_cache().invalidate_question(qid)
+    try:
+        rec = get_question_bank().get(qid)
+        if rec:
+            get_search_index().add(rec)
+        else:
+            get_search_index().remove(qid)
+    except Exception as e:
+        logging.error(f"Search index update error: {e}")
+
+
+@st.cache_resource
+def get_hint_cache() -> HintCache:
+    return HintCache(AppConfig.HINT_CACHE_SIZE, AppConfig.HINT_CACHE_TTL, AppConfig.HINT_CACHE_VARIANTS)
+
+
+@st.cache_resource
+def get_prejudge() -> PreJudge:
+    return PreJudge()
+
+
+@st.cache_resource
+def get_grading_engine() -> GradingEngine:
+    return GradingEngine(max_concurrency=AppConfig.JUDGE_MAX_CONCURRENCY, call_timeout=AppConfig.JUDGE_CALL_TIMEOUT,
+                         max_retries=AppConfig.JUDGE_MAX_RETRIES, paper_deadline=AppConfig.JUDGE_PAPER_DEADLINE)
+
 
+# 管理端只读查询：按短 TTL 缓存，写操作后调用 clear_admin_caches 立即失效
+@st.cache_data(ttl=AppConfig.ADMIN_CACHE_TTL, show_spinner=False)
+def load_dashboard_frames():
+    with get_database_engine().connect() as conn:
+        return (analytics.active_users_last_7_days(conn), analytics.course_durations(conn),
+                analytics.course_accuracy(conn))
 
-def verify_password(db_hash: str, pwd: str) -> bool:
-    if db_hash.startswith("scrypt:") or db_hash.startswith("pbkdf2:"):
-        return check_password_hash(db_hash, pwd)
-    return hashlib.sha256(pwd.encode('utf-8')).hexdigest() == db_hash
+
+@st.cache_data(ttl=AppConfig.ADMIN_CACHE_TTL, show_spinner=False)
+def load_recent_rows(sql: str) -> pd.DataFrame:
+    with get_database_engine().connect() as conn:
+        return pd.read_sql(text(sql), conn)
+
+
+@st.cache_data(ttl=AppConfig.ADMIN_CACHE_TTL, show_spinner=False)
+def load_llm_metrics(hours: int) -> pd.DataFrame:
+    with get_database_engine().connect() as conn:
+        return load_metrics(conn, hours)
+
+
+@st.cache_data(ttl=AppConfig.ADMIN_CACHE_TTL, show_spinner=False)
+def load_custom_courses() -> List[tuple]:
+    with get_database_engine().connect() as conn:
+        return [tuple(r) for r in conn.execute(text("SELECT course_name, description FROM custom_courses")).fetchall()]
+
+
+@st.cache_data(ttl=AppConfig.ADMIN_CACHE_TTL, show_spinner=False)
+def load_question_labels(course: str) -> Dict[int, str]:
+    """只取题号与前 20 个字符用于下拉框标签，完整题目在选中后按题号单独读取。"""
+    with get_database_engine().connect() as conn:
+        rows = conn.execute(text("SELECT id, SUBSTR(content, 1, 20) FROM custom_questions WHERE category = :c ORDER BY id DESC"),
+                            {"c": course}).fetchall()
+    return {r[0]: f"(内部ID:{r[0]}) {r[1]}..." for r in rows}
+
+
+@st.cache_data(ttl=AppConfig.ADMIN_CACHE_TTL, show_spinner=False)
+def load_custom_questions_page(page: int) -> pd.DataFrame:
+    with get_database_engine().connect() as conn:
+        return pd.read_sql(text(
+            "SELECT id AS '内部ID', category AS '所属课程', content AS '题目完整内容' FROM custom_questions ORDER BY id DESC LIMIT :n OFFSET :o"),
+            conn, params={"n": AppConfig.ADMIN_PAGE_SIZE, "o": page * AppConfig.ADMIN_PAGE_SIZE})
+
+
+def clear_admin_caches():
+    load_custom_courses.clear()
+    load_question_labels.clear()
+    load_custom_questions_page.clear()
 
 
 def format_math(text_str: str) -> str:
@@ -54,48 +298,32 @@ def format_math(text_str: str) -> str:
     return text_str
 
 
-def authenticate_user(u: str, p: str):
-    engine = get_database_engine()
-    with engine.connect() as conn:
-        res = conn.execute(text("SELECT password_hash, role FROM users WHERE username = :u"), {"u": u}).fetchone()
-        if res and verify_password(res[0], p):
-            return True, res[1]
-        return False, None
+def authenticate_user(u: str, p: str) -> Optional[str]:
+    """成功返回角色，密码错误返回 None；限流或登录排队已满时抛出 auth.LoginUnavailable。"""
+    return auth.authenticate(get_database_engine(), get_password_hasher(), get_login_throttle(), u, p,
+                             st.context.ip_address)
 
 
 def register_user(u: str, p: str) -> bool:
-    engine = get_database_engine()
-    with engine.connect() as conn:
-        if conn.execute(text("SELECT id FROM users WHERE username = :u"), {"u": u}).fetchone():
-            return False
-        conn.execute(text("INSERT INTO users (username, password_hash, role) VALUES (:u, :p, 'student')"),
-                     {"u": u, "p": generate_password_hash(p)})
-        conn.commit()
-        return True
+    return auth.register(get_database_engine(), get_password_hasher(), u, p)
 
 
 def log_login(username: str):
     try:
-        engine = get_database_engine()
-        with engine.connect() as conn:
-            ts = datetime.now(pytz.timezone('Asia/Shanghai'))
-            conn.execute(text("INSERT INTO login_logs (username, login_time) VALUES (:u, :t)"),
-                         {"u": username, "t": ts})
-            conn.commit()
+        ts = datetime.now(pytz.timezone('Asia/Shanghai'))
+        get_log_writer().write("login_logs", {"u": username, "t": ts})
     except Exception as e:
         logging.error(f"log_login error: {e}")
 
 
-def log_interaction(qid: int, qry: str, rsp: str, leak: int = 0):
+def log_interaction(qid: int, qry: str, rsp: str, leak: int = 0, kind: str = "tutoring",
+                    is_correct: Optional[bool] = None):
     try:
-        engine = get_database_engine()
-        with engine.connect() as conn:
-            ts = datetime.now(pytz.timezone('Asia/Shanghai'))
-            conn.execute(text(
-                "INSERT INTO interaction_logs (question_id, student_id, user_query, ai_response, is_leaking_answer, created_at) VALUES (:qid, :sid, :qry, :rsp, :leak, :time)"),
-                         {"qid": qid, "sid": st.session_state.current_user, "qry": qry, "rsp": rsp, "leak": leak,
-                          "time": ts})
-            conn.commit()
+        ts = datetime.now(pytz.timezone('Asia/Shanghai'))
+        get_log_writer().write("interaction_logs", {
+            "qid": qid, "sid": st.session_state.current_user, "kind": kind,
+            "ok": None if is_correct is None else int(is_correct), "sess": st.session_state.study_session_id,
+            "qry": qry, "rsp": rsp, "leak": leak, "time": ts})
     except Exception as e:
         logging.error(f"log_interaction error: {e}")
 
@@ -105,7 +333,8 @@ def init_session_state():
         "logged_in": False, "current_user": None, "user_role": "student", "page_mode": "home",
         "quiz_queue": [], "current_question_index": 0, "user_answers": {},
         "assessment_results": [], "review_question_index": None,
-        "chat_histories": {}, "session_count": 0, "study_session_id": None, "current_course": None
+        "chat_histories": {}, "chat_history_cursors": {}, "chat_history_lru": [], "chat_summaries": {},
+        "session_count": 0, "study_session_id": None, "current_course": None
     }
     for k, v in defaults.items():
         if k not in st.session_state: st.session_state[k] = v
@@ -115,53 +344,69 @@ init_session_state()
 
 
 def sync_user_data(username: str):
-    engine = get_database_engine()
-    with engine.connect() as conn:
+    with unit_of_work(get_database_engine()) as conn:
         u_res = conn.execute(text("SELECT current_quiz_ids FROM users WHERE username = :u"), {"u": username}).fetchone()
         if u_res and u_res[0]:
             q_ids = [int(i) for i in u_res[0].split(",") if i.strip()]
             if q_ids:
-                db_ids = tuple([i - 1000 for i in q_ids])
-                if db_ids:
-                    res = conn.execute(
-                        text("SELECT id, category, content, answer, solution FROM custom_questions WHERE id IN :ids"),
-                        {"ids": db_ids}).fetchall()
-                    fetched_qs = [{"id": 1000 + r[0], "category": r[1], "content": r[2], "answer": r[3] or "",
-                                   "solution": r[4] or ""} for r in res]
-                    q_map = {q['id']: q for q in fetched_qs}
+                q_map = get_question_bank().get_many(q_ids)
+                if q_map:
                     st.session_state.quiz_queue = [q_map[qid] for qid in q_ids if qid in q_map]
+                    drafts = get_draft_store().load(username)
+                    st.session_state.user_answers = {i: drafts.get(q['id'], "")
+                                                     for i, q in enumerate(st.session_state.quiz_queue)}
                     if st.session_state.quiz_queue:
                         st.session_state.current_course = st.session_state.quiz_queue[0].get('category', '继续测验')
                     st.session_state.page_mode = "quiz"
 
-        logs = conn.execute(
-            text("SELECT question_id, user_query, ai_response FROM interaction_logs WHERE student_id = :u"),
-            {"u": username}).fetchall()
-        for row in logs:
-            qid, qry, rsp = row
-            if qid not in st.session_state.chat_histories:
-                st.session_state.chat_histories[qid] = []
-            if "【辅导】" in qry:
-                st.session_state.chat_histories[qid].append({"role": "user", "content": qry.replace("【辅导】", "")})
-                st.session_state.chat_histories[qid].append({"role": "assistant", "content": rsp})
+
+def load_chat_history(qid: int, older: bool = False):
+    """按题目按需加载辅导记录：只取【辅导】行、按 id 倒序取最近一页，older=True 时从游标处继续向前翻页。"""
+    histories = st.session_state.chat_histories
+    cursors = st.session_state.chat_history_cursors
+    lru = st.session_state.chat_history_lru
+    if qid in lru:
+        lru.remove(qid)
+    lru.append(qid)
+    while len(lru) > AppConfig.CHAT_HISTORY_MAX_QUESTIONS:
+        evicted = lru.pop(0)
+        histories.pop(evicted, None)
+        cursors.pop(evicted, None)
+        st.session_state.chat_summaries.pop(evicted, None)
+    if qid in histories and not older:
+        return
+    before = cursors.get(qid) if older else None
+    if older and before is None:
+        return
+    sql = "SELECT id, user_query, ai_response FROM interaction_logs WHERE student_id = :u AND kind = 'tutoring' AND qid = :q"
+    if before is not None:
+        sql += " AND id < :before"
+    sql += " ORDER BY id DESC LIMIT :n"
+    try:
+        with unit_of_work(get_database_engine()) as conn:
+            rows = conn.execute(text(sql), {"u": st.session_state.current_user, "q": qid, "before": before,
+                                            "n": AppConfig.CHAT_HISTORY_PAGE}).fetchall()
+    except Exception as e:
+        logging.error(f"Load chat history error: {e}")
+        rows = []
+    turns = []
+    for _, qry, rsp in reversed(rows):
+        turns.append({"role": "user", "content": qry.replace("【辅导】", "", 1)})
+        turns.append({"role": "assistant", "content": rsp})
+    histories[qid] = turns + histories.get(qid, []) if older else turns
+    cursors[qid] = rows[-1][0] if len(rows) == AppConfig.CHAT_HISTORY_PAGE else None
 
 
 def start_experiment_session(course_name: str):
-    engine = get_database_engine()
-    with engine.connect() as conn:
-        res = conn.execute(text(
-            "SELECT id, category, content, answer, solution FROM custom_questions WHERE category = :c ORDER BY RAND() LIMIT 10"),
-                           {"c": course_name}).fetchall()
-        course_questions = [
-            {"id": 1000 + r[0], "category": r[1], "content": r[2], "answer": r[3] or "", "solution": r[4] or ""} for r
-            in res]
-
-    if not course_questions:
-        st.toast("题库内目前无该课程对应题目", icon="⚠️")
-        return
+    with unit_of_work(get_database_engine()) as conn:
+        course_questions = get_question_bank().sample(course_name, 10)
+
+        if not course_questions:
+            st.toast("题库内目前无该课程对应题目", icon="⚠️")
+            return
 
-    q_ids = ",".join([str(q['id']) for q in course_questions])
-    with engine.connect() as conn:
+        q_ids = ",".join([str(q['id']) for q in course_questions])
+        get_draft_store().clear(st.session_state.current_user)
         conn.execute(text("UPDATE users SET current_quiz_ids = :ids WHERE username = :u"),
                      {"ids": q_ids, "u": st.session_state.current_user})
         ts = datetime.now(pytz.timezone('Asia/Shanghai'))
@@ -169,7 +414,6 @@ def start_experiment_session(course_name: str):
             text("INSERT INTO study_sessions (username, course_name, start_time) VALUES (:u, :c, :t)"),
             {"u": st.session_state.current_user, "c": course_name, "t": ts})
         st.session_state.study_session_id = res_insert.lastrowid
-        conn.commit()
 
     st.session_state.current_course = course_name
     st.session_state.quiz_queue = course_questions
@@ -178,60 +422,115 @@ def start_experiment_session(course_name: str):
     st.session_state.assessment_results = []
     st.session_state.review_question_index = None
     st.session_state.chat_histories = {}
+    st.session_state.chat_history_cursors = {}
+    st.session_state.chat_history_lru = []
+    st.session_state.chat_summaries = {}
     st.session_state.page_mode = "quiz"
     st.rerun()
 
 
-async def async_assess_single(q: dict, ans: str) -> bool:
-    std_ans = q.get("answer", "")
-    std_sol = q.get("solution", "")
-    if std_ans or std_sol:
-        prompt = f"题目：{q['content']}\n标准答案：{std_ans}\n标准解析：{std_sol}\n学生答案：{ans}\n任务：请严格对照标准答案判断学生是否正确。正确输出PASS，错误输出FAIL。"
-    else:
-        prompt = f"题目：{q['content']}\n学生答案：{ans}\n任务：判断是否正确。正确输出PASS，错误输出FAIL。"
+async def async_assess_single(runtime: LLMRuntime, q: dict, ans: str) -> bool:
+    resp = await runtime.chat("judge", course=q.get("category"), prompt_version=JUDGE_PROMPT_VERSION, qid=q["id"],
+                              model="deepseek-chat", messages=judge_messages(q, ans))
+    res_text = resp.choices[0].message.content.strip()
+    return "PASS" in res_text and "FAIL" not in res_text
+
+
+async def async_assess_many(runtime: LLMRuntime, items: List[tuple]) -> str:
+    resp = await runtime.chat("judge_batch", course=items[0][0].get("category") if items else None,
+                              prompt_version=JUDGE_PROMPT_VERSION, model="deepseek-chat",
+                              messages=batch_judge_messages(items), response_format={"type": "json_object"})
+    return resp.choices[0].message.content
+
+
+def batch_assess(queue: list, answers: dict) -> list:
+    """本地预判与缓存查询在脚本线程完成，只有需要调用大模型的题目投递到后台运行时。"""
+    items = [(q, answers.get(i, "未作答")) for i, q in enumerate(queue)]
+    prejudge = get_prejudge()
+    results = {}
+    for i, (q, ans) in enumerate(items):
+        if q.get("answer"):
+            local = prejudge.judge(q, ans)
+            if local:
+                results[i] = local
+    remaining = [i for i in range(len(items)) if i not in results]
+    cache = get_verdict_cache()
+    cached = cache.get_many([items[i] for i in remaining])
+    results.update({remaining[j]: PASS if ok else FAIL for j, ok in cached.items()})
+    misses = [i for i in remaining if i not in results]
+    runtime = get_llm_runtime()
+    # 交卷批改不随重跑中断：判完的结果写入判题缓存，学生重新提交时直接命中
+    verdicts, paper_stats = runtime.run(get_grading_engine().grade_paper(
+        partial(async_assess_single, runtime), [items[i] for i in misses],
+        judge_batch=partial(async_assess_many, runtime), batch_size=AppConfig.JUDGE_BATCH_SIZE))
+    st.session_state.last_grading_stats = paper_stats
+    cache.put_many([(items[i][0], items[i][1], v == PASS) for i, v in zip(misses, verdicts) if v != UNGRADED])
+    results.update(zip(misses, verdicts))
+    return [results[i] for i in range(len(items))]
+
+
+def record_assessment(q: dict, ans: str, verdict: str) -> dict:
+    is_correct = None if verdict == UNGRADED else verdict == PASS
+    log_interaction(q["id"], f"【答案提交】{ans}", VERDICT_LABELS[verdict], kind="submission", is_correct=is_correct)
+    return {"question_data": q, "user_answer": ans, "verdict": verdict, "is_correct": is_correct}
+
+
+def record_rollup_submissions(conn, queue: list, verdicts: list):
     try:
-        resp = await aclient.chat.completions.create(
-            model="deepseek-chat",
-            messages=[{"role": "system", "content": JUDGE_PROMPT_SYSTEM}, {"role": "user", "content": prompt}]
-        )
-        res_text = resp.choices[0].message.content.strip()
-        return "PASS" in res_text and "FAIL" not in res_text
+        analytics.record_submissions(conn, [(q.get("category") or st.session_state.current_course, q["id"], v == PASS)
+                                            for q, v in zip(queue, verdicts) if v != UNGRADED])
     except Exception as e:
-        logging.error(f"Async assess error: {e}")
-        return False
-
-
-async def batch_assess(queue: list, answers: dict) -> list:
-    tasks = [async_assess_single(q, answers.get(i, "未作答")) for i, q in enumerate(queue)]
-    return await asyncio.gather(*tasks)
+        logging.error(f"Rollup submissions error: {e}")
 
 
 def submit_and_assess():
     st.session_state.assessment_results = []
     with st.spinner("AI 并发极速批改试卷中..."):
-        results = asyncio.run(batch_assess(st.session_state.quiz_queue, st.session_state.user_answers))
+        results = batch_assess(st.session_state.quiz_queue, st.session_state.user_answers)
 
-    for i, (q, is_ok) in enumerate(zip(st.session_state.quiz_queue, results)):
+    for i, (q, verdict) in enumerate(zip(st.session_state.quiz_queue, results)):
         ans = st.session_state.user_answers.get(i, "未作答")
-        st.session_state.assessment_results.append({"question_data": q, "user_answer": ans, "is_correct": is_ok})
-        log_interaction(q["id"], f"【答案提交】{ans}", "正确" if is_ok else "错误")
+        st.session_state.assessment_results.append(record_assessment(q, ans, verdict))
 
-    if st.session_state.study_session_id:
-        engine = get_database_engine()
-        with engine.connect() as conn:
+    # 批改（大模型调用）在工作单元之外完成，这里只把交卷相关的写入放进同一个事务
+    with unit_of_work(get_database_engine()) as conn:
+        record_rollup_submissions(conn, st.session_state.quiz_queue, results)
+        if st.session_state.study_session_id:
             ts = datetime.now(pytz.timezone('Asia/Shanghai'))
             conn.execute(text(
-                "UPDATE study_sessions SET end_time = :t, duration_seconds = TIMESTAMPDIFF(SECOND, start_time, :t) WHERE id = :id"),
+                f"UPDATE study_sessions SET end_time = :t, duration_seconds = {seconds_between(conn, 'start_time', ':t')} WHERE id = :id"),
                          {"t": ts, "id": st.session_state.study_session_id})
             conn.execute(text("UPDATE users SET current_quiz_ids = NULL WHERE username = :u"),
                          {"u": st.session_state.current_user})
-            conn.commit()
+            try:
+                sess = conn.execute(text("SELECT course_name, duration_seconds FROM study_sessions WHERE id = :id"),
+                                    {"id": st.session_state.study_session_id}).fetchone()
+                if sess:
+                    analytics.record_session_end(conn, sess[0], sess[1])
+            except Exception as e:
+                logging.error(f"Rollup session error: {e}")
+        get_draft_store().clear(st.session_state.current_user)
 
     st.session_state.session_count += 1
     st.session_state.page_mode = "results"
     st.rerun()
 
 
+def regrade_ungraded():
+    pending = [i for i, r in enumerate(st.session_state.assessment_results) if r.get("verdict") == UNGRADED]
+    queue = [st.session_state.assessment_results[i]["question_data"] for i in pending]
+    answers = {j: st.session_state.assessment_results[i]["user_answer"] for j, i in enumerate(pending)}
+    with st.spinner("正在重新批改未判定的题目..."):
+        results = batch_assess(queue, answers)
+    for i, verdict in zip(pending, results):
+        if verdict != UNGRADED:
+            r = st.session_state.assessment_results[i]
+            st.session_state.assessment_results[i] = record_assessment(r["question_data"], r["user_answer"], verdict)
+    with unit_of_work(get_database_engine()) as conn:
+        record_rollup_submissions(conn, queue, results)
+    st.rerun()
+
+
 st.set_page_config(page_title="基于LLM的可控解题提示生成系统", layout="wide")
 
 if not st.session_state.logged_in:
@@ -245,8 +544,13 @@ if not st.session_state.logged_in:
                 p_in = st.text_input("密码", type="password")
                 submitted = st.form_submit_button("进入系统", type="primary", use_container_width=True)
                 if submitted:
-                    is_auth, role = authenticate_user(u_in.strip(), p_in.strip())
-                    if is_auth:
+                    # 密码校验在哈希线程池中排队，期间不占用数据库连接；通过后再恢复未完成的测验
+                    try:
+                        role = authenticate_user(u_in.strip(), p_in.strip())
+                        login_error = "账号或密码错误"
+                    except auth.LoginUnavailable as e:
+                        role, login_error = None, str(e)
+                    if role:
                         st.session_state.logged_in = True
                         st.session_state.current_user = u_in.strip()
                         st.session_state.user_role = role
@@ -257,7 +561,7 @@ if not st.session_state.logged_in:
                             sync_user_data(u_in.strip())
                         st.rerun()
                     else:
-                        st.error("账号或密码错误")
+                        st.error(login_error)
         with tab_r:
             with st.form("register_form"):
                 ru = st.text_input("新学号")
@@ -265,10 +569,13 @@ if not st.session_state.logged_in:
                 rp2 = st.text_input("确认密码", type="password")
                 reg_submitted = st.form_submit_button("立即注册", type="primary", use_container_width=True)
                 if reg_submitted:
-                    if ru.strip() and rp.strip() == rp2.strip() and register_user(ru.strip(), rp.strip()):
-                        st.toast("注册成功！请切换到登录页面。", icon="✅")
-                    else:
-                        st.error("注册失败（学号已被占用或密码不一致）。")
+                    try:
+                        if ru.strip() and rp.strip() == rp2.strip() and register_user(ru.strip(), rp.strip()):
+                            st.toast("注册成功！请切换到登录页面。", icon="✅")
+                        else:
+                            st.error("注册失败（学号已被占用或密码不一致）。")
+                    except auth.LoginUnavailable as e:
+                        st.error(str(e))
     st.stop()
 
 with st.sidebar:
@@ -277,11 +584,10 @@ with st.sidebar:
     if st.session_state.user_role == 'student':
         if st.session_state.page_mode != "home":
             if st.button("🏠 返回大厅"):
-                engine = get_database_engine()
-                with engine.connect() as conn:
+                with unit_of_work(get_database_engine()) as conn:
+                    get_draft_store().clear(st.session_state.current_user)
                     conn.execute(text("UPDATE users SET current_quiz_ids = NULL WHERE username = :u"),
                                  {"u": st.session_state.current_user})
-                    conn.commit()
                 st.session_state.page_mode = "home"
                 st.rerun()
         if st.session_state.page_mode != "report":
@@ -289,174 +595,195 @@ with st.sidebar:
                 st.session_state.page_mode = "report"
                 st.rerun()
     if st.button("🚪 退出登录"):
+        get_draft_store().flush(st.session_state.current_user)
         for k in list(st.session_state.keys()): del st.session_state[k]
         st.rerun()
 
 if st.session_state.page_mode == "admin" and st.session_state.user_role == "admin":
     st.markdown("<h1>👨‍💻 教务管理看板与控制台</h1>", unsafe_allow_html=True)
-    tab0, tab1, tab2, tab3, tab4, tab5 = st.tabs(
-        ["📊 可视化数据大屏", "🕒 登录日志", "⏱️ 学习时长追踪", "💬 AI辅导监控", "🛠️ 课程与题库管理",
-         "⚙️ 智能辅导大模型设置"])
+    # 用单选代替 st.tabs：st.tabs 每次重跑都会执行所有标签页，这里只执行当前选中的板块
+    admin_section = st.radio("管理板块", ["📊 可视化数据大屏", "🕒 登录日志", "⏱️ 学习时长追踪", "💬 AI辅导监控",
+                                       "📈 大模型调用监控", "🛠️ 课程与题库管理", "⚙️ 智能辅导大模型设置"],
+                             horizontal=True, label_visibility="collapsed", key="admin_section")
     engine = get_database_engine()
-    with engine.connect() as conn:
-        with tab0:
-            st.subheader("🎓 全系统学情实时监控看板")
-            st.markdown("---")
-            st.markdown("#### 🕒 最近7天系统活跃人数趋势")
-            try:
-                sql_active = text(
-                    "SELECT DATE(login_time) as login_date, COUNT(DISTINCT username) as user_count FROM login_logs WHERE login_time >= DATE_SUB(CURDATE(), INTERVAL 7 DAY) GROUP BY login_date ORDER BY login_date;")
-                df_active = pd.read_sql(sql_active, conn)
-                if not df_active.empty:
-                    df_active['login_date'] = pd.to_datetime(df_active['login_date'])
-                    st.line_chart(df_active, x='login_date', y='user_count', use_container_width=True)
-            except Exception as e:
-                logging.error(f"Dashboard Active Users Error: {e}")
+    if admin_section == "📊 可视化数据大屏":
+        st.subheader("🎓 全系统学情实时监控看板")
+        try:
+            df_active, df_duration, df_accuracy = load_dashboard_frames()
+        except Exception as e:
+            logging.error(f"Dashboard load error: {e}")
+            st.error(f"⚠️ 看板数据加载报错: {e}")
+            st.stop()
+        st.caption(f"数据每 {AppConfig.ADMIN_CACHE_TTL} 秒刷新一次")
+        st.markdown("---")
+        st.markdown("#### 🕒 最近7天系统活跃人数趋势")
+        try:
+            if not df_active.empty:
+                df_active['login_date'] = pd.to_datetime(df_active['login_date'])
+                st.line_chart(df_active, x='login_date', y='user_count', use_container_width=True)
+        except Exception as e:
+            logging.error(f"Dashboard Active Users Error: {e}")
 
-            st.markdown("---")
-            st.markdown("#### 📘 各科课程学习时长占比")
-            col_chart1, col_data1 = st.columns([2, 1])
-            try:
-                sql_duration = text(
-                    "SELECT course_name, SUM(duration_seconds) as total_seconds FROM study_sessions WHERE duration_seconds IS NOT NULL GROUP BY course_name;")
-                df_duration = pd.read_sql(sql_duration, conn)
-                if not df_duration.empty:
-                    df_duration['total_minutes'] = (df_duration['total_seconds'] / 60).round(1)
-                    fig_pie = px.pie(df_duration, values='total_minutes', names='course_name', hole=0.4,
-                                     color_discrete_sequence=px.colors.qualitative.Pastel)
-                    fig_pie.update_traces(textposition='inside', textinfo='percent+label')
-                    with col_chart1:
-                        st.plotly_chart(fig_pie, use_container_width=True)
-                    with col_data1:
-                        st.markdown("<div style='margin-top: 100px;'></div>", unsafe_allow_html=True)
-                        st.dataframe(df_duration[['course_name', 'total_minutes']], hide_index=True)
-            except Exception as e:
-                logging.error(f"Dashboard Duration Error: {e}")
+        st.markdown("---")
+        st.markdown("#### 📘 各科课程学习时长占比")
+        col_chart1, col_data1 = st.columns([2, 1])
+        try:
+            if not df_duration.empty:
+                df_duration['total_minutes'] = (df_duration['total_seconds'] / 60).round(1)
+                fig_pie = px.pie(df_duration, values='total_minutes', names='course_name', hole=0.4,
+                                 color_discrete_sequence=px.colors.qualitative.Pastel)
+                fig_pie.update_traces(textposition='inside', textinfo='percent+label')
+                with col_chart1:
+                    st.plotly_chart(fig_pie, use_container_width=True)
+                with col_data1:
+                    st.markdown("<div style='margin-top: 100px;'></div>", unsafe_allow_html=True)
+                    st.dataframe(df_duration[['course_name', 'total_minutes']], hide_index=True)
+        except Exception as e:
+            logging.error(f"Dashboard Duration Error: {e}")
 
-            st.markdown("---")
-            st.markdown("#### ✅ 全系统题目平均正确率统计")
-            try:
-                df_interact_raw = pd.read_sql(
-                    "SELECT question_id, ai_response FROM interaction_logs WHERE user_query LIKE '【答案提交】%%'", conn)
-                if not df_interact_raw.empty:
-                    q_df = pd.read_sql("SELECT id, category FROM custom_questions", conn)
-                    q_id_map = {str(1000 + int(row['id'])): str(row['category']) for _, row in q_df.iterrows()}
-                    df_interact_raw['clean_id'] = pd.to_numeric(df_interact_raw['question_id'], errors='coerce').fillna(
-                        -1).astype(int).astype(str)
-                    df_interact_raw['course_name'] = df_interact_raw['clean_id'].map(q_id_map)
-                    df_valid = df_interact_raw.dropna(subset=['course_name']).copy()
-                    if not df_valid.empty:
-                        df_valid['is_correct'] = df_valid['ai_response'].apply(
-                            lambda x: 1 if ('正确' in str(x) or 'PASS' in str(x)) else 0)
-                        df_accuracy = df_valid.groupby('course_name')['is_correct'].mean().reset_index()
-                        df_accuracy['accuracy_percent'] = (df_accuracy['is_correct'] * 100).round(1)
-                        fig_bar = px.bar(df_accuracy, x='course_name', y='accuracy_percent',
-                                         labels={'course_name': '课程名称', 'accuracy_percent': '正确率 (%)'},
-                                         color_discrete_sequence=['#1f77b4'])
-                        if len(df_accuracy) == 1:
-                            fig_bar.update_traces(width=0.2)
-                        st.plotly_chart(fig_bar, use_container_width=True)
-                    else:
-                        st.warning("⚠️ 无法生成图表：题号映射失败！")
-                else:
-                    st.info("暂无答题提交数据，无法计算正确率。")
-            except Exception as e:
-                st.error(f"⚠️ 图表加载报错: {e}")
-
-        with tab1:
-            st.subheader("学生活跃度监控")
-            df_login = pd.read_sql(
-                "SELECT username AS '学号', login_time AS '登录时间' FROM login_logs ORDER BY login_time DESC LIMIT 50",
-                conn)
-            st.dataframe(df_login, use_container_width=True)
-            if not df_login.empty:
-                st.download_button("📥 导出登录日志 (CSV)", df_login.to_csv(index=False).encode('utf-8-sig'),
-                                   "login_logs.csv", "text/csv", use_container_width=True)
-
-        with tab2:
-            st.subheader("各科课程学习时长分析")
-            df_study = pd.read_sql(
-                "SELECT username AS '学号', course_name AS '课程', start_time AS '开始时间', end_time AS '结束时间', duration_seconds AS '学习时长(秒)' FROM study_sessions ORDER BY start_time DESC LIMIT 50",
-                conn)
-            st.dataframe(df_study, use_container_width=True)
-            if not df_study.empty:
-                st.download_button("📥 导出学习时长记录 (CSV)", df_study.to_csv(index=False).encode('utf-8-sig'),
-                                   "study_sessions.csv", "text/csv", use_container_width=True)
-
-        with tab3:
-            st.subheader("大模型交互质量抽查")
-            df_chat = pd.read_sql(
-                "SELECT student_id AS '学号', question_id AS '题号', user_query AS '学生提问', ai_response AS '系统反馈', created_at AS '交互时间' FROM interaction_logs ORDER BY created_at DESC LIMIT 50",
-                conn)
-            st.dataframe(df_chat, use_container_width=True)
-            if not df_chat.empty:
-                st.download_button("📥 导出AI辅导监控记录 (CSV)", df_chat.to_csv(index=False).encode('utf-8-sig'),
-                                   "ai_interaction_logs.csv", "text/csv", use_container_width=True)
-
-        with tab4:
-            st.subheader("📚 课程管理")
-            t_c_add, t_c_del, t_c_edit, t_c_view = st.tabs(
-                ["➕ 录入新课程", "🗑️ 删除自定义课程", "✏️ 修改自定义课程", "👀 预览自定义课程"])
-            with t_c_add:
-                with st.form("add_course_form"):
-                    new_c_name = st.text_input("新课程名称")
-                    new_c_desc = st.text_input("课程简介描述")
-                    if st.form_submit_button("确认添加", type="primary", use_container_width=True):
-                        if new_c_name and new_c_desc:
-                            try:
+        st.markdown("---")
+        st.markdown("#### ✅ 全系统题目平均正确率统计")
+        try:
+            if not df_accuracy.empty:
+                df_accuracy['accuracy_percent'] = (df_accuracy['is_correct'].astype(float) * 100).round(1)
+                fig_bar = px.bar(df_accuracy, x='course_name', y='accuracy_percent',
+                                 labels={'course_name': '课程名称', 'accuracy_percent': '正确率 (%)'},
+                                 color_discrete_sequence=['#1f77b4'])
+                if len(df_accuracy) == 1:
+                    fig_bar.update_traces(width=0.2)
+                st.plotly_chart(fig_bar, use_container_width=True)
+            else:
+                st.info("暂无答题提交数据，无法计算正确率。")
+        except Exception as e:
+            st.error(f"⚠️ 图表加载报错: {e}")
+
+    elif admin_section == "🕒 登录日志":
+        st.subheader("学生活跃度监控")
+        df_login = load_recent_rows(
+            "SELECT username AS '学号', login_time AS '登录时间' FROM login_logs ORDER BY login_time DESC LIMIT 50")
+        st.dataframe(df_login, use_container_width=True)
+        if not df_login.empty:
+            st.download_button("📥 导出登录日志 (CSV)", df_login.to_csv(index=False).encode('utf-8-sig'),
+                               "login_logs.csv", "text/csv", use_container_width=True)
+
+    elif admin_section == "⏱️ 学习时长追踪":
+        st.subheader("各科课程学习时长分析")
+        df_study = load_recent_rows(
+            "SELECT username AS '学号', course_name AS '课程', start_time AS '开始时间', end_time AS '结束时间', duration_seconds AS '学习时长(秒)' FROM study_sessions ORDER BY start_time DESC LIMIT 50")
+        st.dataframe(df_study, use_container_width=True)
+        if not df_study.empty:
+            st.download_button("📥 导出学习时长记录 (CSV)", df_study.to_csv(index=False).encode('utf-8-sig'),
+                               "study_sessions.csv", "text/csv", use_container_width=True)
+
+    elif admin_section == "💬 AI辅导监控":
+        st.subheader("大模型交互质量抽查")
+        df_chat = load_recent_rows(
+            "SELECT student_id AS '学号', question_id AS '题号', user_query AS '学生提问', ai_response AS '系统反馈', created_at AS '交互时间' FROM interaction_logs ORDER BY created_at DESC LIMIT 50")
+        st.dataframe(df_chat, use_container_width=True)
+        if not df_chat.empty:
+            st.download_button("📥 导出AI辅导监控记录 (CSV)", df_chat.to_csv(index=False).encode('utf-8-sig'),
+                               "ai_interaction_logs.csv", "text/csv", use_container_width=True)
+
+    elif admin_section == "📈 大模型调用监控":
+        st.subheader("大模型调用延迟与用量")
+        hours = st.select_slider("统计时间范围（小时）", options=[1, 6, 24, 72, 168], value=24, key="llm_metrics_hours")
+        live = get_telemetry().summary()
+        if live:
+            st.caption("本进程最近调用（实时）：" + "，".join(
+                f"{k} {v['calls']} 次 p50 {v['p50']}ms / p95 {v['p95']}ms / p99 {v['p99']}ms，错误 {v['errors']}"
+                for k, v in live.items()))
+        try:
+            df_calls = load_llm_metrics(hours)
+        except Exception as e:
+            logging.error(f"LLM metrics load error: {e}")
+            st.error(f"⚠️ 调用指标加载报错: {e}")
+            st.stop()
+        st.caption(f"数据每 {AppConfig.ADMIN_CACHE_TTL} 秒刷新一次")
+        if df_calls.empty:
+            st.info("该时间范围内暂无大模型调用记录。")
+        else:
+            st.dataframe(kind_summary(df_calls), hide_index=True, use_container_width=True)
+            freq = "1min" if hours <= 1 else "5min" if hours <= 6 else "30min" if hours <= 24 else "2h"
+            for kind in sorted(df_calls["kind"].unique()):
+                df_kind = df_calls[df_calls["kind"] == kind]
+                st.markdown(f"#### {kind}：总延迟分位数 (ms)")
+                st.line_chart(latency_percentiles(df_kind, "latency_ms", freq), use_container_width=True)
+                if df_kind["ttft_ms"].notna().any():
+                    st.markdown(f"#### {kind}：首字延迟分位数 (ms)")
+                    st.line_chart(latency_percentiles(df_kind, "ttft_ms", freq), use_container_width=True)
+            df_errors = df_calls[df_calls["error"].notna()]
+            if not df_errors.empty:
+                st.markdown("#### ❌ 调用错误分布")
+                st.dataframe(df_errors.groupby(["kind", "error"]).size().rename("次数").reset_index(),
+                             hide_index=True, use_container_width=True)
+
+    elif admin_section == "🛠️ 课程与题库管理":
+        try:
+            custom_courses = load_custom_courses()
+        except Exception as e:
+            logging.error(f"Load courses error: {e}")
+            custom_courses = []
+        custom_c_names = [c[0] for c in custom_courses]
+
+        st.subheader("📚 课程管理")
+        c_action = st.radio("课程操作", ["➕ 录入新课程", "🗑️ 删除自定义课程", "✏️ 修改自定义课程", "👀 预览自定义课程"],
+                            horizontal=True, label_visibility="collapsed", key="admin_course_action")
+        if c_action == "➕ 录入新课程":
+            with st.form("add_course_form"):
+                new_c_name = st.text_input("新课程名称")
+                new_c_desc = st.text_input("课程简介描述")
+                if st.form_submit_button("确认添加", type="primary", use_container_width=True):
+                    if new_c_name and new_c_desc:
+                        try:
+                            with engine.connect() as conn:
                                 conn.execute(
                                     text("INSERT INTO custom_courses (course_name, description) VALUES (:n, :d)"),
                                     {"n": new_c_name, "d": new_c_desc})
                                 conn.commit()
-                                st.toast(f"课程《{new_c_name}》添加成功！", icon="✅")
-                                time.sleep(0.5)
-                                st.rerun()
-                            except Exception as e:
-                                st.toast(f"添加失败: {e}", icon="❌")
-                        else:
-                            st.toast("请填写完整的课程信息！", icon="⚠️")
-
-            with t_c_del:
-                with st.form("delete_course_form"):
-                    try:
-                        del_c_list = [r[0] for r in
-                                      conn.execute(text("SELECT course_name FROM custom_courses")).fetchall()]
-                    except Exception as e:
-                        logging.error(f"Delete course load error: {e}")
-                        del_c_list = []
-                    if del_c_list:
-                        del_c_name = st.selectbox("选择要下架的课程", del_c_list)
-                        if st.form_submit_button("确认删除 (将同步删除下属题目)", type="primary",
-                                                 use_container_width=True):
-                            conn.execute(text("DELETE FROM custom_courses WHERE course_name = :c"), {"c": del_c_name})
-                            conn.execute(text("DELETE FROM custom_questions WHERE category = :c"), {"c": del_c_name})
-                            conn.commit()
-                            st.toast(f"已彻底删除课程《{del_c_name}》！", icon="✅")
+                            clear_admin_caches()
+                            st.toast(f"课程《{new_c_name}》添加成功！", icon="✅")
                             time.sleep(0.5)
                             st.rerun()
+                        except Exception as e:
+                            st.toast(f"添加失败: {e}", icon="❌")
                     else:
-                        st.info("暂无自定义课程可以删除。")
-                        st.form_submit_button("确认删除", disabled=True, use_container_width=True)
-
-            with t_c_edit:
-                try:
-                    edit_c_options = {r[0]: r for r in conn.execute(
-                        text("SELECT course_name, description FROM custom_courses")).fetchall()}
-                except Exception as e:
-                    logging.error(f"Edit course load error: {e}")
-                    edit_c_options = {}
-
-                if edit_c_options:
-                    edit_c_choice = st.selectbox("👇 第一步：选择需要修改的课程", list(edit_c_options.keys()),
-                                                 key="edit_c_select")
-                    selected_c_name, selected_c_desc = edit_c_options[edit_c_choice]
-                    with st.form("edit_course_form"):
-                        st.write("👇 第二步：在下方直接编辑并保存")
-                        updated_c_name = st.text_input("修改课程名称", value=selected_c_name)
-                        updated_c_desc = st.text_input("修改课程简介描述", value=selected_c_desc)
-                        if st.form_submit_button("💾 保存修改", type="primary", use_container_width=True):
-                            if updated_c_name.strip() and updated_c_desc.strip():
-                                try:
+                        st.toast("请填写完整的课程信息！", icon="⚠️")
+
+        elif c_action == "🗑️ 删除自定义课程":
+            with st.form("delete_course_form"):
+                if custom_c_names:
+                    del_c_name = st.selectbox("选择要下架的课程", custom_c_names)
+                    if st.form_submit_button("确认删除 (将同步删除下属题目)", type="primary",
+                                             use_container_width=True):
+                        with engine.connect() as conn:
+                            conn.execute(text("DELETE FROM custom_courses WHERE course_name = :c"), {"c": del_c_name})
+                            conn.execute(text("DELETE FROM custom_questions WHERE category = :c"), {"c": del_c_name})
+                            analytics.drop_course(conn, del_c_name)
+                            conn.commit()
+                        get_question_index().invalidate_course(del_c_name)
+                        get_search_index().load()
+                        clear_admin_caches()
+                        st.toast(f"已彻底删除课程《{del_c_name}》！", icon="✅")
+                        time.sleep(0.5)
+                        st.rerun()
+                else:
+                    st.info("暂无自定义课程可以删除。")
+                    st.form_submit_button("确认删除", disabled=True, use_container_width=True)
+
+        elif c_action == "✏️ 修改自定义课程":
+            if custom_courses:
+                edit_c_options = dict(custom_courses)
+                edit_c_choice = st.selectbox("👇 第一步：选择需要修改的课程", list(edit_c_options.keys()),
+                                             key="edit_c_select")
+                selected_c_name, selected_c_desc = edit_c_choice, edit_c_options[edit_c_choice]
+                with st.form("edit_course_form"):
+                    st.write("👇 第二步：在下方直接编辑并保存")
+                    updated_c_name = st.text_input("修改课程名称", value=selected_c_name)
+                    updated_c_desc = st.text_input("修改课程简介描述", value=selected_c_desc)
+                    if st.form_submit_button("💾 保存修改", type="primary", use_container_width=True):
+                        if updated_c_name.strip() and updated_c_desc.strip():
+                            try:
+                                with engine.connect() as conn:
                                     conn.execute(text(
                                         "UPDATE custom_courses SET course_name = :new_n, description = :new_d WHERE course_name = :old_n"),
                                                  {"new_n": updated_c_name.strip(), "new_d": updated_c_desc.strip(),
@@ -465,94 +792,102 @@ if st.session_state.page_mode == "admin" and st.session_state.user_role == "admi
                                         conn.execute(text(
                                             "UPDATE custom_questions SET category = :new_n WHERE category = :old_n"),
                                                      {"new_n": updated_c_name.strip(), "old_n": selected_c_name})
+                                        analytics.rename_course(conn, selected_c_name, updated_c_name.strip())
                                     conn.commit()
-                                    st.toast("课程修改成功！", icon="✅")
-                                    time.sleep(0.5)
-                                    st.rerun()
-                                except Exception as e:
-                                    st.toast(f"修改失败: {e}", icon="❌")
-                            else:
-                                st.toast("课程名称和描述不能为空！", icon="⚠️")
-                else:
-                    st.info("暂无自定义课程可以修改。")
-
-            with t_c_view:
-                try:
-                    df_custom_c = pd.read_sql(
-                        "SELECT course_name AS '课程名称', description AS '课程简介描述' FROM custom_courses", conn)
-                    if not df_custom_c.empty:
-                        st.dataframe(df_custom_c, use_container_width=True)
-                    else:
-                        st.info("当前云端数据库中暂无任何自定义课程。")
-                except Exception as e:
-                    st.warning(f"读取课程失败: {e}")
-
-            st.divider()
-            st.subheader("📝 题库管理")
-            hardcoded_c = ["高等数学", "线性代数", "概率统计", "C语言"]
-            try:
-                all_c = hardcoded_c + [r[0] for r in
-                                       conn.execute(text("SELECT course_name FROM custom_courses")).fetchall()]
-            except Exception as e:
-                logging.error(f"Load courses for questions error: {e}")
-                all_c = hardcoded_c
-
-            t_add, t_del, t_edit, t_view = st.tabs(
-                ["➕ 录入新题目", "🗑️ 删除自定义题目", "✏️ 修改自定义题目", "👀 预览自定义题库"])
-
-            with t_add:
-                with st.form("add_question_form"):
-                    q_category = st.selectbox("选择所属课程", all_c)
-                    q_content = st.text_area("输入题目内容 (支持 LaTeX 格式)")
-                    if st.form_submit_button("确认录入题目", type="primary", use_container_width=True):
-                        if q_category and q_content:
-                            try:
-                                conn.execute(text("INSERT INTO custom_questions (category, content) VALUES (:c, :t)"),
-                                             {"c": q_category, "t": q_content})
-                                conn.commit()
-                                st.toast("题目添加成功！", icon="✅")
+                                get_question_index().invalidate_course(selected_c_name)
+                                get_question_index().invalidate_course(updated_c_name.strip())
+                                if updated_c_name.strip() != selected_c_name:
+                                    get_search_index().load()
+                                clear_admin_caches()
+                                st.toast("课程修改成功！", icon="✅")
                                 time.sleep(0.5)
                                 st.rerun()
                             except Exception as e:
-                                st.toast(f"题目添加失败: {e}", icon="❌")
+                                st.toast(f"修改失败: {e}", icon="❌")
                         else:
-                            st.toast("请填写完整的题目内容！", icon="⚠️")
+                            st.toast("课程名称和描述不能为空！", icon="⚠️")
+            else:
+                st.info("暂无自定义课程可以修改。")
 
-            with t_del:
-                with st.form("delete_question_form"):
-                    try:
-                        del_q_options = {f"[{r[1]}] {r[2]}... (内部ID:{r[0]})": r[0] for r in conn.execute(
-                            text("SELECT id, category, LEFT(content, 15) FROM custom_questions")).fetchall()}
-                    except Exception as e:
-                        logging.error(f"Load questions for delete error: {e}")
-                        del_q_options = {}
+        else:
+            if custom_courses:
+                st.dataframe(pd.DataFrame(custom_courses, columns=["课程名称", "课程简介描述"]),
+                             use_container_width=True)
+            else:
+                st.info("当前云端数据库中暂无任何自定义课程。")
+
+        st.divider()
+        st.subheader("📝 题库管理")
+        all_c = get_question_bank().static_courses + custom_c_names
+
+        q_action = st.radio("题目操作", ["➕ 录入新题目", "🗑️ 删除自定义题目", "✏️ 修改自定义题目", "👀 预览自定义题库",
+                                         "📦 批量导入导出"],
+                            horizontal=True, label_visibility="collapsed", key="admin_question_action")
+        if q_action == "➕ 录入新题目":
+            with st.form("add_question_form"):
+                q_category = st.selectbox("选择所属课程", all_c)
+                q_content = st.text_area("输入题目内容 (支持 LaTeX 格式)")
+                if st.form_submit_button("确认录入题目", type="primary", use_container_width=True):
+                    if q_category and q_content:
+                        try:
+                            with engine.connect() as conn:
+                                res = conn.execute(text(
+                                    "INSERT INTO custom_questions (category, content, dedupe_hash) VALUES (:c, :t, :h)"),
+                                    {"c": q_category, "t": q_content, "h": question_io.dedupe_key(q_category, q_content)})
+                                conn.commit()
+                            get_question_index().invalidate_course(q_category)
+                            invalidate_question_caches(CUSTOM_ID_OFFSET + res.lastrowid)
+                            clear_admin_caches()
+                            st.toast("题目添加成功！", icon="✅")
+                            time.sleep(0.5)
+                            st.rerun()
+                        except Exception as e:
+                            st.toast(f"题目添加失败: {e}", icon="❌")
+                    else:
+                        st.toast("请填写完整的题目内容！", icon="⚠️")
+
+        elif q_action in ("🗑️ 删除自定义题目", "✏️ 修改自定义题目"):
+            # 输入关键词时走全文索引，否则先选课程再选题目：下拉框只按课程加载题号和标签
+            q_search = st.text_input("🔎 搜索题目（支持中文、LaTeX 命令如 \\iint、英文前缀）", key="admin_q_search")
+            if q_search.strip():
+                ix = get_search_index()
+                q_labels = {qid - CUSTOM_ID_OFFSET: f"{ix.label(qid)} (内部ID:{qid - CUSTOM_ID_OFFSET})"
+                            for qid, _ in ix.search(q_search, 50, custom_only=True)}
+            else:
+                pick_c = st.selectbox("所属课程", all_c, key="admin_q_course")
+                try:
+                    q_labels = load_question_labels(pick_c)
+                except Exception as e:
+                    logging.error(f"Load question labels error: {e}")
+                    q_labels = {}
 
-                    if del_q_options:
-                        del_q_choice = st.selectbox("选择要删除的错误题目", list(del_q_options.keys()))
+            if q_action == "🗑️ 删除自定义题目":
+                with st.form("delete_question_form"):
+                    if q_labels:
+                        del_q_id = st.selectbox("选择要删除的错误题目", list(q_labels), format_func=q_labels.get)
                         if st.form_submit_button("确认删除该题", type="primary", use_container_width=True):
-                            conn.execute(text("DELETE FROM custom_questions WHERE id = :id"),
-                                         {"id": del_q_options[del_q_choice]})
-                            conn.commit()
+                            with engine.connect() as conn:
+                                conn.execute(text("DELETE FROM custom_questions WHERE id = :id"), {"id": del_q_id})
+                                analytics.drop_question(conn, CUSTOM_ID_OFFSET + del_q_id)
+                                conn.commit()
+                            invalidate_question_caches(CUSTOM_ID_OFFSET + del_q_id)
+                            clear_admin_caches()
                             st.toast("指定题目已永久删除！", icon="✅")
                             time.sleep(0.5)
                             st.rerun()
                     else:
-                        st.info("暂无自定义题目可以删除。")
+                        st.info("没有符合条件的自定义题目可以删除。")
                         st.form_submit_button("确认删除", disabled=True, use_container_width=True)
 
-            with t_edit:
-                try:
-                    edit_q_options = {f"[{r[1]}] (内部ID:{r[0]}) {r[2][:20]}...": (r[0], r[1], r[2]) for r in
-                                      conn.execute(
-                                          text("SELECT id, category, content FROM custom_questions")).fetchall()}
-                except Exception as e:
-                    logging.error(f"Load questions for edit error: {e}")
-                    edit_q_options = {}
-
-                if edit_q_options:
-                    edit_q_choice = st.selectbox("👇 第一步：选择需要修改的题目", list(edit_q_options.keys()),
-                                                 key="edit_q_select")
-                    selected_id, selected_cat, selected_content = edit_q_options[edit_q_choice]
+            elif q_labels:
+                selected_id = st.selectbox("👇 第一步：选择需要修改的题目", list(q_labels), format_func=q_labels.get,
+                                           key="edit_q_select")
+                selected_q = get_question_bank().get(CUSTOM_ID_OFFSET + selected_id)
+                if selected_q is None:
+                    st.warning("该题目已被删除，请刷新列表。")
+                    clear_admin_caches()
+                else:
+                    selected_cat, selected_content = selected_q["category"], selected_q["content"]
                     with st.form("edit_question_form"):
                         new_category = st.selectbox("修改所属课程", all_c,
                                                     index=all_c.index(selected_cat) if selected_cat in all_c else 0)
@@ -560,10 +895,18 @@ if st.session_state.page_mode == "admin" and st.session_state.user_role == "admi
                         if st.form_submit_button("💾 保存修改", type="primary", use_container_width=True):
                             if new_content.strip():
                                 try:
-                                    conn.execute(
-                                        text("UPDATE custom_questions SET category = :c, content = :t WHERE id = :id"),
-                                        {"c": new_category, "t": new_content, "id": selected_id})
-                                    conn.commit()
+                                    with engine.connect() as conn:
+                                        conn.execute(
+                                            text("UPDATE custom_questions SET category = :c, content = :t, dedupe_hash = :h WHERE id = :id"),
+                                            {"c": new_category, "t": new_content, "id": selected_id,
+                                             "h": question_io.dedupe_key(new_category, new_content)})
+                                        if new_category != selected_cat:
+                                            analytics.move_question(conn, CUSTOM_ID_OFFSET + selected_id, new_category)
+                                        conn.commit()
+                                    invalidate_question_caches(CUSTOM_ID_OFFSET + selected_id)
+                                    get_question_index().invalidate_course(selected_cat)
+                                    get_question_index().invalidate_course(new_category)
+                                    clear_admin_caches()
                                     st.toast("题目修改成功！", icon="✅")
                                     time.sleep(0.5)
                                     st.rerun()
@@ -571,48 +914,134 @@ if st.session_state.page_mode == "admin" and st.session_state.user_role == "admi
                                     st.toast(f"修改失败: {e}", icon="❌")
                             else:
                                 st.toast("题目内容不能为空！", icon="⚠️")
+            else:
+                st.info("没有符合条件的自定义题目可以修改。")
+
+        elif q_action == "👀 预览自定义题库":
+            q_page = st.number_input("页码", min_value=1, value=1, step=1, key="admin_q_page") - 1
+            try:
+                df_custom_q = load_custom_questions_page(int(q_page))
+                if not df_custom_q.empty:
+                    st.dataframe(df_custom_q, use_container_width=True)
                 else:
-                    st.info("暂无自定义题目可以修改。")
+                    st.info("当前页暂无自定义题目。" if q_page else "当前云端数据库中暂无任何自定义题目。")
+            except Exception as e:
+                st.warning(f"读取题库失败: {e}")
 
-            with t_view:
+        else:
+            st.caption("支持 CSV（表头 category,content,answer,solution）、JSONL、JSON 数组以及 questions.py 格式文件；按“课程 + 规范化题目内容”去重。")
+            up_file = st.file_uploader("上传题目文件", type=["csv", "jsonl", "json", "py"], key="import_file")
+            dry_run = st.checkbox("仅校验（不写入数据库）", value=True, key="import_dry_run")
+            if up_file is not None and st.button("🚀 开始导入", type="primary", use_container_width=True):
+                status = st.empty()
+                static_hashes = {question_io.dedupe_key(q["category"], q["content"])
+                                 for q in get_question_bank().static_records()}
                 try:
-                    df_custom_q = pd.read_sql(
-                        "SELECT id AS '内部ID', category AS '所属课程', content AS '题目完整内容' FROM custom_questions ORDER BY id DESC",
-                        conn)
-                    if not df_custom_q.empty:
-                        st.dataframe(df_custom_q, use_container_width=True)
-                    else:
-                        st.info("当前云端数据库中暂无任何自定义题目。")
+                    rows = question_io.reader_for(up_file.name)(
+                        io.TextIOWrapper(up_file, encoding="utf-8-sig", newline=""))
+                    report = question_io.import_questions(
+                        engine, rows, dry_run=dry_run, skip_hashes=static_hashes,
+                        progress=lambda r: status.info(f"⏳ 已处理 {r['read']} 行，用时 {r['elapsed']} 秒..."))
                 except Exception as e:
-                    st.warning(f"读取题库失败: {e}")
-
-        with tab5:
-            st.subheader("🧠 大模型 Prompt 注入控制台")
-            st.info("💡 在这里热更新大模型的底层性格与辅导策略！修改保存后，所有学生的 AI 辅导体验将瞬间改变。")
-            try:
-                curr_prompt_res = conn.execute(
-                    text("SELECT config_value FROM system_configs WHERE config_key = 'system_instruction'")).fetchone()
-                current_prompt = curr_prompt_res[0] if curr_prompt_res else SYSTEM_INSTRUCTION
-            except Exception as e:
-                logging.error(f"Load prompt config error: {e}")
-                current_prompt = SYSTEM_INSTRUCTION
+                    logging.error(f"Question import error: {e}")
+                    status.error(f"导入失败: {e}")
+                else:
+                    status.success(question_io.format_report(report))
+                    if report["errors"]:
+                        st.dataframe(pd.DataFrame(report["errors"], columns=["行号", "错误原因"]), hide_index=True)
+                    unknown = report["categories"] - set(all_c)
+                    if unknown:
+                        st.warning(f"以下课程尚未创建，请在课程管理中补充：{'、'.join(sorted(unknown))}")
+                    if not dry_run and report["inserted"]:
+                        for c in report["categories"]:
+                            get_question_index().invalidate_course(c)
+                        get_search_index().load()
+                        clear_admin_caches()
 
-            with st.form("prompt_update_form"):
-                new_prompt = st.text_area("🔧 当前系统底层提示词 (System Prompt)", value=current_prompt, height=250)
-                if st.form_submit_button("💾 保存并全局应用新指令", type="primary", use_container_width=True):
-                    if new_prompt.strip():
-                        try:
-                            conn.execute(text(
-                                "INSERT INTO system_configs (config_key, config_value) VALUES ('system_instruction', :val) ON DUPLICATE KEY UPDATE config_value = :val"),
-                                         {"val": new_prompt.strip()})
-                            conn.commit()
-                            st.toast("大模型底层指令已热更新！全系统生效！", icon="✅")
-                            time.sleep(0.5)
-                            st.rerun()
-                        except Exception as e:
-                            st.toast(f"更新失败: {e}", icon="❌")
-                    else:
-                        st.toast("提示词不能为空！", icon="⚠️")
+            st.divider()
+            exp_c1, exp_c2 = st.columns(2)
+            exp_course = exp_c1.selectbox("导出课程", ["全部"] + all_c, key="export_course")
+            exp_fmt = exp_c2.selectbox("导出格式", ["jsonl", "csv"], key="export_fmt")
+            if st.button("📤 生成导出文件", use_container_width=True):
+                try:
+                    exp_filter = None if exp_course == "全部" else exp_course
+                    exp_total = question_io.count_questions(engine, exp_filter)
+                    if exp_total > AppConfig.QUESTION_EXPORT_LIMIT:
+                        st.warning(f"共 {exp_total} 题，页面只导出前 {AppConfig.QUESTION_EXPORT_LIMIT} 题；"
+                                   f"完整导出请在服务器上运行 python question_io.py export 文件名。")
+                    data = "".join(question_io.iter_export(engine, exp_fmt, exp_filter,
+                                                           limit=AppConfig.QUESTION_EXPORT_LIMIT))
+                    st.download_button("📥 下载题目文件", data.encode("utf-8-sig" if exp_fmt == "csv" else "utf-8"),
+                                       f"custom_questions.{exp_fmt}", use_container_width=True)
+                except Exception as e:
+                    st.toast(f"导出失败: {e}", icon="❌")
+
+    elif admin_section == "⚙️ 智能辅导大模型设置":
+        st.subheader("🧠 大模型 Prompt 注入控制台")
+        vc_stats = get_verdict_cache().stats()
+        vc1, vc2, vc3 = st.columns(3)
+        vc1.metric("判题缓存命中率", f"{vc_stats['hit_rate'] * 100:.1f} %")
+        vc2.metric("命中次数 (内存/数据库)", f"{vc_stats['mem_hits']} / {vc_stats['db_hits']}")
+        vc3.metric("未命中次数", vc_stats['misses'])
+        pj_stats = get_prejudge().stats()
+        hc_stats = get_hint_cache().stats()
+        pj1, pj2, pj3 = st.columns(3)
+        pj1.metric("本地预判解决比例", f"{pj_stats['resolved_rate'] * 100:.1f} %")
+        pj2.metric("本地判定 (正确/错误/总数)", f"{pj_stats['local_pass']} / {pj_stats['local_fail']} / {pj_stats['total']}")
+        pj3.metric("辅导提示缓存命中率", f"{hc_stats['hit_rate'] * 100:.1f} %")
+        lw_stats = get_log_writer().stats()
+        lw1, lw2, lw3 = st.columns(3)
+        lw1.metric("日志队列深度 (峰值/容量)", f"{lw_stats['depth']} ({lw_stats['max_depth']}/{lw_stats['capacity']})")
+        lw2.metric("已落库 / 批次 / 最近耗时", f"{lw_stats['flushed']} / {lw_stats['batches']} / {lw_stats['last_flush_ms']}ms")
+        lw3.metric("落盘暂存 / 已回放 / 隔离 / 队列溢出",
+                   f"{lw_stats['spilled']} / {lw_stats['replayed']} / {lw_stats['quarantined']} / {lw_stats['overflow']}")
+        grading_summary = get_grading_engine().summary()
+        if grading_summary:
+            g1, g2, g3, g4 = st.columns(4)
+            g1.metric("整卷批改 p50 / p95", f"{grading_summary['wall_p50']:.1f}s / {grading_summary['wall_p95']:.1f}s")
+            g2.metric("整卷批改 p99", f"{grading_summary['wall_p99']:.1f}s")
+            g3.metric("进行中 / 排队中调用", f"{grading_summary['in_flight']} / {grading_summary['waiting']}")
+            g4.metric("重试 / 未判定题数", f"{grading_summary['retries']} / {grading_summary['ungraded']}")
+        st.info("💡 在这里热更新大模型的底层性格与辅导策略！修改保存后，所有学生的 AI 辅导体验将瞬间改变。")
+        config_store = get_config_store()
+        current_prompt = config_store.get("system_instruction", SYSTEM_INSTRUCTION)
+        rt_stats = get_llm_runtime().stats()
+        st.caption(f"大模型运行时：进行中任务 {rt_stats['in_flight']}，活跃流 {rt_stats['streams']}，"
+                   f"累计提交 {rt_stats['submitted']}，已取消 {rt_stats['cancelled']}")
+        if rt_stats['cache_hit_rates']:
+            st.caption("前缀缓存命中率：" + "，".join(f"{k} {v * 100:.1f}%" for k, v in rt_stats['cache_hit_rates'].items()))
+        si_stats = get_search_index().stats()
+        st.caption(f"题库检索索引：{si_stats['docs']} 题 / {si_stats['terms']} 词，平均查询 {si_stats['avg_ms']} ms")
+        db_stats = pool_stats(get_database_engine())
+        st.caption(f"数据库连接池：借出 {db_stats.get('pool_checkedout', 0)} / 容量 {db_stats.get('pool_size', 0)}"
+                   f"+{db_stats.get('pool_max_overflow', 0)}（峰值 {db_stats['peak_checked_out']}），累计借出 {db_stats['checkouts']} 次，"
+                   f"新建连接 {db_stats['connects']}，工作单元 {db_stats['units']} 个 / 复用 {db_stats['joined']} 次 / 回滚 {db_stats['rollbacks']} 次，"
+                   f"借出等待 平均 {db_stats['checkout_ms_avg']} ms / 最大 {db_stats['checkout_ms_max']} ms，超时 {db_stats['timeouts']} 次")
+        pw_stats = get_password_hasher().stats()
+        lt_stats = get_login_throttle().stats()
+        st.caption(f"密码校验线程池：进行中 {pw_stats['in_flight']}（排队 {pw_stats['waiting']}，峰值 {pw_stats['max_in_flight']}），"
+                   f"已完成 {pw_stats['completed']}，拒绝 {pw_stats['rejected']}，超时 {pw_stats['timeouts']}，"
+                   f"排队 平均 {pw_stats['avg_wait_ms']} ms / 最大 {pw_stats['max_wait_ms']} ms，单次哈希 {pw_stats['avg_hash_ms']} ms；"
+                   f"登录失败 {lt_stats['failures']} 次，限流 {lt_stats['throttled']} 次")
+        ds_stats = get_draft_store().stats()
+        st.caption(f"作答草稿：待写 {ds_stats['pending']}（峰值 {ds_stats['max_pending']}），修改 {ds_stats['puts']} 次，"
+                   f"合并 {ds_stats['coalesced']} 次，已落库 {ds_stats['flushed']} 条 / {ds_stats['batches']} 批，"
+                   f"最近耗时 {ds_stats['last_flush_ms']} ms，失败 {ds_stats['failed']}")
+        st.caption(f"配置版本号: {config_store.version}（其他进程最长 {AppConfig.CONFIG_POLL_SECONDS:g} 秒内同步）")
+
+        with st.form("prompt_update_form"):
+            new_prompt = st.text_area("🔧 当前系统底层提示词 (System Prompt)", value=current_prompt, height=250)
+            if st.form_submit_button("💾 保存并全局应用新指令", type="primary", use_container_width=True):
+                if new_prompt.strip():
+                    try:
+                        config_store.set("system_instruction", new_prompt.strip())
+                        st.toast("大模型底层指令已热更新！全系统生效！", icon="✅")
+                        time.sleep(0.5)
+                        st.rerun()
+                    except Exception as e:
+                        st.toast(f"更新失败: {e}", icon="❌")
+                else:
+                    st.toast("提示词不能为空！", icon="⚠️")
 
 elif st.session_state.page_mode == "home" and st.session_state.user_role == "student":
     st.markdown("<h1 style='text-align: center;'>🏫 课程学习大厅</h1>", unsafe_allow_html=True)
@@ -624,13 +1053,10 @@ elif st.session_state.page_mode == "home" and st.session_state.user_role == "stu
         ("概率统计", "包含随机变量、分布规律、信息熵等，结合实际应用场景。"),
         ("C语言", "包含指针、数组、结构体等核心语法，锻炼底层逻辑与编程思维。")
     ]
-    engine = get_database_engine()
-    with engine.connect() as conn:
-        try:
-            for r in conn.execute(text("SELECT course_name, description FROM custom_courses")).fetchall():
-                base_courses.append((r[0], r[1]))
-        except Exception as e:
-            logging.error(f"Load courses error: {e}")
+    try:
+        base_courses.extend(load_custom_courses())
+    except Exception as e:
+        logging.error(f"Load courses error: {e}")
 
     cols = st.columns(4)
     for idx, (c_name, c_desc) in enumerate(base_courses):
@@ -640,8 +1066,24 @@ elif st.session_state.page_mode == "home" and st.session_state.user_role == "stu
             if st.button(f"进入《{c_name}》测验", key=f"btn_{c_name}", use_container_width=True):
                 start_experiment_session(c_name)
 
+    st.divider()
+    with st.expander("🔎 查找相似题目"):
+        similar_query = st.text_input("输入题目关键词或公式片段，例如：特征值、\\lim、洛必达", key="similar_query")
+        if similar_query.strip():
+            try:
+                hits = get_search_index().search(similar_query, 10)
+                hit_map = get_question_bank().get_many(qid for qid, _ in hits)
+            except Exception as e:
+                logging.error(f"Similar search error: {e}")
+                hits, hit_map = [], {}
+            if not hits:
+                st.info("没有找到相关题目，换个关键词试试。")
+            for qid, _ in hits:
+                if qid in hit_map:
+                    st.markdown(f"**[{hit_map[qid]['category']}]** {format_math(hit_map[qid]['content'])}")
+
 elif st.session_state.page_mode == "quiz":
-    st.warning("⚠️ 考试进行中，请勿刷新网页或退出登录，否则未提交的作答记录将会丢失！")
+    st.info(f"💾 作答草稿每 {AppConfig.DRAFT_SAVE_INTERVAL:g} 秒自动保存，翻页时立即保存；刷新网页或重新登录后可继续作答。")
     idx = st.session_state.current_question_index
     total = len(st.session_state.quiz_queue)
     q = st.session_state.quiz_queue[idx]
@@ -650,15 +1092,19 @@ elif st.session_state.page_mode == "quiz":
     st.info(format_math(q['content']))
 
     ans = st.text_area("请作答", value=st.session_state.user_answers.get(idx, ""), height=200, key=f"ans_{idx}")
+    if ans != st.session_state.user_answers.get(idx, ""):
+        get_draft_store().put(st.session_state.current_user, q['id'], ans)
     st.session_state.user_answers[idx] = ans
     cols = st.columns(2)
     with cols[0]:
         if idx > 0 and st.button("⬅️ 上一题"):
+            get_draft_store().flush(st.session_state.current_user)
             st.session_state.current_question_index -= 1
             st.rerun()
     with cols[1]:
         if idx < total - 1:
             if st.button("下一题 ➡️"):
+                get_draft_store().flush(st.session_state.current_user)
                 st.session_state.current_question_index += 1
                 st.rerun()
         else:
@@ -674,11 +1120,15 @@ elif st.session_state.page_mode == "results":
     if st.button("🔄 返回大厅开启新课程"):
         st.session_state.page_mode = "home"
         st.rerun()
+    if any(r.get("verdict") == UNGRADED for r in st.session_state.assessment_results):
+        st.warning("⚠️ 部分题目因网络或服务繁忙暂未完成批改，不计入错题。")
+        if st.button("🔁 重新批改未判定题目"):
+            regrade_ungraded()
     st.divider()
     l_col, r_col = st.columns([1, 1])
     with l_col:
         for i, res in enumerate(st.session_state.assessment_results):
-            label = "✅ 正确" if res['is_correct'] else "❌ 错误"
+            label = "⏳ 未判定" if res['is_correct'] is None else "✅ 正确" if res['is_correct'] else "❌ 错误"
             if st.button(f"题 {i + 1} | {label}", key=f"n_{i}", use_container_width=True):
                 st.session_state.review_question_index = i
                 st.rerun()
@@ -691,9 +1141,13 @@ elif st.session_state.page_mode == "results":
             st.write(f"您的作答: {data['user_answer']}")
             st.divider()
             if qid not in st.session_state.chat_histories:
-                st.session_state.chat_histories[qid] = []
-                if not data['is_correct']: st.session_state.chat_histories[qid].append(
-                    {"role": "assistant", "content": "智能辅导"})
+                load_chat_history(qid)
+                if not st.session_state.chat_histories[qid] and data['is_correct'] is False:
+                    st.session_state.chat_histories[qid].append({"role": "assistant", "content": "智能辅导"})
+            if st.session_state.chat_history_cursors.get(qid) is not None:
+                if st.button("⬆️ 加载更早的辅导记录", key=f"older_{qid}"):
+                    load_chat_history(qid, older=True)
+                    st.rerun()
             for m in st.session_state.chat_histories[qid]:
                 with st.chat_message(m["role"]): st.markdown(m["content"])
             if query := st.chat_input("请求提示..."):
@@ -701,61 +1155,67 @@ elif st.session_state.page_mode == "results":
                 st.rerun()
             if st.session_state.chat_histories[qid] and st.session_state.chat_histories[qid][-1]["role"] == "user":
                 with st.chat_message("assistant"):
-                    h = st.empty()
-                    f = ""
-                    std_ans = data['question_data'].get('answer', '')
-                    std_sol = data['question_data'].get('solution', '')
-                    if std_ans or std_sol:
-                        ctx = f"题目：{data['question_data']['content']}\n标准答案：{std_ans}\n标准解析：{std_sol}\n学生答案：{data['user_answer']}\n判题：{'正确' if data['is_correct'] else '错误'}\n请求：{query}"
+                    renderer = StreamRenderer(st.container().empty, AppConfig.STREAM_RENDER_INTERVAL,
+                                              AppConfig.STREAM_RENDER_CHUNKS)
+                    raw = []
+                    query = st.session_state.chat_histories[qid][-1]["content"]
+                    dynamic_prompt = get_config_store().get("system_instruction", SYSTEM_INSTRUCTION)
+                    prior_turns = st.session_state.chat_histories[qid][:-1]
+                    # 提示缓存只覆盖首轮提问；有历史轮次时回复依赖上下文，直接请求模型
+                    hint_cache = get_hint_cache()
+                    hint_key = hint_cache.key(data['question_data'], data['user_answer'], data['verdict'], query,
+                                              dynamic_prompt)
+                    cached_hint = None if prior_turns else hint_cache.lookup(hint_key)
+                    if cached_hint is not None:
+                        pieces = hint_cache.replay(cached_hint)
                     else:
-                        ctx = f"题目：{data['question_data']['content']}\n答案：{data['user_answer']}\n判题：{'正确' if data['is_correct'] else '错误'}\n请求：{query}"
-                    dynamic_prompt = SYSTEM_INSTRUCTION
-                    try:
-                        engine_tmp = get_database_engine()
-                        with engine_tmp.connect() as conn_tmp:
-                            dyn_prompt_res = conn_tmp.execute(text(
-                                "SELECT config_value FROM system_configs WHERE config_key = 'system_instruction'")).fetchone()
-                            if dyn_prompt_res:
-                                dynamic_prompt = dyn_prompt_res[0]
-                    except Exception as e:
-                        logging.error(f"Fetch prompt error: {e}")
-                    stream = client.chat.completions.create(model="deepseek-chat",
-                                                            messages=[{"role": "system", "content": dynamic_prompt},
-                                                                      {"role": "user", "content": ctx}], stream=True)
-                    for chunk in stream:
-                        c = chunk.choices[0].delta.content
-                        if c:
-                            f += c
-                            h.markdown(format_math(f) + "▌")
-                    final = format_math(f)
-                    h.markdown(final)
+                        messages, summary_state, ctx_stats = get_context_builder().build(
+                            tutor_head(dynamic_prompt, data['question_data'], data['user_answer'],
+                                       VERDICT_LABELS[data['verdict']]),
+                            prior_turns, tutor_request(query), st.session_state.chat_summaries.get(qid))
+                        if summary_state:
+                            st.session_state.chat_summaries[qid] = summary_state
+                        st.session_state.last_tutor_context = ctx_stats
+                        pieces = get_llm_runtime().stream_chat(
+                            kind="tutor", qid=qid, course=data['question_data'].get('category'),
+                            prompt_version=hashlib.sha1(dynamic_prompt.encode('utf-8')).hexdigest()[:8],
+                            model="deepseek-chat", messages=messages)
+                    # 页面跳转或重跑会在 feed 处中断脚本，closing 保证后台的流式请求随之取消
+                    with closing(pieces):
+                        for c in pieces:
+                            if c:
+                                raw.append(c)
+                                renderer.feed(c)
+                    final = renderer.close()
+                    if cached_hint is None and not prior_turns:
+                        hint_cache.add(hint_key, qid, "".join(raw))
                     st.session_state.chat_histories[qid].append({"role": "assistant", "content": final})
                     log_interaction(qid, f"【辅导】{query}", final)
 
 elif st.session_state.page_mode == "report" and st.session_state.user_role == "student":
     st.markdown("<h1 style='text-align: center;'>📊 个人学情中心与错题记录</h1>", unsafe_allow_html=True)
     st.divider()
-    engine = get_database_engine()
-    with engine.connect() as conn:
+    with unit_of_work(get_database_engine()) as conn:
         study_res = conn.execute(text("SELECT SUM(duration_seconds) FROM study_sessions WHERE username = :u"),
                                  {"u": st.session_state.current_user}).fetchone()
         total_seconds = study_res[0] if study_res and study_res[0] else 0
         total_minutes = round(total_seconds / 60)
 
-        ans_logs = conn.execute(text(
-            "SELECT question_id, ai_response FROM interaction_logs WHERE student_id = :u AND user_query LIKE '【答案提交】%%'"),
-                                {"u": st.session_state.current_user}).fetchall()
-        total_answered = len(ans_logs)
-        total_correct = sum(1 for log in ans_logs if '正确' in str(log[1]) or 'PASS' in str(log[1]))
+        ans_stats = conn.execute(text(
+            "SELECT COUNT(*), COALESCE(SUM(is_correct), 0) FROM interaction_logs WHERE student_id = :u AND kind = 'submission' AND is_correct IS NOT NULL"),
+                                 {"u": st.session_state.current_user}).fetchone()
+        total_answered, total_correct = int(ans_stats[0]), int(ans_stats[1])
         accuracy = round((total_correct / total_answered * 100), 1) if total_answered > 0 else 0.0
 
-        wrong_qids = set()
-        for log in ans_logs:
-            if '错误' in str(log[1]) or 'FAIL' in str(log[1]):
-                try:
-                    wrong_qids.add(int(log[0]))
-                except Exception as e:
-                    logging.error(f"Parse qid error: {e}")
+        wrong_qids = {r[0] for r in conn.execute(text(
+            "SELECT DISTINCT qid FROM interaction_logs WHERE student_id = :u AND kind = 'submission' AND is_correct = 0"),
+            {"u": st.session_state.current_user}).fetchall() if r[0] is not None}
+
+        q_dict = {}
+        try:
+            q_dict = get_question_bank().get_many(int(qid) for qid in wrong_qids)
+        except Exception as e:
+            logging.error(f"Fetch wrong questions error: {e}")
 
     col1, col2, col3 = st.columns(3)
     col1.metric("⏱️ 累计专注学习", f"{total_minutes} 分钟")
@@ -767,24 +1227,21 @@ elif st.session_state.page_mode == "report" and st.session_state.user_role == "s
     if not wrong_qids:
         st.info("你目前没有任何错题记录")
     else:
-        db_ids_tuple = tuple([int(qid) - 1000 for qid in wrong_qids])
-        q_dict = {}
-        if db_ids_tuple:
-            with engine.connect() as conn:
-                try:
-                    res = conn.execute(text("SELECT id, category, content FROM custom_questions WHERE id IN :ids"),
-                                       {"ids": db_ids_tuple}).fetchall()
-                    q_dict = {1000 + r[0]: {"category": r[1], "content": r[2]} for r in res}
-                except Exception as e:
-                    logging.error(f"Fetch wrong questions error: {e}")
-
         for qid in wrong_qids:
             if qid in q_dict:
                 q_data = q_dict[qid]
                 with st.expander(f"[{q_data['category']}] 错题回顾 (题号: {qid})"):
                     st.info(format_math(q_data['content']))
-                    if qid in st.session_state.chat_histories and st.session_state.chat_histories[qid]:
+                    if qid not in st.session_state.chat_histories:
+                        if st.button("💬 查看智能辅导记录", key=f"hist_{qid}"):
+                            load_chat_history(qid)
+                            st.rerun()
+                    elif st.session_state.chat_histories[qid]:
                         st.markdown("##### 💬 智能辅导记录")
+                        if st.session_state.chat_history_cursors.get(qid) is not None:
+                            if st.button("⬆️ 加载更早的记录", key=f"older_{qid}"):
+                                load_chat_history(qid, older=True)
+                                st.rerun()
                         for m in st.session_state.chat_histories[qid]:
                             if m["role"] == "user":
                                 st.markdown(f"**🧑‍🎓 你**: {m['content']}")
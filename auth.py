@@ -0,0 +1,262 @@
+import concurrent.futures
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Optional
+
+from sqlalchemy import text, Engine
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from db import insert_ignore, unit_of_work
+
+# 登录相关：密码哈希放到有界线程池中计算（scrypt / pbkdf2 在 C 层释放 GIL），排队按提交顺序先来先服务，
+# 队列满或等待超时直接提示稍后重试，避免上课集中登录时挤占页面渲染。旧版无盐 sha256 哈希在登录成功后后台升级。
+
+
+class LoginUnavailable(Exception):
+    """暂时无法完成登录（限流或哈希队列繁忙），异常信息可直接展示给用户。"""
+
+
+class LoginThrottled(LoginUnavailable):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"登录失败次数过多，请 {int(retry_after) + 1} 秒后再试。")
+
+
+class HasherBusy(LoginUnavailable):
+    def __init__(self):
+        super().__init__("当前登录人数较多，请稍后重试。")
+
+
+def verify_password(db_hash: str, pwd: str) -> bool:
+    if db_hash.startswith("scrypt:") or db_hash.startswith("pbkdf2:"):
+        return check_password_hash(db_hash, pwd)
+    return hashlib.sha256(pwd.encode('utf-8')).hexdigest() == db_hash
+
+
+def needs_rehash(db_hash: str, method: str) -> bool:
+    """旧版 sha256 或参数与当前配置不同的哈希需要升级。method 形如 scrypt 或 scrypt:32768:8:1。"""
+    head = db_hash.split("$", 1)[0]
+    return not (head == method or head.startswith(method + ":"))
+
+
+class PasswordHasher:
+    """密码哈希专用线程池。workers 个线程同时计算，最多 max_waiting 个请求排队，其余直接拒绝。
+
+    按最近的单次哈希耗时估算排队时间，预计等不到 timeout 内完成的请求立即拒绝，不让用户干等到超时。
+    workers <= 0 时在调用线程内直接计算（用于基准测试对比）。
+    """
+
+    def __init__(self, workers: int = 2, max_waiting: int = 200, timeout: float = 15.0, method: str = "scrypt"):
+        self.workers = workers
+        self.timeout = timeout
+        self.method = method
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pw-hash") if workers > 0 else None
+        self._slots = threading.BoundedSemaphore(max(1, workers) + max_waiting)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waits: Deque[float] = deque(maxlen=1000)
+        self._runs: Deque[float] = deque(maxlen=1000)
+        self.metrics = {"completed": 0, "rejected": 0, "timeouts": 0, "background": 0, "deferred": 0,
+                        "max_in_flight": 0}
+        # 不存在的账号也校验一次同样代价的哈希，登录耗时不泄露账号是否存在；顺便作为排队时间估算的初值，
+        # 线程数多于 CPU 核数时各线程分摊 CPU，单次耗时按比例放大
+        started = time.perf_counter()
+        self._dummy_hash = generate_password_hash("dummy-password", method=method)
+        share = max(1, workers) / min(max(1, workers), os.cpu_count() or 1)
+        self._runs.append((time.perf_counter() - started) * 1000 * share)
+
+    def _wrap(self, fn: Callable, args: tuple, queued_at: float):
+        def run():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._waits.append((started - queued_at) * 1000)
+                    self._runs.append((time.perf_counter() - started) * 1000)
+                    self.metrics["completed"] += 1
+                self._slots.release()
+        return run
+
+    def _expected_wait_ms(self) -> float:
+        runs = self._runs
+        if self._pool is None or not runs:
+            return 0.0
+        ahead = self._in_flight - self.workers + 1
+        return max(0.0, ahead / self.workers * sum(runs) / len(runs))
+
+    def _acquire(self, background: bool = False) -> bool:
+        with self._lock:
+            # 哈希升级只用空闲的线程，集中登录期间让位给登录请求
+            busy = self._in_flight >= max(1, self.workers) if background else self._expected_wait_ms() > self.timeout * 1000
+        if busy or not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.metrics["rejected" if not background else "deferred"] += 1
+            return False
+        with self._lock:
+            self._in_flight += 1
+            self.metrics["max_in_flight"] = max(self.metrics["max_in_flight"], self._in_flight)
+        return True
+
+    def _release_unstarted(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def run(self, fn: Callable, *args):
+        """在线程池中执行并等待结果；队列已满或等待超过 timeout 时抛出 HasherBusy。"""
+        if not self._acquire():
+            raise HasherBusy()
+        task = self._wrap(fn, args, time.perf_counter())
+        if self._pool is None:
+            return task()
+        future = self._pool.submit(task)
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                self.metrics["timeouts"] += 1
+            if future.cancel():
+                self._release_unstarted()
+            raise HasherBusy()
+
+    def run_background(self, fn: Callable, *args) -> bool:
+        """不等待结果（用于哈希升级）。没有空闲线程时直接放弃，下次登录再试。
+
+        不排队：升级任务的参数里有明文密码，不能在内存里留到线程池空闲。
+        """
+        if not self._acquire(background=True):
+            return False
+        with self._lock:
+            self.metrics["background"] += 1
+        task = self._wrap(fn, args, time.perf_counter())
+        if self._pool is None:
+            task()
+        else:
+            self._pool.submit(task)
+        return True
+
+    def verify(self, db_hash: Optional[str], pwd: str) -> bool:
+        return self.run(verify_password, db_hash or self._dummy_hash, pwd) and db_hash is not None
+
+    def hash(self, pwd: str) -> str:
+        return self.run(generate_password_hash, pwd, self.method)
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits, runs = list(self._waits), list(self._runs)
+            in_flight = self._in_flight
+            metrics = dict(self.metrics)
+        return dict(metrics, in_flight=in_flight, waiting=max(0, in_flight - max(1, self.workers)),
+                    avg_wait_ms=round(sum(waits) / len(waits), 1) if waits else 0.0,
+                    max_wait_ms=round(max(waits), 1) if waits else 0.0,
+                    avg_hash_ms=round(sum(runs) / len(runs), 1) if runs else 0.0)
+
+
+class LoginThrottle:
+    """失败登录限流：同一账号或同一 IP 在 window_seconds 内失败达到上限后，锁定到最早一次失败移出窗口为止。
+
+    计数保存在进程内，多进程部署时每个进程各自限流。同一教室通常共用出口 IP，IP 上限应明显大于账号上限。
+    """
+
+    def __init__(self, max_user_failures: int = 5, max_ip_failures: int = 100, window_seconds: float = 300.0,
+                 max_keys: int = 50000):
+        self.limits = {"u": max_user_failures, "ip": max_ip_failures}
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._failures: "OrderedDict[tuple, Deque[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {"failures": 0, "throttled": 0}
+
+    def _keys(self, username: str, ip: Optional[str]) -> list:
+        keys = [("u", username)]
+        if ip:
+            keys.append(("ip", ip))
+        return keys
+
+    def _recent(self, key: tuple, now: float) -> Deque[float]:
+        times = self._failures.get(key)
+        if times is None:
+            return deque()
+        while times and now - times[0] >= self.window_seconds:
+            times.popleft()
+        if not times:
+            del self._failures[key]
+        return times
+
+    def retry_after(self, username: str, ip: Optional[str] = None) -> float:
+        now = time.monotonic()
+        wait = 0.0
+        with self._lock:
+            for key in self._keys(username, ip):
+                times = self._recent(key, now)
+                if len(times) >= self.limits[key[0]]:
+                    wait = max(wait, self.window_seconds - (now - times[-self.limits[key[0]]]))
+            if wait > 0:
+                self.metrics["throttled"] += 1
+        return wait
+
+    def failed(self, username: str, ip: Optional[str] = None):
+        now = time.monotonic()
+        with self._lock:
+            self.metrics["failures"] += 1
+            for key in self._keys(username, ip):
+                self._failures.setdefault(key, deque(maxlen=self.limits[key[0]])).append(now)
+                self._failures.move_to_end(key)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+    def succeeded(self, username: str, ip: Optional[str] = None):
+        with self._lock:
+            self._failures.pop(("u", username), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.metrics, tracked=len(self._failures))
+
+
+def _upgrade_hash(engine: Engine, username: str, old_hash: str, pwd: str, method: str):
+    try:
+        new_hash = generate_password_hash(pwd, method=method)
+        with unit_of_work(engine) as conn:
+            # 只在哈希未被其他请求修改时更新，避免覆盖并发的改密
+            conn.execute(text("UPDATE users SET password_hash = :n WHERE username = :u AND password_hash = :o"),
+                         {"n": new_hash, "u": username, "o": old_hash})
+    except Exception as e:
+        logging.error(f"Password rehash error: {e}")
+
+
+def authenticate(engine: Engine, hasher: PasswordHasher, throttle: LoginThrottle, username: str, pwd: str,
+                 ip: Optional[str] = None) -> Optional[str]:
+    """校验成功返回角色，密码错误返回 None；被限流或哈希队列繁忙时抛出 LoginUnavailable。
+
+    查询完账号就归还连接，哈希排队和计算期间不占用数据库连接。
+    """
+    wait = throttle.retry_after(username, ip)
+    if wait > 0:
+        raise LoginThrottled(wait)
+    with unit_of_work(engine) as conn:
+        row = conn.execute(text("SELECT password_hash, role FROM users WHERE username = :u"), {"u": username}).fetchone()
+    db_hash, role = (row[0], row[1]) if row else (None, None)
+    if not hasher.verify(db_hash, pwd):
+        throttle.failed(username, ip)
+        return None
+    throttle.succeeded(username, ip)
+    if needs_rehash(db_hash, hasher.method):
+        hasher.run_background(_upgrade_hash, engine, username, db_hash, pwd, hasher.method)
+    return role
+
+
+def register(engine: Engine, hasher: PasswordHasher, username: str, pwd: str) -> bool:
+    """单条 INSERT 依靠 users.username 唯一索引判重，并发注册同一学号时只有一个成功。"""
+    pw_hash = hasher.hash(pwd)
+    with unit_of_work(engine) as conn:
+        res = conn.execute(text(insert_ignore(conn, "INTO users (username, password_hash, role) VALUES (:u, :p, 'student')")),
+                           {"u": username, "p": pw_hash})
+        return res.rowcount == 1
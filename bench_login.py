@@ -0,0 +1,178 @@
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from typing import Dict, List
+
+from dotenv import load_dotenv
+from sqlalchemy import text, Engine
+from werkzeug.security import generate_password_hash
+
+import auth
+import migrations
+from db import engine_from_env, pool_stats
+from grading import percentile
+
+# 集中登录基准：模拟上课时 N 个学生在同一瞬间点击“进入系统”。每个模拟学生一个线程（等价于一个 Streamlit 脚本线程），
+# 用 Barrier 同时放行后调用与页面相同的 auth.authenticate，统计登录耗时分位数、排队/拒绝/限流次数、
+# 旧版 sha256 哈希的升级情况，并用一个“渲染探针”线程测量同期普通页面逻辑被拖慢的程度。
+# 账号统一以 loginbench_ 开头，每次运行前重建，保证旧哈希比例可重复。
+
+BENCH_PREFIX = "loginbench_"
+
+
+def prepare_accounts(engine: Engine, n: int, password: str, legacy_share: float, method: str,
+                     rng: random.Random) -> List[str]:
+    modern = generate_password_hash(password, method=method)
+    legacy = hashlib.sha256(password.encode('utf-8')).hexdigest()
+    names = [f"{BENCH_PREFIX}{i}" for i in range(n)]
+    with engine.connect() as conn:
+        conn.execute(text("DELETE FROM users WHERE username LIKE :p"), {"p": f"{BENCH_PREFIX}%"})
+        conn.execute(text("INSERT INTO users (username, password_hash, role) VALUES (:u, :p, 'student')"),
+                     [{"u": u, "p": legacy if rng.random() < legacy_share else modern} for u in names])
+        conn.commit()
+    return names
+
+
+def count_stale_hashes(engine: Engine, method: str) -> int:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT COUNT(*) FROM users WHERE username LIKE :p AND password_hash NOT LIKE :m"),
+                            {"p": f"{BENCH_PREFIX}%", "m": f"{method}%"}).scalar()
+
+
+class RenderProbe:
+    """每 interval 秒做一小段纯 Python 计算（相当于一次轻量页面重跑），记录实际耗时超出预期的部分。"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="render-probe", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            json.dumps([{"i": i, "s": str(i)} for i in range(200)])
+            time.sleep(self.interval)
+            self.lags.append(max(0.0, (time.perf_counter() - started - self.interval) * 1000))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_burst(engine: Engine, hasher: auth.PasswordHasher, throttle: auth.LoginThrottle, names: List[str],
+              password: str, wrong_share: float, shared_ip: bool, rng: random.Random) -> List[Dict[str, object]]:
+    barrier = threading.Barrier(len(names))
+    results: List[Dict[str, object]] = [{} for _ in names]
+    attempts = [(u, password if rng.random() >= wrong_share else password + "-wrong") for u in names]
+
+    def login(i: int):
+        username, pwd = attempts[i]
+        ip = "10.0.0.1" if shared_ip else f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+        barrier.wait()
+        started = time.perf_counter()
+        try:
+            outcome = "ok" if auth.authenticate(engine, hasher, throttle, username, pwd, ip) else "wrong"
+        except auth.LoginThrottled:
+            outcome = "throttled"
+        except auth.HasherBusy:
+            outcome = "busy"
+        except Exception as e:
+            outcome = f"error: {type(e).__name__}"
+        results[i] = {"ms": (time.perf_counter() - started) * 1000, "outcome": outcome}
+
+    threads = [threading.Thread(target=login, args=(i,)) for i in range(len(names))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def report(results: List[dict], wall: float, probe: RenderProbe, hasher: auth.PasswordHasher, engine: Engine,
+           stale_before: int, stale_after: int) -> dict:
+    outcomes: Dict[str, int] = {}
+    for r in results:
+        outcomes[r["outcome"]] = outcomes.get(r["outcome"], 0) + 1
+    ms = [r["ms"] for r in results]
+    ok_ms = [r["ms"] for r in results if r["outcome"] in ("ok", "wrong")]
+    return {"logins": len(results), "wall_seconds": round(wall, 2), "outcomes": outcomes,
+            "login_ms": {"p50": round(percentile(ms, 50)), "p95": round(percentile(ms, 95)),
+                         "p99": round(percentile(ms, 99)), "max": round(max(ms)) if ms else 0},
+            "verified_login_p99_ms": round(percentile(ok_ms, 99)),
+            "render_probe_lag_ms": {"p50": round(percentile(probe.lags, 50), 1),
+                                    "p99": round(percentile(probe.lags, 99), 1),
+                                    "max": round(max(probe.lags), 1) if probe.lags else 0.0},
+            "stale_hashes": {"before": stale_before, "after": stale_after},
+            "hasher": hasher.stats(), "db_pool": pool_stats(engine)}
+
+
+def print_report(rep: dict):
+    lm, lag = rep["login_ms"], rep["render_probe_lag_ms"]
+    print(f"\n{rep['logins']} 次并发登录，总耗时 {rep['wall_seconds']} 秒，结果：{rep['outcomes']}")
+    print(f"登录耗时 p50 {lm['p50']} ms，p95 {lm['p95']} ms，p99 {lm['p99']} ms，max {lm['max']} ms"
+          f"（完成校验的登录 p99 {rep['verified_login_p99_ms']} ms）")
+    print(f"渲染探针额外延迟 p50 {lag['p50']} ms，p99 {lag['p99']} ms，max {lag['max']} ms")
+    h = rep["hasher"]
+    print(f"哈希线程池：峰值占用 {h['max_in_flight']}，拒绝 {h['rejected']}，超时 {h['timeouts']}，升级推迟到下次登录 {h['deferred']}，"
+          f"平均排队 {h['avg_wait_ms']} ms，单次哈希 {h['avg_hash_ms']} ms")
+    print(f"旧版哈希账号：{rep['stale_hashes']['before']} → {rep['stale_hashes']['after']}")
+    p = rep["db_pool"]
+    print(f"数据库连接：峰值借出 {p['peak_checked_out']}，新建 {p['connects']}，借出等待最大 {p['checkout_ms_max']} ms，"
+          f"超时 {p['timeouts']}")
+
+
+if __name__ == "__main__":
+    # 用法：python bench_login.py --logins 200 --workers 2
+    #       python bench_login.py --logins 200 --workers 0      （不使用线程池，在各自线程内直接计算哈希作对比）
+    #       python bench_login.py --logins 200 --max-p99-ms 5000 （超过阈值时以非零状态退出，可用于 CI）
+    parser = argparse.ArgumentParser(description="集中登录基准测试")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=2, help="哈希线程数，0 表示在登录线程内直接计算")
+    parser.add_argument("--queue", type=int, default=200, help="哈希排队上限")
+    parser.add_argument("--timeout", type=float, default=15.0, help="单次登录最长排队秒数")
+    parser.add_argument("--method", default="scrypt", help="当前密码哈希方法")
+    parser.add_argument("--legacy-share", type=float, default=0.3, help="使用旧版 sha256 哈希的账号比例")
+    parser.add_argument("--wrong-share", type=float, default=0.05, help="输错密码的比例")
+    parser.add_argument("--shared-ip", action="store_true", help="所有学生共用一个出口 IP（同一教室 NAT）")
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--max-overflow", type=int, default=20)
+    parser.add_argument("--password", default="loginbench")
+    parser.add_argument("--seed", type=int, default=20240901)
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="登录 p99 超过该值时返回非零状态")
+    parser.add_argument("--json", default=None, help="把报告另存为 JSON 文件")
+    args = parser.parse_args()
+
+    load_dotenv()
+    engine = engine_from_env(pool_size=args.pool_size, max_overflow=args.max_overflow)
+    migrations.upgrade(engine)
+    rng = random.Random(args.seed)
+    names = prepare_accounts(engine, args.logins, args.password, args.legacy_share, args.method, rng)
+    stale_before = count_stale_hashes(engine, args.method)
+    hasher = auth.PasswordHasher(args.workers, args.queue, args.timeout, args.method)
+    throttle = auth.LoginThrottle()
+
+    with RenderProbe() as probe:
+        started = time.perf_counter()
+        results = run_burst(engine, hasher, throttle, names, args.password, args.wrong_share, args.shared_ip, rng)
+        wall = time.perf_counter() - started
+        # 等待后台的哈希升级写完再统计
+        deadline = time.monotonic() + 60
+        while hasher.stats()["in_flight"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+    rep = report(results, wall, probe, hasher, engine, stale_before, count_stale_hashes(engine, args.method))
+    print_report(rep)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
+    if args.max_p99_ms is not None and rep["login_ms"]["p99"] > args.max_p99_ms:
+        print(f"❌ 登录 p99 {rep['login_ms']['p99']} ms 超过阈值 {args.max_p99_ms} ms")
+        sys.exit(1)
@@ -0,0 +1,211 @@
+import argparse
+import json
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, text, Engine
+
+from db import engine_from_env
+from grading import percentile
+
+# 数据库查询基准：逐条执行 app.py 各页面路径上的只读查询，记录耗时分位数、返回行数与 EXPLAIN 执行计划，
+# 结果保存为 JSON 基线；--compare 与旧基线对比，耗时变慢超过阈值或执行计划所用索引变化时报出。
+# 查询文本与 app.py / analytics.py / question_index.py 中的对应语句保持一致，修改那边的 SQL 时同步更新这里。
+# 配合 seed_data.py 生成的数据使用：用户参数取会话最多的“重度”学生和排在中间的“普通”学生。
+
+BENCH_TABLES = ("users", "login_logs", "study_sessions", "interaction_logs", "custom_questions", "custom_courses",
+                "rollup_daily_active", "rollup_course_time", "rollup_question_accuracy", "judge_verdict_cache")
+
+# 名称 -> (SQL, 参数构造)。ctx 为 pick_params 选出的样本参数
+Query = Tuple[str, Callable[[dict], dict]]
+QUERIES: Dict[str, Query] = {
+    "login.authenticate": ("SELECT password_hash, role FROM users WHERE username = :u",
+                           lambda c: {"u": c["user"]}),
+    "login.sync_user_data": ("SELECT current_quiz_ids FROM users WHERE username = :u", lambda c: {"u": c["user"]}),
+    "tutoring.chat_history": (
+        "SELECT id, user_query, ai_response FROM interaction_logs WHERE student_id = :u AND kind = 'tutoring' AND qid = :q ORDER BY id DESC LIMIT :n",
+        lambda c: {"u": c["user"], "q": c["qid"], "n": 20}),
+    "report.study_total": ("SELECT SUM(duration_seconds) FROM study_sessions WHERE username = :u",
+                           lambda c: {"u": c["user"]}),
+    "report.answer_stats": (
+        "SELECT COUNT(*), COALESCE(SUM(is_correct), 0) FROM interaction_logs WHERE student_id = :u AND kind = 'submission' AND is_correct IS NOT NULL",
+        lambda c: {"u": c["user"]}),
+    "report.wrong_qids": (
+        "SELECT DISTINCT qid FROM interaction_logs WHERE student_id = :u AND kind = 'submission' AND is_correct = 0",
+        lambda c: {"u": c["user"]}),
+    "home.custom_courses": ("SELECT course_name, description FROM custom_courses", lambda c: {}),
+    "bank.course_questions": (
+        "SELECT id, category, content, answer, solution FROM custom_questions WHERE category = :c",
+        lambda c: {"c": c["course"]}),
+    "bank.get_many": ("SELECT id, category, content, answer, solution FROM custom_questions WHERE id IN :ids",
+                      lambda c: {"ids": list(c["ids"])}),
+    "admin.dashboard_active": (
+        "SELECT stat_date AS login_date, user_count FROM rollup_daily_active WHERE stat_date >= :since ORDER BY stat_date",
+        lambda c: {"since": date.today() - timedelta(days=7)}),
+    "admin.dashboard_durations": ("SELECT course_name, total_seconds FROM rollup_course_time WHERE total_seconds > 0",
+                                  lambda c: {}),
+    "admin.dashboard_accuracy": (
+        "SELECT course_name, SUM(correct) * 1.0 / SUM(attempts) AS is_correct FROM rollup_question_accuracy GROUP BY course_name HAVING SUM(attempts) > 0",
+        lambda c: {}),
+    "admin.login_logs": ("SELECT username, login_time FROM login_logs ORDER BY login_time DESC LIMIT 50", lambda c: {}),
+    "admin.study_sessions": (
+        "SELECT username, course_name, start_time, end_time, duration_seconds FROM study_sessions ORDER BY start_time DESC LIMIT 50",
+        lambda c: {}),
+    "admin.interaction_logs": (
+        "SELECT student_id, question_id, user_query, ai_response, created_at FROM interaction_logs ORDER BY created_at DESC LIMIT 50",
+        lambda c: {}),
+    "admin.question_labels": ("SELECT id, SUBSTR(content, 1, 20) FROM custom_questions WHERE category = :c ORDER BY id DESC",
+                              lambda c: {"c": c["course"]}),
+    "admin.custom_questions_page": (
+        "SELECT id, category, content FROM custom_questions ORDER BY id DESC LIMIT :n OFFSET :o",
+        lambda c: {"n": 50, "o": 50 * 20}),
+}
+# 按学生执行的查询分别用重度学生与普通学生各跑一遍
+PER_USER = {"login.authenticate", "login.sync_user_data", "tutoring.chat_history", "report.study_total",
+            "report.answer_stats", "report.wrong_qids"}
+# 全量重算一类的重查询，默认不跑
+HEAVY_QUERIES: Dict[str, Query] = {
+    "analytics.rebuild_accuracy": (
+        "SELECT qid, COUNT(*), SUM(is_correct) FROM interaction_logs WHERE kind = 'submission' AND is_correct IS NOT NULL AND qid IS NOT NULL GROUP BY qid",
+        lambda c: {}),
+}
+
+
+def pick_params(conn) -> dict:
+    heavy = conn.execute(text(
+        "SELECT username FROM study_sessions GROUP BY username ORDER BY COUNT(*) DESC LIMIT 1")).fetchone()
+    n_students = conn.execute(text("SELECT COUNT(*) FROM users WHERE role = 'student'")).scalar() or 0
+    typical = conn.execute(text("SELECT username FROM users WHERE role = 'student' ORDER BY id LIMIT 1 OFFSET :o"),
+                           {"o": n_students // 2}).fetchone()
+    course = conn.execute(text(
+        "SELECT category FROM custom_questions GROUP BY category ORDER BY COUNT(*) DESC LIMIT 1")).fetchone()
+    ids = [r[0] for r in conn.execute(text("SELECT id FROM custom_questions ORDER BY id DESC LIMIT 10")).fetchall()]
+    ctx = {"heavy_user": heavy[0] if heavy else "", "typical_user": typical[0] if typical else "",
+           "course": course[0] if course else "", "ids": ids or [0]}
+    for role in ("heavy", "typical"):
+        row = conn.execute(text(
+            "SELECT qid FROM interaction_logs WHERE student_id = :u AND kind = 'tutoring' ORDER BY id DESC LIMIT 1"),
+            {"u": ctx[f"{role}_user"]}).fetchone()
+        ctx[f"{role}_qid"] = row[0] if row else 0
+    return ctx
+
+
+def _stmt(sql: str, params: dict):
+    stmt = text(sql)
+    expanding = [bindparam(k, expanding=True) for k, v in params.items() if isinstance(v, list)]
+    return stmt.bindparams(*expanding) if expanding else stmt
+
+
+def explain(conn, sql: str, params: dict) -> List[dict]:
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    rows = conn.execute(_stmt(prefix + sql, params), params).fetchall()
+    return [{k: (v if isinstance(v, (int, float, str)) or v is None else str(v)) for k, v in r._mapping.items()}
+            for r in rows]
+
+
+def plan_keys(plan: List[dict]) -> List[str]:
+    """执行计划的摘要：每张表实际使用的索引（MySQL 的 key 列，SQLite 的 detail 文本）。"""
+    out = []
+    for step in plan:
+        if "detail" in step:
+            out.append(str(step["detail"]))
+        else:
+            out.append(f"{step.get('table')}:{step.get('key') or step.get('type')}")
+    return out
+
+
+def time_query(conn, sql: str, params: dict, repeat: int, warmup: int) -> dict:
+    stmt = _stmt(sql, params)
+    for _ in range(warmup):
+        conn.execute(stmt, params).fetchall()
+    times, rows = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = len(conn.execute(stmt, params).fetchall())
+        times.append((time.perf_counter() - started) * 1000)
+    return {"p50_ms": round(percentile(times, 50), 3), "p95_ms": round(percentile(times, 95), 3),
+            "max_ms": round(max(times), 3), "rows": rows}
+
+
+def run_benchmark(engine: Engine, repeat: int = 20, warmup: int = 2, include_heavy: bool = False,
+                  only: Optional[List[str]] = None) -> dict:
+    queries = dict(QUERIES, **(HEAVY_QUERIES if include_heavy else {}))
+    result = {"created_at": datetime.now().isoformat(timespec="seconds"), "dialect": engine.dialect.name,
+              "repeat": repeat, "tables": {}, "params": {}, "queries": {}}
+    with engine.connect() as conn:
+        for table in BENCH_TABLES:
+            try:
+                result["tables"][table] = conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+            except Exception:
+                conn.rollback()
+        ctx = pick_params(conn)
+        result["params"] = ctx
+        for name, (sql, make_params) in queries.items():
+            if only and not any(name.startswith(p) for p in only):
+                continue
+            variants = [("heavy", "[heavy]"), ("typical", "[typical]")] if name in PER_USER else [("heavy", "")]
+            for role, suffix in variants:
+                params = make_params(dict(ctx, user=ctx[f"{role}_user"], qid=ctx[f"{role}_qid"]))
+                entry = time_query(conn, sql, params, repeat, warmup)
+                entry["plan"] = explain(conn, sql, params)
+                entry["plan_keys"] = plan_keys(entry["plan"])
+                result["queries"][name + suffix] = entry
+                print(f"{name + suffix:<36}p50 {entry['p50_ms']:>9.2f} ms  p95 {entry['p95_ms']:>9.2f} ms  "
+                      f"{entry['rows']:>7} 行  {', '.join(entry['plan_keys'])}")
+    return result
+
+
+def compare(base: dict, cur: dict, threshold: float = 1.5, min_delta_ms: float = 2.0) -> List[str]:
+    """返回回归项说明：p50 变慢超过 threshold 倍且绝对差超过 min_delta_ms，或执行计划使用的索引变化。"""
+    problems = []
+    for name, now in cur["queries"].items():
+        old = base.get("queries", {}).get(name)
+        if not old:
+            continue
+        ratio = now["p50_ms"] / old["p50_ms"] if old["p50_ms"] else float("inf")
+        delta = now["p50_ms"] - old["p50_ms"]
+        mark = ""
+        if ratio > threshold and delta > min_delta_ms:
+            mark = "❌ 变慢"
+            problems.append(f"{name}: p50 {old['p50_ms']} → {now['p50_ms']} ms（×{ratio:.2f}）")
+        elif ratio < 1 / threshold and -delta > min_delta_ms:
+            mark = "✅ 变快"
+        if old.get("plan_keys") != now.get("plan_keys"):
+            problems.append(f"{name}: 执行计划变化 {old.get('plan_keys')} → {now.get('plan_keys')}")
+            mark = (mark + " ⚠️ 计划变化").strip()
+        print(f"{name:<36}{old['p50_ms']:>10.2f} → {now['p50_ms']:>10.2f} ms  ×{ratio:>6.2f}  {mark}")
+    return problems
+
+
+if __name__ == "__main__":
+    # 用法：python bench_queries.py --out bench_baseline.json
+    #       python bench_queries.py --compare bench_baseline.json --out bench_after.json
+    parser = argparse.ArgumentParser(description="数据库查询基准测试")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--heavy", action="store_true", help="同时测试全量重算等重查询")
+    parser.add_argument("--only", nargs="*", help="只测试指定前缀的查询，例如 report admin.dashboard")
+    parser.add_argument("--out", default=None, help="保存结果 JSON")
+    parser.add_argument("--compare", default=None, help="与之前保存的基线 JSON 对比")
+    parser.add_argument("--threshold", type=float, default=1.5, help="p50 变慢超过该倍数视为回归")
+    args = parser.parse_args()
+
+    load_dotenv()
+    engine = engine_from_env()
+    res = run_benchmark(engine, args.repeat, args.warmup, args.heavy, args.only)
+    print(f"数据规模：{res['tables']}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2, default=str)
+        print(f"✅ 结果已保存到 {args.out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\n与基线 {args.compare}（{baseline.get('created_at')}）对比：")
+        regressions = compare(baseline, res, args.threshold)
+        for line in regressions:
+            print(f"  ❌ {line}")
+        sys.exit(1 if regressions else 0)
@@ -1,15 +1,14 @@
 import os
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import inspect
 from dotenv import load_dotenv
+from db import engine_from_env
 
 # 加载配置
 load_dotenv()
 
-# 构建连接地址
-db_url = f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
-
 try:
-    engine = create_engine(db_url)
+    # 按 DB_BACKEND 选择 MySQL 或本地 SQLite
+    engine = engine_from_env()
     # 检查数据库里的表
     inspector = inspect(engine)
     tables = inspector.get_table_names()
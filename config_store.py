@@ -0,0 +1,70 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import text, Engine
+
+from db import cast_int, unit_of_work, upsert
+
+VERSION_KEY = "__config_version__"
+
+
+class ConfigStore:
+    """system_configs 的进程内缓存。
+
+    读请求直接命中内存；每隔 poll_interval 秒由某个读请求顺带查一次版本号行，版本变化才整表重载。
+    写入时与版本号递增放在同一事务里，其他进程最多 poll_interval 秒后看到新值。
+    """
+
+    def __init__(self, engine: Engine, poll_interval: float = 5.0):
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self._values: Dict[str, str] = {}
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> Optional[int]:
+        return self._version
+
+    def _poll(self):
+        with unit_of_work(self.engine) as conn:
+            row = conn.execute(text("SELECT config_value FROM system_configs WHERE config_key = :k"),
+                               {"k": VERSION_KEY}).fetchone()
+            version = int(row[0]) if row else 0
+            if version != self._version:
+                rows = conn.execute(text("SELECT config_key, config_value FROM system_configs")).fetchall()
+                self._values = {k: v for k, v in rows if k != VERSION_KEY}
+                self._version = version
+
+    def _refresh_if_stale(self):
+        if time.monotonic() - self._checked_at < self.poll_interval:
+            return
+        if not self._lock.acquire(blocking=self._version is None):
+            return
+        try:
+            if time.monotonic() - self._checked_at >= self.poll_interval:
+                self._poll()
+                self._checked_at = time.monotonic()
+        except Exception as e:
+            logging.error(f"Config poll error: {e}")
+            self._checked_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def get(self, key: str, default: str = None) -> Optional[str]:
+        self._refresh_if_stale()
+        return self._values.get(key, default)
+
+    def set(self, key: str, value: str):
+        with unit_of_work(self.engine) as conn:
+            conn.execute(text(upsert(conn, "INSERT INTO system_configs (config_key, config_value) VALUES (:k, :v)",
+                                     "config_key", replace=("config_value",))), {"k": key, "v": value})
+            conn.execute(text(upsert(conn, "INSERT INTO system_configs (config_key, config_value) VALUES (:k, '1')",
+                                     "config_key", f"config_value = {cast_int(conn, 'config_value')} + 1")),
+                         {"k": VERSION_KEY})
+        with self._lock:
+            self._poll()
+            self._checked_at = time.monotonic()
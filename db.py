@@ -0,0 +1,222 @@
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime
+from typing import Iterator, Optional, Sequence, Tuple
+
+from sqlalchemy import create_engine, event, text, Connection, Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+# 数据库后端：默认 MySQL（pymysql），DB_BACKEND=sqlite 时使用本地 SQLite 文件（WAL 模式），适合单机小班和测试机。
+# 两种后端不一致的 SQL 写法集中在这里生成，业务代码只调用下面的函数，不直接写方言专有语法。
+
+DEFAULT_SQLITE_PATH = "app.db"
+
+
+def _adapt_datetime(dt: datetime) -> str:
+    # 与 MySQL DATETIME 一致：只保存本地时间，不保存时区；统一格式保证按字符串比较时顺序正确
+    return dt.replace(tzinfo=None).isoformat(" ", timespec="microseconds")
+
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_adapter(date, date.isoformat)
+
+
+def database_url(backend: str = "mysql", user: Optional[str] = None, password: Optional[str] = None,
+                 host: Optional[str] = None, name: Optional[str] = None, sqlite_path: Optional[str] = None) -> str:
+    if backend == "sqlite":
+        return f"sqlite:///{sqlite_path or DEFAULT_SQLITE_PATH}"
+    if backend != "mysql":
+        raise ValueError(f"不支持的数据库后端: {backend}（可选 mysql / sqlite）")
+    return f"mysql+pymysql://{user}:{password}@{host}/{name}"
+
+
+# 每个 engine 的连接池计数：借出次数、新建连接数、同时借出峰值，以及 unit_of_work 的借出等待耗时
+_POOL_METRICS: "weakref.WeakKeyDictionary[Engine, dict]" = weakref.WeakKeyDictionary()
+_POOL_LOCK = threading.Lock()
+
+
+def _track_pool(engine: Engine):
+    metrics = {"checkouts": 0, "connects": 0, "checked_out": 0, "peak_checked_out": 0, "units": 0, "joined": 0,
+               "rollbacks": 0, "timeouts": 0, "checkout_ms_total": 0.0, "checkout_ms_max": 0.0}
+    _POOL_METRICS[engine] = metrics
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_conn, record):
+        with _POOL_LOCK:
+            metrics["connects"] += 1
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_conn, record, proxy):
+        with _POOL_LOCK:
+            metrics["checkouts"] += 1
+            metrics["checked_out"] += 1
+            metrics["peak_checked_out"] = max(metrics["peak_checked_out"], metrics["checked_out"])
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_conn, record):
+        with _POOL_LOCK:
+            metrics["checked_out"] = max(0, metrics["checked_out"] - 1)
+
+
+def make_engine(url: str, pool_size: int = 5, max_overflow: int = 10, sqlite_cache_mb: int = 64,
+                sqlite_busy_ms: int = 5000, pool_timeout: float = 30.0, pool_recycle: int = 1800,
+                pre_ping: bool = True) -> Engine:
+    """pre_ping 关闭时依靠 pool_recycle（应小于 MySQL wait_timeout）与 LIFO 复用淘汰空闲过久的连接，省去每次借出的往返。"""
+    if not url.startswith("sqlite"):
+        engine = create_engine(url, pool_recycle=pool_recycle, pool_pre_ping=pre_ping, pool_size=pool_size,
+                               max_overflow=max_overflow, pool_timeout=pool_timeout, pool_use_lifo=True)
+        _track_pool(engine)
+        return engine
+    path = url.split("///", 1)[-1]
+    if path and path != ":memory:" and os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    engine = create_engine(url, pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout,
+                           connect_args={"check_same_thread": False, "timeout": sqlite_busy_ms / 1000})
+    _track_pool(engine)
+
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_conn, record):
+        cur = dbapi_conn.cursor()
+        # WAL：读写互不阻塞；synchronous=NORMAL 在 WAL 下只在检查点时 fsync，掉电最多丢最后几个事务
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={int(sqlite_busy_ms)}")
+        cur.execute(f"PRAGMA cache_size=-{int(sqlite_cache_mb) * 1024}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA mmap_size=268435456")
+        cur.close()
+
+    return engine
+
+
+def engine_from_env(**engine_args) -> Engine:
+    """命令行工具使用：按环境变量（.env）选择后端并创建 engine，engine_args 透传给 make_engine（如连接池大小）。"""
+    return make_engine(database_url(os.getenv("DB_BACKEND", "mysql"), os.getenv("DB_USER"), os.getenv("DB_PASSWORD"),
+                                    os.getenv("DB_HOST"), os.getenv("DB_NAME"), os.getenv("SQLITE_PATH")), **engine_args)
+
+
+def pool_stats(engine: Engine) -> dict:
+    pool = engine.pool
+    with _POOL_LOCK:
+        stats = dict(_POOL_METRICS.get(engine, {}))
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        fn = getattr(pool, name, None)
+        if callable(fn):
+            stats[f"pool_{name}"] = fn()
+    stats["pool_max_overflow"] = getattr(pool, "_max_overflow", 0)
+    units = stats.get("units", 0)
+    stats["checkout_ms_avg"] = round(stats.pop("checkout_ms_total", 0.0) / units, 2) if units else 0.0
+    return stats
+
+
+# 当前线程（Streamlit 脚本线程）正在进行的工作单元：(engine, 连接)。后台线程看不到，仍各自借连接
+_ACTIVE_UNIT: ContextVar[Optional[Tuple[Engine, Connection]]] = ContextVar("db_unit_of_work", default=None)
+
+
+@contextmanager
+def unit_of_work(engine: Engine) -> Iterator[Connection]:
+    """一次页面交互内共用一个连接：相关写入在退出时一起提交，出错整体回滚。
+
+    嵌套调用时复用外层连接、不单独提交，所以块内不要调用 conn.commit()。st.rerun / st.stop 通过
+    BaseException 跳出脚本，按正常结束处理并提交。不要在块内等待大模型调用，以免长时间占用连接和事务。
+    """
+    active = _ACTIVE_UNIT.get()
+    metrics = _POOL_METRICS.get(engine)
+    if active is not None and active[0] is engine:
+        if metrics is not None:
+            with _POOL_LOCK:
+                metrics["joined"] += 1
+        yield active[1]
+        return
+    started = time.perf_counter()
+    try:
+        conn = engine.connect()
+    except PoolTimeoutError:
+        if metrics is not None:
+            with _POOL_LOCK:
+                metrics["timeouts"] += 1
+        raise
+    waited = (time.perf_counter() - started) * 1000
+    if metrics is not None:
+        with _POOL_LOCK:
+            metrics["units"] += 1
+            metrics["checkout_ms_total"] += waited
+            metrics["checkout_ms_max"] = round(max(metrics["checkout_ms_max"], waited), 2)
+    token = _ACTIVE_UNIT.set((engine, conn))
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        if metrics is not None:
+            with _POOL_LOCK:
+                metrics["rollbacks"] += 1
+        raise
+    except BaseException:
+        conn.commit()
+        raise
+    else:
+        conn.commit()
+    finally:
+        _ACTIVE_UNIT.reset(token)
+        conn.close()
+
+
+def is_sqlite(conn) -> bool:
+    return conn.dialect.name == "sqlite"
+
+
+def inserted(conn, column: str) -> str:
+    """冲突更新子句中引用“本次要插入的新值”：MySQL 为 VALUES(col)，SQLite 为 excluded.col。"""
+    return f"excluded.{column}" if is_sqlite(conn) else f"VALUES({column})"
+
+
+def upsert(conn, insert_sql: str, conflict: str, update: str = "", replace: Sequence[str] = (),
+           increment: Sequence[str] = ()) -> str:
+    """在 INSERT 语句后拼接“冲突则更新”子句。
+
+    replace 中的列改为新插入行的值，increment 中的列在原值上累加新插入行的值；update 为额外的赋值表达式，
+    其中不能引用 :参数——pymysql 批量写入（executemany）只替换 VALUES 中的参数，ON DUPLICATE KEY UPDATE
+    之后的参数会原样发给 MySQL。需要新值时用 inserted()。
+    """
+    sets = [f"{c} = {inserted(conn, c)}" for c in replace]
+    sets += [f"{c} = {c} + {inserted(conn, c)}" for c in increment]
+    if update:
+        sets.append(update)
+    clause = ", ".join(sets)
+    if is_sqlite(conn):
+        return f"{insert_sql} ON CONFLICT ({conflict}) DO UPDATE SET {clause}"
+    return f"{insert_sql} ON DUPLICATE KEY UPDATE {clause}"
+
+
+def insert_ignore(conn, rest: str) -> str:
+    """rest 为 INSERT 之后的部分，例如 "INTO t (a) VALUES (:a)"。"""
+    return f"INSERT OR IGNORE {rest}" if is_sqlite(conn) else f"INSERT IGNORE {rest}"
+
+
+def seconds_between(conn, start: str, end: str) -> str:
+    """两个时间表达式相差的整秒数。"""
+    if is_sqlite(conn):
+        return f"CAST(ROUND((julianday({end}) - julianday({start})) * 86400) AS INTEGER)"
+    return f"TIMESTAMPDIFF(SECOND, {start}, {end})"
+
+
+def cast_int(conn, expr: str) -> str:
+    return f"CAST({expr} AS INTEGER)" if is_sqlite(conn) else f"CAST({expr} AS SIGNED)"
+
+
+def acquire_lock(conn, name: str, timeout: int) -> bool:
+    """跨进程命名锁。SQLite 只在单机使用，写入由数据库文件锁串行化，这里直接返回成功。"""
+    if is_sqlite(conn):
+        return True
+    return bool(conn.execute(text("SELECT GET_LOCK(:n, :t)"), {"n": name, "t": timeout}).scalar())
+
+
+def release_lock(conn, name: str):
+    if is_sqlite(conn):
+        return
+    conn.execute(text("SELECT RELEASE_LOCK(:n)"), {"n": name})
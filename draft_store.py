@@ -0,0 +1,126 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import text, Engine
+
+from db import unit_of_work, upsert
+
+DraftKey = Tuple[str, int]
+
+
+class DraftStore:
+    """测验作答草稿的服务端暂存：每次重跑只改内存中的待写字典，后台线程每 debounce_seconds 秒批量 upsert 一次。
+
+    同一学生同一题在一个周期内的多次修改合并为一次写入；翻页、交卷、退出时调用 flush(username) 立即落库。
+    草稿按统一题号保存，刷新页面后由 load() 取回（尚未落库的内存草稿优先）。
+    """
+
+    def __init__(self, engine: Engine, debounce_seconds: float = 5.0, max_pending: int = 20000):
+        self.engine = engine
+        self.debounce_seconds = debounce_seconds
+        self.max_pending = max_pending
+        self._pending: Dict[DraftKey, str] = {}
+        self._lock = threading.Lock()
+        # 写库与 clear 串行化，避免交卷清空后又被后台线程写回旧草稿
+        self._io_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.metrics = {"puts": 0, "coalesced": 0, "flushed": 0, "batches": 0, "failed": 0, "max_pending": 0,
+                        "last_flush_ms": 0.0}
+        self._thread = threading.Thread(target=self._run, name="draft-store", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, username: str, qid: int, answer: str):
+        with self._lock:
+            key = (username, qid)
+            if key in self._pending:
+                self.metrics["coalesced"] += 1
+            self._pending[key] = answer
+            self.metrics["puts"] += 1
+            self.metrics["max_pending"] = max(self.metrics["max_pending"], len(self._pending))
+            overfull = len(self._pending) >= self.max_pending
+        if overfull:
+            self.flush()
+
+    def _take(self, username: Optional[str] = None) -> Dict[DraftKey, str]:
+        with self._lock:
+            if username is None:
+                taken, self._pending = self._pending, {}
+            else:
+                taken = {k: v for k, v in self._pending.items() if k[0] == username}
+                for k in taken:
+                    del self._pending[k]
+        return taken
+
+    def _write(self, drafts: Dict[DraftKey, str]) -> bool:
+        if not drafts:
+            return True
+        started = time.perf_counter()
+        now = datetime.now()
+        rows = [{"u": u, "q": q, "a": a, "t": now} for (u, q), a in drafts.items()]
+        with self._io_lock:
+            try:
+                with self.engine.connect() as conn:
+                    conn.execute(text(upsert(
+                        conn, "INSERT INTO quiz_drafts (username, question_id, answer, updated_at) VALUES (:u, :q, :a, :t)",
+                        "username, question_id", replace=("answer", "updated_at"))), rows)
+                    conn.commit()
+            except Exception as e:
+                logging.error(f"Draft flush error, {len(rows)} drafts kept in memory: {getattr(e, 'orig', e)}")
+                self.metrics["failed"] += 1
+                with self._lock:
+                    # 写失败的草稿放回待写字典，期间又有新修改的以新值为准
+                    for k, v in drafts.items():
+                        self._pending.setdefault(k, v)
+                return False
+        self.metrics["flushed"] += len(rows)
+        self.metrics["batches"] += 1
+        self.metrics["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.debounce_seconds):
+            self._write(self._take())
+
+    def flush(self, username: Optional[str] = None) -> bool:
+        """立即写入某个学生（默认全部）尚未落库的草稿。"""
+        return self._write(self._take(username))
+
+    def load(self, username: str) -> Dict[int, str]:
+        """返回 统一题号 -> 草稿；读库失败时只返回内存中的草稿。"""
+        drafts: Dict[int, str] = {}
+        try:
+            with unit_of_work(self.engine) as conn:
+                rows = conn.execute(text("SELECT question_id, answer FROM quiz_drafts WHERE username = :u"),
+                                    {"u": username}).fetchall()
+            drafts.update({int(q): a or "" for q, a in rows})
+        except Exception as e:
+            logging.error(f"Draft load error: {e}")
+        with self._lock:
+            drafts.update({q: a for (u, q), a in self._pending.items() if u == username})
+        return drafts
+
+    def clear(self, username: str):
+        """交卷或开始新测验时丢弃该学生的全部草稿。"""
+        with self._io_lock:
+            self._take(username)
+            try:
+                with unit_of_work(self.engine) as conn:
+                    conn.execute(text("DELETE FROM quiz_drafts WHERE username = :u"), {"u": username})
+            except Exception as e:
+                logging.error(f"Draft clear error: {e}")
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.metrics, pending=len(self._pending))
@@ -0,0 +1,226 @@
+import asyncio
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import openai
+
+PASS, FAIL, UNGRADED = "PASS", "FAIL", "UNGRADED"
+VERDICT_LABELS = {PASS: "正确", FAIL: "错误", UNGRADED: "未判定"}
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                    openai.InternalServerError, asyncio.TimeoutError)
+
+JudgeFn = Callable[[dict, str], Awaitable[bool]]
+BatchJudgeFn = Callable[[List[Tuple[dict, str]]], Awaitable[str]]
+
+# 当前调用是第几次重试（0 为首次），wait_for 创建的任务复制上下文，调用指标据此记录重试次数
+CALL_ATTEMPT: contextvars.ContextVar = contextvars.ContextVar("llm_call_attempt", default=0)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def parse_batch_verdicts(raw: str, n: int) -> Dict[int, bool]:
+    """解析批量判题输出，返回 0 起始下标 -> 是否正确。编号越界、重复或判定值非法的条目直接丢弃，由调用方逐题回退。"""
+    raw = raw.strip()
+    if raw.startswith("```"):
+        raw = raw.strip("`").split("\n", 1)[-1]
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return {}
+    if isinstance(data, dict):
+        data = data.get("results", [])
+    if not isinstance(data, list):
+        return {}
+    parsed: Dict[int, bool] = {}
+    for entry in data:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            idx = int(entry.get("id")) - 1
+        except (TypeError, ValueError):
+            continue
+        verdict = str(entry.get("verdict", "")).strip().upper()
+        if 0 <= idx < n and idx not in parsed and verdict in (PASS, FAIL):
+            parsed[idx] = verdict == PASS
+    return parsed
+
+
+class GlobalLimiter:
+    """跨会话共享的并发闸门。
+
+    Streamlit 每个会话跑在自己的线程里、每次交卷各自起事件循环，asyncio.Semaphore 无法跨循环共享，
+    这里用线程锁维护名额，排队者按先来后到通过 call_soon_threadsafe 唤醒。
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiters = deque()
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._in_use < self.limit and not self._waiters:
+                self._in_use += 1
+                return
+            fut = loop.create_future()
+            entry = (loop, fut)
+            self._waiters.append(entry)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove(entry)
+                    queued = True
+                except ValueError:
+                    queued = False
+            if not queued and not fut.cancelled():
+                self.release()
+            raise
+
+    def _grant(self, fut: asyncio.Future):
+        if fut.done():
+            self.release()
+        else:
+            fut.set_result(None)
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                loop, fut = self._waiters.popleft()
+                if loop.is_closed():
+                    continue
+                loop.call_soon_threadsafe(self._grant, fut)
+                return
+            self._in_use -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class GradingEngine:
+    """整卷批改：全局限流、单次调用超时、抖动指数退避重试、整卷截止时间，结果为 PASS/FAIL/UNGRADED 三态。"""
+
+    def __init__(self, max_concurrency: int = 16, call_timeout: float = 20.0, max_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_cap: float = 8.0, paper_deadline: float = 60.0):
+        self.limiter = GlobalLimiter(max_concurrency)
+        self.call_timeout = call_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.paper_deadline = paper_deadline
+        self.recent_papers = deque(maxlen=200)
+
+    async def _call(self, make_call: Callable[[], Awaitable[Any]], deadline: float, stats: dict, what: str) -> Any:
+        """限流 + 超时 + 重试地执行一次模型调用；放弃时返回 None。"""
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                async with self.limiter:
+                    started = time.monotonic()
+                    CALL_ATTEMPT.set(attempt)
+                    result = await asyncio.wait_for(make_call(), timeout=min(self.call_timeout, remaining))
+                    stats["latencies"].append(time.monotonic() - started)
+                return result
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    logging.error(f"Grading gave up on {what} after {attempt + 1} attempts: {e!r}")
+                    return None
+                attempt += 1
+                stats["retries"] += 1
+                await asyncio.sleep(random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt)))
+            except Exception as e:
+                logging.error(f"Grading error on {what}: {e!r}")
+                return None
+
+    async def grade_one(self, judge: JudgeFn, q: dict, ans: str, deadline: float, stats: dict) -> str:
+        ok = await self._call(lambda: judge(q, ans), deadline, stats, f"question {q.get('id')}")
+        return UNGRADED if ok is None else PASS if ok else FAIL
+
+    async def grade_chunk(self, judge_batch: BatchJudgeFn, judge: JudgeFn, chunk: List[Tuple[dict, str]],
+                          deadline: float, stats: dict) -> List[str]:
+        raw = await self._call(lambda: judge_batch(chunk), deadline, stats, f"batch of {len(chunk)}")
+        parsed = parse_batch_verdicts(raw, len(chunk)) if raw is not None else {}
+        missing = [i for i in range(len(chunk)) if i not in parsed]
+        stats["fallbacks"] += len(missing)
+        fallback = await asyncio.gather(*[self.grade_one(judge, *chunk[i], deadline, stats) for i in missing])
+        verdicts = {i: PASS if ok else FAIL for i, ok in parsed.items()}
+        verdicts.update(zip(missing, fallback))
+        return [verdicts[i] for i in range(len(chunk))]
+
+    async def grade_paper(self, judge: JudgeFn, items: List[Tuple[dict, str]], judge_batch: BatchJudgeFn = None,
+                          batch_size: int = 0) -> Tuple[List[str], dict]:
+        """batch_size > 1 且提供 judge_batch 时按批合并请求，缺失或无法解析的条目逐题回退。"""
+        started = time.monotonic()
+        deadline = started + self.paper_deadline
+        stats = {"latencies": [], "retries": 0, "fallbacks": 0}
+        if judge_batch is not None and batch_size > 1:
+            chunks = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+            tasks = [asyncio.ensure_future(self.grade_chunk(judge_batch, judge, c, deadline, stats)) for c in chunks]
+        else:
+            chunks = [[item] for item in items]
+            tasks = [asyncio.ensure_future(self.grade_chunk_single(judge, c, deadline, stats)) for c in chunks]
+        await self._wait(tasks)
+        verdicts: List[str] = []
+        for t, c in zip(tasks, chunks):
+            verdicts.extend(t.result() if t.done() and not t.cancelled() else [UNGRADED] * len(c))
+        paper = self._summarize(stats, verdicts, time.monotonic() - started)
+        self.recent_papers.append(paper)
+        return verdicts, paper
+
+    async def grade_chunk_single(self, judge: JudgeFn, chunk: List[Tuple[dict, str]], deadline: float,
+                                 stats: dict) -> List[str]:
+        return [await self.grade_one(judge, *chunk[0], deadline, stats)]
+
+    async def _wait(self, tasks: List[asyncio.Future]):
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.paper_deadline)
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+    @staticmethod
+    def _summarize(stats: dict, verdicts: List[str], wall: float) -> dict:
+        lat = stats["latencies"]
+        return {"items": len(verdicts), "ungraded": verdicts.count(UNGRADED), "retries": stats["retries"],
+                "calls": len(lat), "fallbacks": stats["fallbacks"],
+                "wall_seconds": round(wall, 3), "call_p50": round(percentile(lat, 50), 3),
+                "call_p95": round(percentile(lat, 95), 3), "call_max": round(max(lat), 3) if lat else 0.0}
+
+    def summary(self) -> Optional[dict]:
+        if not self.recent_papers:
+            return None
+        walls = [p["wall_seconds"] for p in self.recent_papers]
+        return {"papers": len(walls), "wall_p50": percentile(walls, 50), "wall_p95": percentile(walls, 95),
+                "wall_p99": percentile(walls, 99), "in_flight": self.limiter.in_use, "waiting": self.limiter.waiting,
+                "ungraded": sum(p["ungraded"] for p in self.recent_papers),
+                "retries": sum(p["retries"] for p in self.recent_papers)}
@@ -0,0 +1,90 @@
+import hashlib
+import random
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+from judge_cache import question_fingerprint
+
+
+def normalize_request(query: str) -> str:
+    # "给点提示。" / "给点提示 " / "给点提示！" 归为同一请求
+    s = unicodedata.normalize("NFKC", query or "").lower()
+    return "".join(ch for ch in s if not ch.isspace() and not unicodedata.category(ch).startswith("P"))
+
+
+def normalize_answer(ans: str) -> str:
+    # 只去掉空白和全角差异，标点和运算符保留："(1,2)" 与 "12" 是不同的作答
+    return "".join(ch for ch in unicodedata.normalize("NFKC", ans or "") if not ch.isspace())
+
+
+class HintCache:
+    """辅导提示缓存。
+
+    每个键最多积累 variants_per_entry 条不同的模型回复；攒满之前照常请求模型并把回复收进来，
+    攒满之后随机回放其中一条，保证同一请求不总是看到一模一样的文字。
+    提示是针对学生本人答案写的，键里带上规范化后的答案，只有作答相同的学生才会共用。
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: int = 6 * 3600, variants_per_entry: int = 3):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.variants_per_entry = variants_per_entry
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(q: dict, answer: str, verdict: str, query: str, system_prompt: str) -> str:
+        prompt_version = hashlib.sha1(system_prompt.encode('utf-8')).hexdigest()
+        answer_digest = hashlib.sha1(normalize_answer(answer).encode('utf-8')).hexdigest()
+        raw = f"{q['id']}:{question_fingerprint(q)}:{answer_digest}:{verdict}:{normalize_request(query)}:{prompt_version}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def lookup(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["expires"] < time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None or len(entry["variants"]) < self.variants_per_entry:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return random.choice(entry["variants"])
+
+    def add(self, key: str, qid: int, hint: str):
+        if not hint.strip():
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {"qid": qid, "variants": [], "expires": time.time() + self.ttl_seconds}
+                self._entries[key] = entry
+            if hint not in entry["variants"] and len(entry["variants"]) < self.variants_per_entry:
+                entry["variants"].append(hint)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_question(self, qid: int):
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if v["qid"] == qid]:
+                del self._entries[key]
+
+    @staticmethod
+    def replay(hint: str, chunk_chars: int = 6, delay: float = 0.012) -> Iterator[str]:
+        """把缓存文本切片成模拟流，沿用与真实流式输出相同的渲染路径。"""
+        for i in range(0, len(hint), chunk_chars):
+            if i:
+                time.sleep(delay)
+            yield hint[i:i + chunk_chars]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0}
@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, text, DateTime, Engine
+
+from db import unit_of_work, upsert
+from prompts import JUDGE_PROMPT_VERSION
+from question_index import content_hash
+
+
+def _sha1(s: str) -> str:
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+def normalize_answer(ans: str) -> str:
+    # 全角转半角、去掉公式定界符与句末标点、压缩空白，使 "1" / " １。" / "$1$" 命中同一条缓存
+    s = unicodedata.normalize("NFKC", ans or "").strip()
+    s = s.replace("$", "")
+    s = re.sub(r"\s+", " ", s)
+    return s.rstrip("。.，, ").strip()
+
+
+def question_fingerprint(q: dict) -> str:
+    return q.get("content_hash") or content_hash(q)
+
+
+def verdict_key(q: dict, ans: str) -> str:
+    return _sha1(f"{q['id']}:{question_fingerprint(q)}:{_sha1(normalize_answer(ans))}:{JUDGE_PROMPT_VERSION}")
+
+
+class VerdictCache:
+    """判题结果两级缓存：进程内 LRU + judge_verdict_cache 表。
+
+    键里包含题目/答案/解析的哈希与判题 Prompt 版本，管理员改题或升级 Prompt 后旧条目自然失效。
+    """
+
+    def __init__(self, engine: Engine, max_entries: int = 4096, ttl_seconds: int = 7 * 86400):
+        self.engine = engine
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lru: "OrderedDict[str, Tuple[bool, float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts_since_purge = 0
+        self.mem_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _mem_get(self, key: str) -> Optional[bool]:
+        with self._lock:
+            hit = self._lru.get(key)
+            if hit is None:
+                return None
+            verdict, expires, _ = hit
+            if expires < time.time():
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return verdict
+
+    def _mem_put(self, key: str, qid: int, verdict: bool, expires: float):
+        with self._lock:
+            self._lru[key] = (verdict, expires, qid)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def get_many(self, items: List[Tuple[dict, str]]) -> Dict[int, bool]:
+        """按下标返回命中的判题结果，未命中的下标不出现在结果中。内存未命中的键合并成一次数据库查询。"""
+        found: Dict[int, bool] = {}
+        pending: Dict[str, List[int]] = {}
+        for i, (q, ans) in enumerate(items):
+            key = verdict_key(q, ans)
+            verdict = self._mem_get(key)
+            if verdict is None:
+                pending.setdefault(key, []).append(i)
+            else:
+                found[i] = verdict
+                self.mem_hits += 1
+        if pending:
+            try:
+                with unit_of_work(self.engine) as conn:
+                    rows = conn.execute(text(
+                        "SELECT cache_key, question_id, verdict, expires_at FROM judge_verdict_cache WHERE cache_key IN :keys AND expires_at > :now")
+                        .bindparams(bindparam("keys", expanding=True)).columns(expires_at=DateTime),
+                        {"keys": list(pending.keys()), "now": datetime.now()}).fetchall()
+                for key, qid, verdict, expires_at in rows:
+                    self._mem_put(key, qid, bool(verdict), expires_at.timestamp())
+                    for i in pending.pop(key, []):
+                        found[i] = bool(verdict)
+                        self.db_hits += 1
+            except Exception as e:
+                logging.error(f"Verdict cache lookup error: {e}")
+        self.misses += sum(len(v) for v in pending.values())
+        return found
+
+    def put_many(self, items: List[Tuple[dict, str, bool]]):
+        if not items:
+            return
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=self.ttl_seconds)
+        rows = {}
+        for q, ans, verdict in items:
+            key = verdict_key(q, ans)
+            self._mem_put(key, q["id"], verdict, expires_at.timestamp())
+            rows[key] = {"k": key, "qid": q["id"], "v": int(verdict), "c": now, "e": expires_at}
+        try:
+            with unit_of_work(self.engine) as conn:
+                conn.execute(text(upsert(
+                    conn, "INSERT INTO judge_verdict_cache (cache_key, question_id, verdict, created_at, expires_at) VALUES (:k, :qid, :v, :c, :e)",
+                    "cache_key", replace=("verdict", "expires_at"))), list(rows.values()))
+                self._puts_since_purge += len(rows)
+                if self._puts_since_purge >= 500:
+                    conn.execute(text("DELETE FROM judge_verdict_cache WHERE expires_at <= :now"), {"now": now})
+                    self._puts_since_purge = 0
+        except Exception as e:
+            logging.error(f"Verdict cache write error: {e}")
+
+    def invalidate_question(self, qid: int):
+        with self._lock:
+            for key in [k for k, v in self._lru.items() if v[2] == qid]:
+                del self._lru[key]
+        try:
+            with unit_of_work(self.engine) as conn:
+                conn.execute(text("DELETE FROM judge_verdict_cache WHERE question_id = :qid"), {"qid": qid})
+        except Exception as e:
+            logging.error(f"Verdict cache invalidate error: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.mem_hits + self.db_hits + self.misses
+        return {"mem_hits": self.mem_hits, "db_hits": self.db_hits, "misses": self.misses,
+                "hit_rate": round((self.mem_hits + self.db_hits) / lookups, 3) if lookups else 0.0,
+                "entries": len(self._lru)}
@@ -0,0 +1,232 @@
+import asyncio
+import atexit
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine, Dict, Iterator, Optional
+
+from openai import DEFAULT_CONNECTION_LIMITS, AsyncOpenAI, DefaultAsyncHttpxClient, Timeout
+
+from telemetry import Telemetry
+
+_DONE = object()
+
+
+def usage_tokens(usage) -> Dict[str, int]:
+    """从 usage 字段取出提示 / 命中缓存 / 生成 token 数。DeepSeek 用 prompt_cache_hit_tokens，OpenAI 用 prompt_tokens_details.cached_tokens。"""
+    if usage is None:
+        return {"prompt": 0, "cached": 0, "completion": 0}
+    cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    if cached is None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) if details is not None else None
+    return {"prompt": getattr(usage, "prompt_tokens", 0) or 0, "cached": cached or 0,
+            "completion": getattr(usage, "completion_tokens", 0) or 0}
+
+
+class LLMRuntime:
+    """进程级大模型运行时：一个后台事件循环线程 + 一个长连接池化的 AsyncOpenAI 客户端。
+
+    Streamlit 脚本线程通过 run / submit / stream 把协程投递到这个循环，不再每次交卷 asyncio.run 新建事件循环、
+    重新握手 TLS；流式辅导的网络读写也在后台循环里完成，脚本线程只从队列取文本块。
+    run 可传入 interrupt 在等待期间定时检查是否放弃（如 Streamlit 重跑）；stream 在消费方停止迭代时取消后台任务。
+    """
+
+    def __init__(self, api_key: str, base_url: str, max_connections: int = 100, max_keepalive: int = 20,
+                 keepalive_expiry: float = 30.0, timeout: float = 60.0, telemetry: Optional[Telemetry] = None):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="llm-runtime")
+        self._thread.start()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.streams = 0
+        self.cancelled = 0
+        self.submitted = 0
+        self.usage_by_kind: Dict[str, Dict[str, int]] = {}
+        self.recent_usage: deque = deque(maxlen=500)
+        self.telemetry = telemetry or Telemetry()
+
+        async def make_client() -> AsyncOpenAI:
+            # 连接池在事件循环内创建，保证与运行循环绑定。HTTP 客户端沿用 openai 自带的传输库
+            # （Limits 取自其默认连接上限的类型），不单独依赖 httpx
+            limits_cls = type(DEFAULT_CONNECTION_LIMITS)
+            http_client = DefaultAsyncHttpxClient(
+                limits=limits_cls(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                  keepalive_expiry=keepalive_expiry),
+                timeout=Timeout(timeout, connect=10.0))
+            return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
+        self.client: AsyncOpenAI = asyncio.run_coroutine_threadsafe(make_client(), self._loop).result()
+        atexit.register(self.close)
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        with self._lock:
+            self.submitted += 1
+            self.in_flight += 1
+        fut = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        fut.add_done_callback(self._on_done)
+        return fut
+
+    def _on_done(self, fut: concurrent.futures.Future):
+        with self._lock:
+            self.in_flight -= 1
+            if fut.cancelled():
+                self.cancelled += 1
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None, interrupt: Optional[Callable[[], None]] = None,
+            poll_interval: float = 0.2) -> Any:
+        """在后台循环上执行协程并等待结果，超时或调用线程抛出异常时取消该任务。
+
+        阻塞在 fut.result() 里的线程收不到外部中断（Streamlit 的重跑请求要等脚本下一次调用 st.* 才生效），
+        因此每 poll_interval 秒调用一次 interrupt，由它在需要放弃等待时抛出异常。
+        """
+        fut = self.submit(coro)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                wait = poll_interval if interrupt else None
+                if deadline is not None:
+                    wait = max(0.0, deadline - time.monotonic()) if wait is None else \
+                        min(wait, max(0.0, deadline - time.monotonic()))
+                try:
+                    return fut.result(wait)
+                except concurrent.futures.TimeoutError:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise
+                interrupt()
+        except BaseException:
+            fut.cancel()
+            raise
+
+    def stream(self, agen_factory) -> Iterator[Any]:
+        """把异步迭代器转成同步生成器：后台循环负责读取，调用线程逐块取出。
+
+        agen_factory 是返回异步迭代器的协程函数。生成器被关闭（消费方提前退出或中断）时取消后台任务。
+        """
+        q: "queue.Queue[Any]" = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in await agen_factory():
+                    q.put(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                q.put(e)
+            finally:
+                q.put(_DONE)
+
+        with self._lock:
+            self.streams += 1
+        fut = self.submit(pump())
+        try:
+            while True:
+                item = q.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            with self._lock:
+                self.streams -= 1
+            if not fut.done():
+                fut.cancel()
+
+    def record_usage(self, kind: str, usage, qid: Optional[int] = None) -> Dict[str, int]:
+        """按调用记录 token 用量与前缀缓存命中，kind 区分 judge / judge_batch / tutor / summary。"""
+        tokens = usage_tokens(usage)
+        with self._lock:
+            agg = self.usage_by_kind.setdefault(kind, {"calls": 0, "prompt": 0, "cached": 0, "completion": 0})
+            agg["calls"] += 1
+            for k, v in tokens.items():
+                agg[k] += v
+            self.recent_usage.append({"kind": kind, "qid": qid, "at": time.time(), **tokens})
+        return tokens
+
+    def cache_hit_rates(self) -> Dict[str, float]:
+        with self._lock:
+            return {k: round(v["cached"] / v["prompt"], 3) if v["prompt"] else 0.0 for k, v in self.usage_by_kind.items()}
+
+    def _record_call(self, kind: str, started: float, tags: dict, model: Optional[str], tokens: Optional[dict],
+                     first_at: Optional[float] = None, error: Optional[BaseException] = None):
+        now = time.monotonic()
+        tokens = tokens or {"prompt": 0, "cached": 0, "completion": 0}
+        tps = None
+        if first_at is not None and tokens["completion"] and now > first_at:
+            tps = tokens["completion"] / (now - first_at)
+        err = None
+        if error is not None:
+            err = "cancelled" if isinstance(error, (asyncio.CancelledError, GeneratorExit)) else type(error).__name__
+        try:
+            self.telemetry.record(kind, (now - started) * 1000, course=tags.get("course"),
+                                  prompt_version=tags.get("prompt_version"), model=model,
+                                  ttft_ms=None if first_at is None else (first_at - started) * 1000,
+                                  tokens_per_sec=tps, prompt_tokens=tokens["prompt"],
+                                  completion_tokens=tokens["completion"], cached_tokens=tokens["cached"], error=err)
+        except Exception as e:
+            logging.error(f"LLM telemetry error: {e}")
+
+    async def chat(self, kind: str, course: Optional[str] = None, prompt_version: Optional[str] = None,
+                   qid: Optional[int] = None, **kwargs):
+        """非流式对话补全，记录用量与调用指标（延迟、token、错误类型），异常原样抛出。"""
+        started = time.monotonic()
+        tags = {"course": course, "prompt_version": prompt_version}
+        try:
+            resp = await self.client.chat.completions.create(**kwargs)
+        except BaseException as e:
+            self._record_call(kind, started, tags, kwargs.get("model"), None, error=e)
+            raise
+        self._record_call(kind, started, tags, kwargs.get("model"), self.record_usage(kind, resp.usage, qid))
+        return resp
+
+    def stream_chat(self, kind: str = "tutor", qid: Optional[int] = None, course: Optional[str] = None,
+                    prompt_version: Optional[str] = None, **kwargs) -> Iterator[str]:
+        """流式对话补全，逐块产出 delta 文本；最后一个块带回的 usage 记入 kind 名下，并记录首字延迟与生成速度。"""
+        tags = {"course": course, "prompt_version": prompt_version}
+
+        async def open_stream():
+            started = time.monotonic()
+            try:
+                resp = await self.client.chat.completions.create(stream=True, stream_options={"include_usage": True},
+                                                                 **kwargs)
+            except BaseException as e:
+                self._record_call(kind, started, tags, kwargs.get("model"), None, error=e)
+                raise
+
+            async def deltas():
+                first_at, tokens, error = None, None, None
+                try:
+                    async for chunk in resp:
+                        if getattr(chunk, "usage", None) is not None:
+                            tokens = self.record_usage(kind, chunk.usage, qid)
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            if first_at is None:
+                                first_at = time.monotonic()
+                            yield chunk.choices[0].delta.content
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    self._record_call(kind, started, tags, kwargs.get("model"), tokens, first_at, error)
+                    await resp.close()
+
+            return deltas()
+
+        return self.stream(open_stream)
+
+    def close(self):
+        if not self._loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.client.close(), self._loop).result(5)
+        except Exception as e:
+            logging.error(f"LLM runtime close error: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "streams": self.streams, "submitted": self.submitted,
+                "cancelled": self.cancelled, "cache_hit_rates": self.cache_hit_rates()}
@@ -0,0 +1,251 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event, text
+from sqlalchemy.pool import Pool
+from streamlit.testing.v1 import AppTest
+from werkzeug.security import generate_password_hash
+
+import mock_llm
+from db import engine_from_env
+from grading import percentile
+
+# 并发学生压测：模拟学生分派到 spawn 出的工作进程里，每个进程同一时刻只跑一个 AppTest 会话。AppTest 每次运行都会改写进程级的
+# Runtime 实例和 st.secrets，同一进程内的多个会话无法并发，所以用进程隔离；代价是每个工作进程各有一套
+# st.cache_resource 单例（连接池、大模型运行时），相当于 --concurrency 个单会话应用进程同时访问同一个数据库
+# 和大模型端点，学生数多于并发数时工作进程依次复用。
+# 每个学生依次：登录 → 进入课程（start_experiment_session）→ 逐题作答并交卷（submit_and_assess）
+# → 对第一题发起辅导提问（流式）。统计各阶段耗时分位数、整体吞吐以及各进程数据库连接池的占用峰值。
+
+STAGES = ("login", "start", "answer", "submit", "tutor")
+STUDENT_PREFIX = "loadtest_"
+
+
+class PoolTracker:
+    """通过连接池 checkout / checkin 事件统计同时借出的连接数。对所在进程内的所有连接池生效。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+        self.checkouts = 0
+        self.waits: List[float] = []
+        event.listen(Pool, "checkout", self._checkout)
+        event.listen(Pool, "checkin", self._checkin)
+
+    def _checkout(self, dbapi_conn, record, proxy):
+        with self.lock:
+            self.current += 1
+            self.checkouts += 1
+            self.peak = max(self.peak, self.current)
+
+    def _checkin(self, dbapi_conn, record):
+        with self.lock:
+            self.current = max(0, self.current - 1)
+
+    def reset(self):
+        with self.lock:
+            self.peak = self.current
+            self.checkouts = 0
+
+
+def prepare_students(n: int, password: str):
+    """预先注册 loadtest_0 .. loadtest_{n-1}，已存在的账号保持不变。"""
+    engine = engine_from_env()
+    names = [f"{STUDENT_PREFIX}{i}" for i in range(n)]
+    with engine.connect() as conn:
+        existing = {r[0] for r in conn.execute(text("SELECT username FROM users WHERE username LIKE :p"),
+                                               {"p": f"{STUDENT_PREFIX}%"}).fetchall()}
+        missing = [u for u in names if u not in existing]
+        pw_hash = generate_password_hash(password)
+        if missing:
+            conn.execute(text("INSERT INTO users (username, password_hash, role) VALUES (:u, :p, 'student')"),
+                         [{"u": u, "p": pw_hash} for u in missing])
+            conn.commit()
+    engine.dispose()
+    print(f"已准备 {n} 个压测账号（新建 {len(missing)} 个）")
+
+
+def _button(at: AppTest, label: str):
+    for b in at.button:
+        if b.label == label:
+            return b
+    raise LookupError(f"页面上没有按钮：{label}")
+
+
+def _check(at: AppTest, stage: str):
+    if at.exception:
+        raise RuntimeError(f"{stage}: {at.exception[0].message}")
+
+
+_tracker: Optional[PoolTracker] = None
+
+
+def run_student(i: int, args, secrets: Dict[str, str]) -> Dict[str, object]:
+    """在工作进程内跑完一个学生的流程，返回各阶段耗时、判题结果和本进程在此期间的连接池统计。"""
+    global _tracker
+    if _tracker is None:
+        logging.getLogger("streamlit").setLevel(logging.ERROR)
+        _tracker = PoolTracker()
+    tracker = _tracker
+    if args.ramp:
+        # 按统一的起始时刻错峰，复用的工作进程不会额外多等
+        time.sleep(max(0.0, args.ramp_start + args.ramp * i / max(1, args.students) - time.time()))
+    tracker.reset()
+    rng = random.Random(args.seed * 100003 + i if args.seed is not None else None)
+    result: Dict[str, object] = {"student": i, "timings": {}, "error": None}
+    timings: Dict[str, float] = result["timings"]
+
+    def timed(stage: str, fn):
+        started = time.monotonic()
+        fn()
+        timings[stage] = timings.get(stage, 0.0) + time.monotonic() - started
+        _check(at, stage)
+
+    at = AppTest.from_file(args.app, default_timeout=args.timeout)
+    at.secrets.update(secrets)
+    try:
+        at.run()
+        _check(at, "load")
+        at.text_input[0].set_value(f"{STUDENT_PREFIX}{i}")
+        at.text_input[1].set_value(args.password)
+        timed("login", lambda: _button(at, "进入系统").click().run())
+        if not at.session_state.logged_in:
+            raise RuntimeError("login: 登录失败（是否先运行了 --prepare？）")
+        # 上次中断的测验会被 sync_user_data 恢复，直接从测验页继续
+        if at.session_state.page_mode != "quiz":
+            timed("start", lambda: at.button(key=f"btn_{args.course}").click().run())
+        queue = at.session_state.quiz_queue
+        for idx, q in enumerate(queue):
+            correct = q.get("answer") and rng.random() < args.correct_rate
+            ans = q["answer"] if correct else f"压测作答 {i}-{idx} {rng.random():.6f}"
+            last = idx == len(queue) - 1
+            timed("answer", lambda: at.text_area(key=f"ans_{idx}").set_value(ans).run())
+            if not last:
+                timed("answer", lambda: _button(at, "下一题 ➡️").click().run())
+        timed("submit", lambda: _button(at, "✅ 提交试卷").click().run())
+        if at.session_state.page_mode != "results":
+            raise RuntimeError("submit: 交卷后没有进入结果页")
+        result["verdicts"] = [r["verdict"] for r in at.session_state.assessment_results]
+        timed("tutor", lambda: at.button(key="n_0").click().run())
+        for n in range(args.tutor_turns):
+            timed("tutor", lambda: at.chat_input[0].set_value(f"第 {n + 1} 次提问：这道题应该从哪里入手？").run())
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["db_pool"] = {"peak_checked_out": tracker.peak, "checkouts": tracker.checkouts}
+    return result
+
+
+def report(results: List[dict], wall: float, mock_stats: Optional[dict]) -> dict:
+    ok = [r for r in results if not r["error"]]
+    stages = {}
+    for stage in STAGES:
+        values = [r["timings"][stage] * 1000 for r in results if stage in r["timings"]]
+        if values:
+            stages[stage] = {"n": len(values), "p50": round(percentile(values, 50)),
+                             "p95": round(percentile(values, 95)), "p99": round(percentile(values, 99)),
+                             "max": round(max(values))}
+    verdicts: Dict[str, int] = {}
+    for r in ok:
+        for v in r.get("verdicts", []):
+            verdicts[v] = verdicts.get(v, 0) + 1
+    # 各进程峰值之和是数据库侧同时连接数的上限（各进程峰值未必同时出现）
+    peaks = [r["db_pool"]["peak_checked_out"] for r in results if r.get("db_pool")]
+    return {"students": len(results), "completed": len(ok), "failed": len(results) - len(ok),
+            "wall_seconds": round(wall, 2), "students_per_minute": round(len(ok) / wall * 60, 1) if wall else 0.0,
+            "stages_ms": stages, "verdicts": verdicts,
+            "db_pool": {"peak_checked_out": max(peaks, default=0), "sum_of_peaks": sum(peaks),
+                        "checkouts": sum(r["db_pool"]["checkouts"] for r in results if r.get("db_pool"))},
+            "mock_llm": mock_stats, "errors": [r["error"] for r in results if r["error"]][:20]}
+
+
+def print_report(rep: dict):
+    print(f"\n学生数 {rep['students']}，完成 {rep['completed']}，失败 {rep['failed']}，"
+          f"总耗时 {rep['wall_seconds']} 秒，吞吐 {rep['students_per_minute']} 人/分钟")
+    print(f"{'阶段':<8}{'次数':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for stage, s in rep["stages_ms"].items():
+        print(f"{stage:<8}{s['n']:>6}{s['p50']:>10}{s['p95']:>10}{s['p99']:>10}{s['max']:>10}")
+    print(f"判题结果：{rep['verdicts']}")
+    print(f"数据库连接：单进程峰值借出 {rep['db_pool']['peak_checked_out']}，"
+          f"各进程峰值合计 {rep['db_pool']['sum_of_peaks']}，累计借出 {rep['db_pool']['checkouts']}")
+    if rep["mock_llm"]:
+        m = rep["mock_llm"]
+        print(f"模拟大模型：请求 {m['requests']}（流式 {m['streams']}），峰值并发 {m['peak_in_flight']}，"
+              f"注入错误 {m['errors']}，限流 {m['rate_limited']}")
+    for err in rep["errors"]:
+        print(f"  ❌ {err}")
+
+
+if __name__ == "__main__":
+    # 用法：python loadtest.py --prepare --students 50
+    #       python loadtest.py --students 50 --concurrency 50 --mock --latency-ms 800 --rate-limit-rate 0.02
+    #       python loadtest.py --students 20 --llm-base-url http://127.0.0.1:8900   （使用单独启动的 mock_llm.py）
+    parser = argparse.ArgumentParser(description="并发学生压测")
+    parser.add_argument("--app", default="app.py")
+    parser.add_argument("--students", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=0, help="同时在线的学生数，默认等于 --students")
+    parser.add_argument("--ramp", type=float, default=0.0, help="在多少秒内陆续启动所有学生")
+    parser.add_argument("--course", default="高等数学")
+    parser.add_argument("--password", default="loadtest")
+    parser.add_argument("--correct-rate", type=float, default=0.5, help="有标准答案的题目按此比例填入正确答案")
+    parser.add_argument("--tutor-turns", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120.0, help="单次页面运行的超时秒数")
+    parser.add_argument("--prepare", action="store_true", help="只预先注册压测账号")
+    parser.add_argument("--mock", action="store_true", help="在压测主进程内启动模拟大模型服务")
+    parser.add_argument("--llm-base-url", default=None, help="指向已启动的模拟服务或其他兼容端点")
+    parser.add_argument("--json", default=None, help="把报告另存为 JSON 文件")
+    mock_llm.add_arguments(parser)
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.prepare:
+        prepare_students(args.students, args.password)
+        raise SystemExit(0)
+
+    server = None
+    if args.mock:
+        server = mock_llm.start_server(cfg=mock_llm.config_from_args(args))
+        args.llm_base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    if not args.llm_base_url:
+        parser.error("压测不应访问真实大模型，请使用 --mock 或 --llm-base-url")
+    os.environ["LLM_BASE_URL"] = args.llm_base_url
+    secrets = {k: os.getenv(k) or "" for k in ("DB_USER", "DB_PASSWORD", "DB_HOST", "DB_NAME")}
+    secrets["LLM_API_KEY"] = "loadtest"
+    concurrency = args.concurrency or args.students
+
+    # 子进程用 spawn 启动，不继承主进程里模拟服务的线程；LLM_BASE_URL 经环境变量传给子进程。
+    # AppTest 运行时会临时替换 sys.modules["__main__"]，任务函数要按模块名 loadtest.run_student 传递，
+    # 否则复用的工作进程反序列化下一个任务时找不到 __main__.run_student
+    from loadtest import run_student as student_task
+
+    started = time.monotonic()
+    args.ramp_start = time.time()
+    with ProcessPoolExecutor(max_workers=concurrency, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(student_task, i, args, secrets) for i in range(args.students)]
+        results = []
+        for i, fut in enumerate(futures):
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                results.append({"student": i, "timings": {}, "error": f"进程异常 {type(e).__name__}: {e}"})
+    wall = time.monotonic() - started
+
+    mock_stats = None
+    if server:
+        with server.RequestHandlerClass.cfg.lock:
+            mock_stats = dict(server.RequestHandlerClass.cfg.counts)
+        server.shutdown()
+    rep = report(results, wall, mock_stats)
+    print_report(rep)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,221 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text, Engine
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+FlushHook = Callable[[object, str, List[dict]], None]
+
+
+def _encode(table: str, row: dict) -> str:
+    dt_keys = [k for k, v in row.items() if isinstance(v, datetime)]
+    payload = {k: (v.isoformat() if k in dt_keys else v) for k, v in row.items()}
+    return json.dumps({"table": table, "row": payload, "dt": dt_keys}, ensure_ascii=False, default=str)
+
+
+def _decode(line: str) -> Tuple[str, dict]:
+    rec = json.loads(line)
+    row = rec["row"]
+    for k in rec.get("dt", []):
+        row[k] = datetime.fromisoformat(row[k])
+    return rec["table"], row
+
+
+def _is_outage(e: Exception) -> bool:
+    """连接断开、连接池超时、数据库锁忙等与具体行无关的错误：整批暂存，稍后重试。"""
+    return isinstance(e, (OperationalError, InterfaceError, PoolTimeoutError)) or getattr(e, "connection_invalidated", False)
+
+
+class LogWriter:
+    """日志异步落库：有界内存队列 + 后台线程按条数或时间间隔批量 executemany。
+
+    数据库不可用或队列写满时落盘到 spill 文件，下一次成功刷盘后自动回放。
+    某一批因数据本身出错时逐行重试，仍然失败的行和 spill 中无法解析的行移到 quarantine 文件，不再回放。
+    """
+
+    def __init__(self, engine: Engine, statements: Dict[str, str], max_queue: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 1.0, spill_path: str = "log_spill.jsonl", on_flush: Optional[FlushHook] = None,
+                 defaults: Optional[Dict[str, dict]] = None):
+        self.engine = engine
+        self.statements = statements
+        # 表结构新增字段后，旧版本写进 spill 文件的行回放时用这里的默认值补齐参数
+        self.defaults = defaults or {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.quarantine_path = spill_path + ".bad"
+        self.on_flush = on_flush
+        self._queue: "queue.Queue[Tuple[str, dict]]" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._spill_lock = threading.Lock()
+        self._replay_after = 0.0
+        self.metrics = {"enqueued": 0, "flushed": 0, "batches": 0, "spilled": 0, "replayed": 0,
+                        "quarantined": 0, "overflow": 0, "max_depth": 0, "last_flush_ms": 0.0}
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, table: str, row: dict):
+        try:
+            self._queue.put((table, row), timeout=0.05)
+        except queue.Full:
+            self.metrics["overflow"] += 1
+            self._spill([(table, row)])
+            return
+        self.metrics["enqueued"] += 1
+        self.metrics["max_depth"] = max(self.metrics["max_depth"], self._queue.qsize())
+
+    def _drain(self, batch: List[Tuple[str, dict]]) -> List[Tuple[str, dict]]:
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch: List[Tuple[str, dict]] = []
+            try:
+                try:
+                    first = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    self._replay_spill()
+                    continue
+                deadline = time.monotonic() + self.flush_interval
+                batch.append(first)
+                self._drain(batch)
+                while len(batch) < self.batch_size and time.monotonic() < deadline and not self._stop.is_set():
+                    time.sleep(min(0.05, max(0.0, deadline - time.monotonic())))
+                    self._drain(batch)
+                flushed, batch = self._flush(batch), []
+                if flushed:
+                    self._replay_spill()
+            except Exception as e:
+                logging.error(f"Log writer error: {e}")
+                # 已取出但还没交给 _flush 的行落盘，不随异常丢失
+                self._spill(batch)
+                self._stop.wait(self.flush_interval)
+
+    def _write_batch(self, batch: List[Tuple[str, dict]]):
+        grouped: Dict[str, List[dict]] = {}
+        for table, row in batch:
+            grouped.setdefault(table, []).append({**self.defaults.get(table, {}), **row})
+        with self.engine.connect() as conn:
+            for table, rows in grouped.items():
+                conn.execute(text(self.statements[table]), rows)
+                if self.on_flush:
+                    self.on_flush(conn, table, rows)
+            conn.commit()
+
+    def _flush(self, batch: List[Tuple[str, dict]]) -> bool:
+        if not batch:
+            return True
+        started = time.perf_counter()
+        rejected = 0
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            if _is_outage(e):
+                logging.error(f"Log flush error, spilling {len(batch)} rows: {getattr(e, 'orig', e)}")
+                self._spill(batch)
+                self._replay_after = time.monotonic() + 10 * self.flush_interval
+                return False
+            logging.error(f"Log flush error, retrying {len(batch)} rows one by one: {getattr(e, 'orig', e)}")
+            for i, item in enumerate(batch):
+                try:
+                    self._write_batch([item])
+                except Exception as row_error:
+                    if _is_outage(row_error):
+                        logging.error(f"Log flush error, spilling {len(batch) - i} rows: {getattr(row_error, 'orig', row_error)}")
+                        self._spill(batch[i:])
+                        self._replay_after = time.monotonic() + 10 * self.flush_interval
+                        return False
+                    logging.error(f"Log row rejected into {self.quarantine_path}: {getattr(row_error, 'orig', row_error)}")
+                    self._quarantine([_encode(*item)])
+                    rejected += 1
+        self.metrics["flushed"] += len(batch) - rejected
+        self.metrics["batches"] += 1
+        self.metrics["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return True
+
+    def _spill(self, batch: List[Tuple[str, dict]]):
+        if not batch:
+            return
+        with self._spill_lock:
+            try:
+                with open(self.spill_path, "a", encoding="utf-8") as fp:
+                    for table, row in batch:
+                        fp.write(_encode(table, row) + "\n")
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                self.metrics["spilled"] += len(batch)
+            except Exception as e:
+                logging.error(f"Log spill error, {len(batch)} rows lost: {e}")
+
+    def _quarantine(self, lines: List[str]):
+        with self._spill_lock:
+            try:
+                with open(self.quarantine_path, "a", encoding="utf-8") as fp:
+                    for line in lines:
+                        fp.write(line.rstrip("\n") + "\n")
+                self.metrics["quarantined"] += len(lines)
+            except Exception as e:
+                logging.error(f"Log quarantine error, {len(lines)} rows lost: {e}")
+
+    def _replay_spill(self):
+        if time.monotonic() < self._replay_after:
+            return
+        replaying = self.spill_path + ".replay"
+        with self._spill_lock:
+            # .replay 仍在说明上次回放没做完（进程中途退出），启动后第一次回放先把它处理完，spill 文件留到下一轮
+            if not os.path.exists(replaying):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replaying)
+        records, bad = [], []
+        with open(replaying, encoding="utf-8", errors="replace") as fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+                try:
+                    records.append(_decode(line))
+                except Exception as e:
+                    logging.error(f"Log spill line unreadable, quarantined: {e}")
+                    bad.append(line)
+        if bad:
+            self._quarantine(bad)
+        for i in range(0, len(records), self.batch_size):
+            chunk = records[i:i + self.batch_size]
+            if not self._flush(chunk):
+                # _flush 已把本批重新写回 spill 文件，剩余的也一并写回，等下次再试
+                self._spill(records[i + self.batch_size:])
+                break
+            self.metrics["replayed"] += len(chunk)
+        # 全部落库或写回 spill 后才删除；在此之前退出，下次启动会重放整个文件（日志可能重复，不会丢）
+        os.remove(replaying)
+
+    def flush(self):
+        """同步刷出当前队列中的全部日志（退出时或需要立即可见时调用）。"""
+        while True:
+            batch = self._drain([])
+            if not batch:
+                return
+            self._flush(batch)
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> dict:
+        return dict(self.metrics, depth=self._queue.qsize(), capacity=self._queue.maxsize)
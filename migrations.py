@@ -0,0 +1,203 @@
+import logging
+import sys
+from datetime import datetime
+from typing import Callable, List, Tuple, Union
+
+from sqlalchemy import inspect, text, Engine
+
+from db import acquire_lock, engine_from_env, is_sqlite, release_lock
+from question_io import backfill_content_hash
+
+# 数据库结构版本管理：每个迁移只执行一次，执行成功后记入 schema_migrations。
+# 新增表或字段时在 MIGRATIONS 末尾追加一项，已发布的迁移不要再修改。
+# SQLite 新库由 SQLITE_SCHEMA 一次建到 SQLITE_BASELINE 版本；之后追加的迁移须同时兼容 MySQL 与 SQLite：
+# 索引用单独的 CREATE INDEX，不用 ENUM / AUTO_INCREMENT，一条 ALTER TABLE 只加一列。
+
+BACKFILL_CHUNK = 50000
+
+
+def _note_interaction_logs_backfill(conn):
+    """结构化字段的数据回填可能涉及千万行，不放在应用启动路径上；已有日志时提示离线执行 python migrations.py backfill。"""
+    if conn.execute(text("SELECT 1 FROM interaction_logs LIMIT 1")).first():
+        logging.warning("interaction_logs structured columns are not backfilled yet, run: python migrations.py backfill")
+
+
+def backfill_interaction_logs(engine: Engine, start_id: int = 0, chunk: int = BACKFILL_CHUNK) -> int:
+    """离线回填：把 user_query 前缀 / ai_response 中文结论写入结构化字段。
+
+    按 id 分段、每段单独提交，避免长事务锁表；语句幂等，中断后可从打印的 id 处续跑。返回处理到的最大 id。
+    """
+    with engine.connect() as conn:
+        cast_type = "INTEGER" if is_sqlite(conn) else "SIGNED"
+        max_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM interaction_logs")).scalar()
+        conn.commit()
+        for lo in range(start_id, max_id, chunk):
+            conn.execute(text(
+                "UPDATE interaction_logs SET "
+                "kind = CASE WHEN user_query LIKE '【答案提交】%%' THEN 'submission' WHEN user_query LIKE '【辅导】%%' THEN 'tutoring' ELSE 'other' END, "
+                "is_correct = CASE WHEN user_query NOT LIKE '【答案提交】%%' THEN NULL WHEN ai_response IN ('正确', 'PASS') THEN 1 WHEN ai_response IN ('错误', 'FAIL') THEN 0 ELSE NULL END, "
+                f"qid = CAST(question_id AS {cast_type}) "
+                "WHERE id > :lo AND id <= :hi"), {"lo": lo, "hi": lo + chunk})
+            conn.commit()
+            print(f"已回填 id ≤ {min(lo + chunk, max_id)} / {max_id}")
+    return max_id
+
+
+def _unique_username(conn):
+    """注册改为单条 INSERT 判重，依赖 users.username 唯一索引；已有唯一约束或存在重复账号时跳过并记录日志。"""
+    insp = inspect(conn)
+    unique_cols = [c["column_names"] for c in insp.get_unique_constraints("users")]
+    unique_cols += [i["column_names"] for i in insp.get_indexes("users") if i.get("unique")]
+    if ["username"] in unique_cols:
+        return
+    dupes = conn.execute(text("SELECT username FROM users GROUP BY username HAVING COUNT(*) > 1 LIMIT 5")).fetchall()
+    if dupes:
+        logging.error(f"users.username has duplicates, unique index skipped: {[r[0] for r in dupes]}")
+        return
+    conn.execute(text("CREATE UNIQUE INDEX uq_users_username ON users (username)"))
+
+
+def _rename_dedupe_hash(conn):
+    """custom_questions.content_hash 是导入去重键（课程 + 规范化内容），与判题缓存用的题目 content_hash 不是一回事，改名避免混用。"""
+    if is_sqlite(conn):
+        conn.execute(text("DROP INDEX IF EXISTS idx_cq_content_hash"))
+        conn.execute(text("ALTER TABLE custom_questions RENAME COLUMN content_hash TO dedupe_hash"))
+    else:
+        conn.execute(text("DROP INDEX idx_cq_content_hash ON custom_questions"))
+        conn.execute(text("ALTER TABLE custom_questions CHANGE content_hash dedupe_hash CHAR(40) NULL"))
+    conn.execute(text("CREATE INDEX idx_cq_dedupe_hash ON custom_questions (dedupe_hash)"))
+
+
+Step = Union[str, Callable]
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "judge verdict cache", [
+        "CREATE TABLE IF NOT EXISTS judge_verdict_cache (cache_key CHAR(40) PRIMARY KEY, question_id INT NOT NULL, verdict TINYINT NOT NULL, created_at DATETIME NOT NULL, expires_at DATETIME NOT NULL, INDEX idx_jvc_qid (question_id))",
+    ]),
+    (2, "dashboard rollups", [
+        "CREATE TABLE IF NOT EXISTS rollup_daily_users (stat_date DATE NOT NULL, username VARCHAR(64) NOT NULL, PRIMARY KEY (stat_date, username))",
+        "CREATE TABLE IF NOT EXISTS rollup_daily_active (stat_date DATE PRIMARY KEY, user_count INT NOT NULL DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS rollup_course_time (course_name VARCHAR(128) PRIMARY KEY, total_seconds BIGINT NOT NULL DEFAULT 0, session_count INT NOT NULL DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS rollup_question_accuracy (course_name VARCHAR(128) NOT NULL, question_id INT NOT NULL, attempts INT NOT NULL DEFAULT 0, correct INT NOT NULL DEFAULT 0, PRIMARY KEY (course_name, question_id))",
+    ]),
+    (3, "structured interaction_logs columns", [
+        "ALTER TABLE interaction_logs ADD COLUMN kind ENUM('submission', 'tutoring', 'other') NOT NULL DEFAULT 'other', ADD COLUMN is_correct TINYINT(1) NULL, ADD COLUMN session_id INT NULL, ADD COLUMN qid INT NULL",
+    ]),
+    (4, "backfill interaction_logs structured columns", [_note_interaction_logs_backfill]),
+    (5, "indexes for report, history, dashboard and admin log queries", [
+        "CREATE INDEX idx_il_student_kind_qid ON interaction_logs (student_id, kind, qid, id)",
+        "CREATE INDEX idx_il_created_at ON interaction_logs (created_at)",
+        "CREATE INDEX idx_login_logs_time ON login_logs (login_time)",
+        "CREATE INDEX idx_ss_start_time ON study_sessions (start_time)",
+        "CREATE INDEX idx_ss_username ON study_sessions (username)",
+        "CREATE INDEX idx_cq_category ON custom_questions (category)",
+    ]),
+    (6, "custom_questions content hash for import dedupe", [
+        "ALTER TABLE custom_questions ADD COLUMN content_hash CHAR(40) NULL",
+        backfill_content_hash,
+        "CREATE INDEX idx_cq_content_hash ON custom_questions (content_hash)",
+    ]),
+    (7, "llm call metrics", [
+        "CREATE TABLE IF NOT EXISTS llm_call_metrics (id BIGINT AUTO_INCREMENT PRIMARY KEY, created_at DATETIME NOT NULL, kind VARCHAR(16) NOT NULL, course VARCHAR(128) NULL, prompt_version VARCHAR(32) NULL, model VARCHAR(32) NULL, latency_ms INT NOT NULL, ttft_ms INT NULL, tokens_per_sec FLOAT NULL, prompt_tokens INT NOT NULL DEFAULT 0, completion_tokens INT NOT NULL DEFAULT 0, cached_tokens INT NOT NULL DEFAULT 0, retries INT NOT NULL DEFAULT 0, error VARCHAR(64) NULL, INDEX idx_lcm_created_at (created_at), INDEX idx_lcm_kind_created (kind, created_at))",
+    ]),
+    (8, "quiz answer drafts", [
+        "CREATE TABLE IF NOT EXISTS quiz_drafts (username VARCHAR(64) NOT NULL, question_id INT NOT NULL, answer TEXT NULL, updated_at DATETIME NOT NULL, PRIMARY KEY (username, question_id))",
+    ]),
+    (9, "unique usernames for atomic registration", [_unique_username]),
+    (10, "rename custom_questions.content_hash to dedupe_hash", [_rename_dedupe_hash]),
+]
+
+SQLITE_BASELINE = 7
+SQLITE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, username VARCHAR(64) NOT NULL UNIQUE, password_hash VARCHAR(255) NOT NULL, role VARCHAR(16) NOT NULL DEFAULT 'student', current_quiz_ids TEXT NULL)",
+    "CREATE TABLE IF NOT EXISTS login_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, username VARCHAR(64) NOT NULL, login_time DATETIME NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS study_sessions (id INTEGER PRIMARY KEY AUTOINCREMENT, username VARCHAR(64) NOT NULL, course_name VARCHAR(128) NOT NULL, start_time DATETIME NOT NULL, end_time DATETIME NULL, duration_seconds INT NULL)",
+    "CREATE TABLE IF NOT EXISTS interaction_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, question_id INT NULL, student_id VARCHAR(64) NOT NULL, user_query TEXT NULL, ai_response TEXT NULL, is_leaking_answer TINYINT NOT NULL DEFAULT 0, created_at DATETIME NOT NULL, kind VARCHAR(16) NOT NULL DEFAULT 'other' CHECK (kind IN ('submission', 'tutoring', 'other')), is_correct TINYINT NULL, session_id INT NULL, qid INT NULL)",
+    "CREATE TABLE IF NOT EXISTS custom_courses (id INTEGER PRIMARY KEY AUTOINCREMENT, course_name VARCHAR(128) NOT NULL UNIQUE, description TEXT NULL)",
+    "CREATE TABLE IF NOT EXISTS custom_questions (id INTEGER PRIMARY KEY AUTOINCREMENT, category VARCHAR(128) NOT NULL, content TEXT NOT NULL, answer TEXT NULL, solution TEXT NULL, content_hash CHAR(40) NULL)",
+    "CREATE TABLE IF NOT EXISTS system_configs (config_key VARCHAR(64) PRIMARY KEY, config_value TEXT NULL)",
+    "CREATE TABLE IF NOT EXISTS judge_verdict_cache (cache_key CHAR(40) PRIMARY KEY, question_id INT NOT NULL, verdict TINYINT NOT NULL, created_at DATETIME NOT NULL, expires_at DATETIME NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_jvc_qid ON judge_verdict_cache (question_id)",
+    "CREATE TABLE IF NOT EXISTS rollup_daily_users (stat_date DATE NOT NULL, username VARCHAR(64) NOT NULL, PRIMARY KEY (stat_date, username))",
+    "CREATE TABLE IF NOT EXISTS rollup_daily_active (stat_date DATE PRIMARY KEY, user_count INT NOT NULL DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS rollup_course_time (course_name VARCHAR(128) PRIMARY KEY, total_seconds BIGINT NOT NULL DEFAULT 0, session_count INT NOT NULL DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS rollup_question_accuracy (course_name VARCHAR(128) NOT NULL, question_id INT NOT NULL, attempts INT NOT NULL DEFAULT 0, correct INT NOT NULL DEFAULT 0, PRIMARY KEY (course_name, question_id))",
+    "CREATE INDEX IF NOT EXISTS idx_il_student_kind_qid ON interaction_logs (student_id, kind, qid, id)",
+    "CREATE INDEX IF NOT EXISTS idx_il_created_at ON interaction_logs (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_login_logs_time ON login_logs (login_time)",
+    "CREATE INDEX IF NOT EXISTS idx_ss_start_time ON study_sessions (start_time)",
+    "CREATE INDEX IF NOT EXISTS idx_ss_username ON study_sessions (username)",
+    "CREATE INDEX IF NOT EXISTS idx_cq_category ON custom_questions (category)",
+    "CREATE INDEX IF NOT EXISTS idx_cq_content_hash ON custom_questions (content_hash)",
+    "CREATE TABLE IF NOT EXISTS llm_call_metrics (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at DATETIME NOT NULL, kind VARCHAR(16) NOT NULL, course VARCHAR(128) NULL, prompt_version VARCHAR(32) NULL, model VARCHAR(32) NULL, latency_ms INT NOT NULL, ttft_ms INT NULL, tokens_per_sec FLOAT NULL, prompt_tokens INT NOT NULL DEFAULT 0, completion_tokens INT NOT NULL DEFAULT 0, cached_tokens INT NOT NULL DEFAULT 0, retries INT NOT NULL DEFAULT 0, error VARCHAR(64) NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_lcm_created_at ON llm_call_metrics (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_lcm_kind_created ON llm_call_metrics (kind, created_at)",
+]
+
+
+def _bootstrap_sqlite(conn) -> int:
+    """SQLite 空库：直接建出 SQLITE_BASELINE 版本的完整结构，并把之前的迁移记为已执行。"""
+    for stmt in SQLITE_SCHEMA:
+        conn.execute(text(stmt))
+    conn.execute(text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                 [{"v": v, "d": desc, "t": datetime.now()} for v, desc, _ in MIGRATIONS if v <= SQLITE_BASELINE])
+    conn.commit()
+    logging.warning(f"Bootstrapped SQLite schema at version {SQLITE_BASELINE}")
+    return SQLITE_BASELINE
+
+
+def current_version(conn) -> int:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations (version INT PRIMARY KEY, description VARCHAR(255) NOT NULL, applied_at DATETIME NOT NULL)"))
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar()
+
+
+def upgrade(engine: Engine) -> List[int]:
+    """执行所有未执行的迁移，返回本次执行的版本号。多进程同时启动时由 GET_LOCK 串行化。"""
+    applied = []
+    with engine.connect() as conn:
+        if not acquire_lock(conn, "schema_migrations", 60):
+            raise RuntimeError("could not acquire schema migration lock")
+        try:
+            version = current_version(conn)
+            conn.commit()
+            if version == 0 and is_sqlite(conn):
+                version = _bootstrap_sqlite(conn)
+            for v, desc, steps in MIGRATIONS:
+                if v <= version:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(text(step))
+                conn.execute(text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                             {"v": v, "d": desc, "t": datetime.now()})
+                conn.commit()
+                applied.append(v)
+                logging.warning(f"Applied schema migration {v}: {desc}")
+        finally:
+            release_lock(conn, "schema_migrations")
+    return applied
+
+
+if __name__ == "__main__":
+    # 用法：python migrations.py [upgrade|status|backfill [起始id]]
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    engine = engine_from_env()
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if cmd == "status":
+        with engine.connect() as conn:
+            v = current_version(conn)
+            conn.commit()
+        print(f"当前结构版本：{v} / 最新版本：{MIGRATIONS[-1][0]}")
+    elif cmd == "upgrade":
+        done = upgrade(engine)
+        print(f"✅ 已执行迁移：{done}" if done else "✅ 数据库结构已是最新")
+    elif cmd == "backfill":
+        backfill_interaction_logs(engine, int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+        print("✅ interaction_logs 结构化字段回填完成")
+    else:
+        print("用法：python migrations.py [upgrade|status|backfill [起始id]]")
+        sys.exit(1)
@@ -0,0 +1,293 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+from prompts import BATCH_JUDGE_PROMPT_SYSTEM, JUDGE_PROMPT_SYSTEM, SUMMARY_PROMPT_SYSTEM
+from tutor_context import count_tokens
+
+# 本地压测用的 OpenAI 兼容模拟服务：/chat/completions 与 /v1/chat/completions，支持 SSE 流式输出。
+# 延迟按对数正态分布抽样，流式按固定生成速度逐块输出，可按比例注入 500 / 429 错误。
+# 判题结果是确定的：学生答案与标准答案规范化后一致（或包含标准答案）为 PASS，没有标准答案时按答案哈希奇偶判定。
+# 前缀缓存按消息边界模拟：请求开头与此前见过的请求相同的若干条消息计入 prompt_cache_hit_tokens。
+
+TUTOR_SENTENCES = [
+    "我们先回到题目本身，看看已知条件能推出什么。",
+    "注意 \\( f(x) \\) 在这一点附近的变化趋势，先别急着代入数值。",
+    "可以试着把式子写成 \\( \\frac{a}{b} \\) 的形式，再观察分子分母的阶。",
+    "回忆一下相关定义，\\[ \\lim_{x \\to 0} \\frac{\\sin x}{x} = 1 \\] 这个结论在这里有帮助吗？",
+    "先判断每一步变形是否等价，尤其是两边同时平方的时候。",
+    "如果卡住了，可以先考虑一个更简单的特例，比如 \\( n = 1 \\) 的情形。",
+    "\n\n换个角度想：题目真正要求的量是什么？它和哪些条件直接相关？",
+    "检查一下符号和边界条件，很多错误都出在这里。",
+]
+
+_ANSWER_RE = re.compile(r"标准答案：(.*)")
+_STUDENT_RE = re.compile(r"学生答案：(.*)", re.S)
+
+
+def _norm(s: str) -> str:
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", s or "")).lower()
+
+
+def judge_block(block: str) -> bool:
+    std = _ANSWER_RE.search(block)
+    stu = _STUDENT_RE.search(block)
+    student = _norm(stu.group(1)) if stu else ""
+    if std and _norm(std.group(1)):
+        answer = _norm(std.group(1))
+        return student == answer or (len(answer) >= 1 and answer in student)
+    return int(hashlib.sha1(student.encode('utf-8')).hexdigest(), 16) % 2 == 0
+
+
+class MockConfig:
+    def __init__(self, latency_ms: float = 800.0, latency_sigma: float = 0.5, ttft_ms: float = 400.0,
+                 tokens_per_sec: float = 40.0, tutor_tokens: int = 160, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, cache_entries: int = 20000, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.ttft_ms = ttft_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.tutor_tokens = tutor_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.cache_entries = cache_entries
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.prefixes: "OrderedDict[str, None]" = OrderedDict()
+        self.counts = {"requests": 0, "streams": 0, "errors": 0, "rate_limited": 0, "in_flight": 0, "peak_in_flight": 0}
+
+    def sample_ms(self, median: float) -> float:
+        if median <= 0:
+            return 0.0
+        with self.lock:
+            return self.rng.lognormvariate(0, self.latency_sigma) * median
+
+    def roll(self, rate: float) -> bool:
+        with self.lock:
+            return rate > 0 and self.rng.random() < rate
+
+    def cached_tokens(self, messages: List[dict]) -> int:
+        """返回与历史请求相同的最长消息前缀的 token 数，并记住本次请求的所有前缀。"""
+        h = hashlib.sha1()
+        hit, running = 0, 0
+        with self.lock:
+            for m in messages:
+                h.update(f"{m.get('role')}\x1f{m.get('content')}\x1e".encode('utf-8'))
+                running += count_tokens(str(m.get("content") or ""))
+                key = h.hexdigest()
+                if key in self.prefixes:
+                    self.prefixes.move_to_end(key)
+                    hit = running
+                else:
+                    self.prefixes[key] = None
+                    if len(self.prefixes) > self.cache_entries:
+                        self.prefixes.popitem(last=False)
+        return hit
+
+    def tutor_text(self) -> str:
+        parts, n = [], 0
+        with self.lock:
+            while n < self.tutor_tokens:
+                s = self.rng.choice(TUTOR_SENTENCES)
+                parts.append(s)
+                n += count_tokens(s)
+        return "".join(parts)
+
+
+def reply_for(cfg: MockConfig, body: dict) -> str:
+    messages = body.get("messages") or []
+    system = messages[0].get("content") if messages and messages[0].get("role") == "system" else ""
+    user = "\n".join(str(m.get("content") or "") for m in messages if m.get("role") == "user")
+    if system == BATCH_JUDGE_PROMPT_SYSTEM:
+        blocks = re.split(r"【第(\d+)题】", user)[1:]
+        results = [{"id": int(blocks[i]), "verdict": "PASS" if judge_block(blocks[i + 1]) else "FAIL"}
+                   for i in range(0, len(blocks), 2)]
+        return json.dumps({"results": results}, ensure_ascii=False)
+    if system == JUDGE_PROMPT_SYSTEM:
+        return "PASS" if judge_block(user) else "FAIL"
+    if system == SUMMARY_PROMPT_SYSTEM:
+        return "学生在求解过程中多次询问思路，已提示其回到定义并检查变形是否等价。"
+    return cfg.tutor_text()
+
+
+def split_chunks(text: str, rng: random.Random) -> List[str]:
+    out, i = [], 0
+    while i < len(text):
+        n = rng.randint(1, 4)
+        out.append(text[i:i + n])
+        i += n
+    return out
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    cfg: MockConfig = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status: int, obj: dict, headers: Optional[dict] = None):
+        data = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/stats", "/v1/stats"):
+            with self.cfg.lock:
+                self._send_json(200, dict(self.cfg.counts))
+        elif self.path.rstrip("/") in ("/models", "/v1/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "deepseek-chat", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if self.path.rstrip("/") not in ("/chat/completions", "/v1/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        try:
+            body = json.loads(raw or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid json", "type": "invalid_request_error"}})
+            return
+        cfg = self.cfg
+        with cfg.lock:
+            cfg.counts["requests"] += 1
+            cfg.counts["in_flight"] += 1
+            cfg.counts["peak_in_flight"] = max(cfg.counts["peak_in_flight"], cfg.counts["in_flight"])
+        try:
+            self._complete(cfg, body)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        finally:
+            with cfg.lock:
+                cfg.counts["in_flight"] -= 1
+
+    def _complete(self, cfg: MockConfig, body: dict):
+        if cfg.roll(cfg.rate_limit_rate):
+            with cfg.lock:
+                cfg.counts["rate_limited"] += 1
+            time.sleep(cfg.sample_ms(cfg.ttft_ms / 4) / 1000)
+            self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit_error"}},
+                            {"Retry-After": "1"})
+            return
+        if cfg.roll(cfg.error_rate):
+            with cfg.lock:
+                cfg.counts["errors"] += 1
+            time.sleep(cfg.sample_ms(cfg.latency_ms) / 1000)
+            self._send_json(500, {"error": {"message": "injected failure", "type": "server_error"}})
+            return
+
+        messages = body.get("messages") or []
+        model = body.get("model") or "deepseek-chat"
+        content = reply_for(cfg, body)
+        prompt_tokens = sum(count_tokens(str(m.get("content") or "")) for m in messages)
+        cached = cfg.cached_tokens(messages)
+        completion_tokens = count_tokens(content)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens, "prompt_cache_hit_tokens": cached,
+                 "prompt_cache_miss_tokens": prompt_tokens - cached}
+        cid = "chatcmpl-mock-" + hashlib.sha1(f"{time.time()}{id(body)}".encode()).hexdigest()[:12]
+        created = int(time.time())
+
+        if not body.get("stream"):
+            time.sleep(cfg.sample_ms(cfg.latency_ms) / 1000)
+            self._send_json(200, {"id": cid, "object": "chat.completion", "created": created, "model": model,
+                                  "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                               "finish_reason": "stop"}], "usage": usage})
+            return
+
+        with cfg.lock:
+            cfg.counts["streams"] += 1
+        time.sleep(cfg.sample_ms(cfg.ttft_ms) / 1000)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(delta: dict, finish: Optional[str] = None) -> bytes:
+            return ("data: " + json.dumps({"id": cid, "object": "chat.completion.chunk", "created": created,
+                                           "model": model, "choices": [{"index": 0, "delta": delta,
+                                                                        "finish_reason": finish}]},
+                                          ensure_ascii=False) + "\n\n").encode('utf-8')
+
+        self._chunk(event({"role": "assistant", "content": ""}))
+        with cfg.lock:
+            pieces = split_chunks(content, cfg.rng)
+        started = time.monotonic()
+        sent = 0
+        for piece in pieces:
+            self._chunk(event({"content": piece}))
+            sent += count_tokens(piece)
+            if cfg.tokens_per_sec > 0:
+                ahead = sent / cfg.tokens_per_sec - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        self._chunk(event({}, "stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._chunk(("data: " + json.dumps({"id": cid, "object": "chat.completion.chunk", "created": created,
+                                                "model": model, "choices": [], "usage": usage}) + "\n\n").encode())
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, cfg: Optional[MockConfig] = None) -> ThreadingHTTPServer:
+    """在后台线程启动模拟服务并返回 server；port 为 0 时自动分配，实际地址见 server.server_address。"""
+    handler = type("BoundMockHandler", (MockHandler,), {"cfg": cfg or MockConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="mock-llm").start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="非流式调用延迟中位数 (ms)")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="对数正态分布的 sigma，越大长尾越重")
+    parser.add_argument("--ttft-ms", type=float, default=400.0, help="流式首字延迟中位数 (ms)")
+    parser.add_argument("--tps", type=float, default=40.0, help="流式生成速度 (tokens/s)，0 表示不限速")
+    parser.add_argument("--tutor-tokens", type=int, default=160, help="每次辅导回复的大致 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args) -> MockConfig:
+    return MockConfig(latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, ttft_ms=args.ttft_ms,
+                      tokens_per_sec=args.tps, tutor_tokens=args.tutor_tokens, error_rate=args.error_rate,
+                      rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+
+
+if __name__ == "__main__":
+    # 用法：python mock_llm.py --port 8900 --latency-ms 600 --rate-limit-rate 0.02
+    #       然后以 LLM_BASE_URL=http://127.0.0.1:8900 启动应用
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地模拟大模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    srv = start_server(args.host, args.port, config_from_args(args))
+    print(f"模拟大模型服务已启动：http://{args.host}:{srv.server_address[1]}（Ctrl+C 退出）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
@@ -0,0 +1,392 @@
+import math
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from grading import PASS, FAIL
+
+# 本地确定性预判：把 LaTeX / 纯文本答案解析成表达式，做数值相等与随机取点等价比较。
+# 只在有把握时给出 PASS/FAIL，其余一律返回 None 交给大模型。
+
+FUNCTIONS: Dict[str, Callable[[float], float]] = {
+    "arcsin": math.asin, "arccos": math.acos, "arctan": math.atan,
+    "sinh": math.sinh, "cosh": math.cosh, "tanh": math.tanh,
+    "sin": math.sin, "cos": math.cos, "tan": math.tan,
+    "cot": lambda x: 1 / math.tan(x), "sec": lambda x: 1 / math.cos(x), "csc": lambda x: 1 / math.sin(x),
+    "ln": math.log, "log": math.log, "exp": math.exp, "sqrt": math.sqrt,
+}
+CONSTANTS = {"pi": math.pi, "e": math.e, "inf": math.inf}
+_NAMES = sorted(list(FUNCTIONS) + list(CONSTANTS), key=len, reverse=True)
+
+_LATEX_DROP = re.compile(r"\\left|\\right|\\displaystyle|\\[,;:! ]|\\\(|\\\)|\\\[|\\\]|\$")
+_LATEX_REPLACE = [("\\cdot", "*"), ("\\times", "*"), ("\\div", "/"), ("\\infty", "inf"),
+                  ("×", "*"), ("·", "*"), ("÷", "/"), ("π", "pi"), ("∞", "inf"), ("√", "sqrt"), ("**", "^")]
+_TOKEN = re.compile(r"\s*(?:(\d+\.\d*|\.\d+|\d+)|([A-Za-z]+)|([-+*/^()!|]))")
+_SAMPLE_POINTS = (0.37, 1.23, 2.71, -0.61, 1.87)
+# 1e3 这类科学计数法会被读成 1·e·3，本地不判
+_SCI_NOTATION = re.compile(r"\d\.?[eE][+-]?\d")
+# 171! 已超出 float 范围；再大的阶乘 math.factorial 会长时间占住 GIL
+MAX_FACTORIAL = 170
+
+
+class _ParseError(Exception):
+    pass
+
+
+def _factorial(x: float) -> float:
+    if x > MAX_FACTORIAL:
+        raise _ParseError("factorial too large")
+    return float(math.factorial(int(x)))
+
+
+def _match_group(s: str, start: int) -> int:
+    """s[start] 为 '{' 时返回与之配对的 '}' 下标。"""
+    depth = 0
+    for i in range(start, len(s)):
+        if s[i] == "{":
+            depth += 1
+        elif s[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return i
+    raise _ParseError("unbalanced braces")
+
+
+def _expand_latex(s: str) -> str:
+    out = []
+    i = 0
+    while i < len(s):
+        m = re.match(r"\\[dt]?frac\s*\{", s[i:])
+        if m:
+            a_start = i + m.end() - 1
+            a_end = _match_group(s, a_start)
+            if a_end + 1 >= len(s) or s[a_end + 1] != "{":
+                raise _ParseError("bad \\frac")
+            b_end = _match_group(s, a_end + 1)
+            out.append(f"(({_expand_latex(s[a_start + 1:a_end])})/({_expand_latex(s[a_end + 2:b_end])}))")
+            i = b_end + 1
+            continue
+        m = re.match(r"\\sqrt\s*(?:\[([^\]]+)\])?\s*\{", s[i:])
+        if m:
+            a_start = i + m.end() - 1
+            a_end = _match_group(s, a_start)
+            inner = _expand_latex(s[a_start + 1:a_end])
+            out.append(f"(({inner})^(1/({m.group(1)})))" if m.group(1) else f"sqrt({inner})")
+            i = a_end + 1
+            continue
+        m = re.match(r"\\([A-Za-z]+)", s[i:])
+        if m:
+            if m.group(1) not in FUNCTIONS and m.group(1) not in CONSTANTS:
+                raise _ParseError(f"unsupported command \\{m.group(1)}")
+            out.append(f" {m.group(1)} ")
+            i += m.end()
+            continue
+        out.append({"{": "(", "}": ")"}.get(s[i], s[i]))
+        i += 1
+    return "".join(out)
+
+
+# 不等号、约等号及其 LaTeX 写法；这类答案方向和范围都要比较，本地不判
+_RELATION = re.compile(r"[<>≤≥≠≈]|!=|\\(?:le|ge|leq|geq|lt|gt|ne|neq|approx)(?![A-Za-z])")
+# 带中文的答案（“x=1 或 x=2”、“a=1 且 b=2”等）可能包含多个条件，交给大模型
+_CJK = re.compile(r"[\u3400-\u9fff]")
+_LEADING_VAR = re.compile(r"([A-Za-z])\s*=")
+
+
+def normalize_text(raw: str) -> str:
+    """去掉空白和末尾标点，只用于判断两份答案是否逐字相同。"""
+    s = unicodedata.normalize("NFKC", raw or "")
+    return re.sub(r"\s+", "", s).rstrip("。.，,")
+
+
+def normalize_expression(raw: str) -> Optional[Tuple[str, str]]:
+    """返回 (等号左侧的变量名, 表达式)，没有 “x =” 前缀时变量名为空串。
+
+    只去掉开头的一个 “变量 =”；不等式、多个等式、带中文连接词的答案无法可靠比较，返回 None。
+    """
+    s = unicodedata.normalize("NFKC", raw or "").strip()
+    if _RELATION.search(s) or _CJK.search(s):
+        return None
+    s = _LATEX_DROP.sub("", s)
+    for a, b in _LATEX_REPLACE:
+        s = s.replace(a, b)
+    s = s.strip()
+    var = ""
+    m = _LEADING_VAR.match(s)
+    if m:
+        var, s = m.group(1), s[m.end():]
+    if "=" in s:
+        return None
+    return var, s.strip().rstrip("。.，,").strip()
+
+
+def _tokenize(s: str) -> List[Tuple[str, str]]:
+    tokens = []
+    pos = 0
+    s = s.rstrip()
+    while pos < len(s):
+        m = _TOKEN.match(s, pos)
+        if not m:
+            raise _ParseError(f"unexpected character {s[pos]!r}")
+        pos = m.end()
+        if m.group(1):
+            tokens.append(("num", m.group(1)))
+        elif m.group(2):
+            word = m.group(2)
+            while word:
+                name = next((n for n in _NAMES if word.startswith(n)), None)
+                if name:
+                    tokens.append(("func" if name in FUNCTIONS else "const", name))
+                    word = word[len(name):]
+                else:
+                    tokens.append(("var", word[0]))
+                    word = word[1:]
+        else:
+            tokens.append(("op", m.group(3)))
+    return tokens
+
+
+class _Parser:
+    """递归下降解析，支持隐式乘法（2x、2\\pi、x\\sin x）与省略括号的函数调用（\\sin x）。"""
+
+    def __init__(self, tokens: List[Tuple[str, str]]):
+        self.tokens = tokens
+        self.pos = 0
+        self.variables = set()
+        self.decimals = 0
+
+    def peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self) -> Tuple[str, str]:
+        tok = self.peek()
+        if tok is None:
+            raise _ParseError("unexpected end")
+        self.pos += 1
+        return tok
+
+    def expect(self, op: str):
+        if self.take() != ("op", op):
+            raise _ParseError(f"expected {op}")
+
+    def parse(self):
+        node = self.expr()
+        if self.peek() is not None:
+            raise _ParseError("trailing tokens")
+        return node
+
+    def expr(self):
+        node = self.term()
+        while self.peek() in (("op", "+"), ("op", "-")):
+            op = self.take()[1]
+            rhs = self.term()
+            node = (lambda a, b: lambda env: a(env) + b(env))(node, rhs) if op == "+" else \
+                (lambda a, b: lambda env: a(env) - b(env))(node, rhs)
+        return node
+
+    def _starts_primary(self) -> bool:
+        tok = self.peek()
+        return tok is not None and (tok[0] in ("num", "var", "const", "func") or tok == ("op", "("))
+
+    def term(self):
+        node = self.unary()
+        while True:
+            tok = self.peek()
+            if tok in (("op", "*"), ("op", "/")):
+                self.take()
+                rhs = self.unary()
+                node = (lambda a, b: lambda env: a(env) * b(env))(node, rhs) if tok[1] == "*" else \
+                    (lambda a, b: lambda env: a(env) / b(env))(node, rhs)
+            elif self._starts_primary():
+                rhs = self.power()
+                node = (lambda a, b: lambda env: a(env) * b(env))(node, rhs)
+            else:
+                return node
+
+    def unary(self):
+        tok = self.peek()
+        if tok == ("op", "-"):
+            self.take()
+            inner = self.unary()
+            return lambda env: -inner(env)
+        if tok == ("op", "+"):
+            self.take()
+            return self.unary()
+        return self.power()
+
+    def power(self):
+        base = self.postfix()
+        if self.peek() == ("op", "^"):
+            self.take()
+            exponent = self.unary()
+            return lambda env: base(env) ** exponent(env)
+        return base
+
+    def postfix(self):
+        node = self.primary()
+        while self.peek() == ("op", "!"):
+            self.take()
+            node = (lambda a: lambda env: _factorial(a(env)))(node)
+        return node
+
+    def function_argument(self):
+        # \sin 2x 读作 sin(2x)；遇到下一个函数名或运算符为止，\sin x \cos x 仍是 sin(x)·cos(x)
+        node = self.power()
+        while self._starts_primary() and self.peek()[0] != "func":
+            rhs = self.power()
+            node = (lambda a, b: lambda env: a(env) * b(env))(node, rhs)
+        return node
+
+    def primary(self):
+        kind, val = self.take()
+        if kind == "num":
+            if "." in val:
+                self.decimals = max(self.decimals, len(val.split(".")[1]))
+            number = float(val)
+            return lambda env: number
+        if kind == "const":
+            number = CONSTANTS[val]
+            return lambda env: number
+        if kind == "var":
+            self.variables.add(val)
+            return lambda env: env[val]
+        if kind == "func":
+            fn = FUNCTIONS[val]
+            if self.peek() == ("op", "^"):
+                # \sin^2 x
+                self.take()
+                exponent = self.unary()
+                arg = self.function_argument()
+                return lambda env: fn(arg(env)) ** exponent(env)
+            arg = self.function_argument()
+            return lambda env: fn(arg(env))
+        if (kind, val) == ("op", "("):
+            node = self.expr()
+            self.expect(")")
+            return node
+        if (kind, val) == ("op", "|"):
+            node = self.expr()
+            self.expect("|")
+            return lambda env: abs(node(env))
+        raise _ParseError(f"unexpected token {val!r}")
+
+
+@lru_cache(maxsize=8192)
+def compile_answer(raw: str) -> Optional[Tuple[Tuple[Callable, ...], FrozenSet[str], int]]:
+    """解析为 (逗号分隔的各分量表达式, 自由变量, 最大小数位数)；无法解析返回 None。"""
+    normalized = normalize_expression(raw)
+    if normalized is None or not normalized[1]:
+        return None
+    s = normalized[1]
+    if _SCI_NOTATION.search(s):
+        return None
+    parts = [p for p in re.split(r"[,;]", s) if p.strip()]
+    try:
+        compiled, variables, decimals = [], set(), 0
+        for part in parts:
+            parser = _Parser(_tokenize(_expand_latex(part)))
+            compiled.append(parser.parse())
+            variables |= parser.variables
+            decimals = max(decimals, parser.decimals)
+    except (_ParseError, RecursionError):
+        return None
+    return tuple(compiled), frozenset(variables), decimals
+
+
+def _evaluate(fn: Callable, env: Dict[str, float]) -> Optional[float]:
+    try:
+        value = fn(env)
+    except (ValueError, ZeroDivisionError, OverflowError, TypeError, _ParseError):
+        return None
+    if isinstance(value, complex) or math.isnan(value):
+        return None
+    return float(value)
+
+
+def _close(a: float, b: float, tol: float) -> bool:
+    if math.isinf(a) or math.isinf(b):
+        return a == b
+    return abs(a - b) <= max(tol, 1e-9 * max(abs(a), abs(b)))
+
+
+class PreJudge:
+    """对有标准答案的题目做本地判定，并统计本地解决比例。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.local_pass = 0
+        self.local_fail = 0
+
+    def judge(self, q: dict, ans: str) -> Optional[str]:
+        verdict = self._judge(q.get("answer", "") or "", ans or "")
+        with self._lock:
+            self.total += 1
+            if verdict == PASS:
+                self.local_pass += 1
+            elif verdict == FAIL:
+                self.local_fail += 1
+        return verdict
+
+    @staticmethod
+    def _judge(std: str, ans: str) -> Optional[str]:
+        if not std.strip() or not ans.strip():
+            return None
+        if normalize_text(std) == normalize_text(ans):
+            return PASS
+        std_n, ans_n = normalize_expression(std), normalize_expression(ans)
+        if std_n is None or ans_n is None:
+            return None
+        # “x = 1” 与 “1” 可以比较，“a = 1” 与 “b = 1” 不行
+        if std_n[0] and ans_n[0] and std_n[0] != ans_n[0]:
+            return None
+        std_c, ans_c = compile_answer(std), compile_answer(ans)
+        if std_c is None or ans_c is None:
+            return None
+        (std_fns, std_vars, std_dec), (ans_fns, ans_vars, ans_dec) = std_c, ans_c
+        if len(std_fns) != len(ans_fns) or std_vars != ans_vars:
+            return None
+        # 只有数值相等才判对；差距在任一方的舍入范围内（0.25 与 0.3）说明可能只是精度不同，交给大模型
+        rounding = max(0.5 * 10 ** -std_dec if std_dec else 0.0, 0.5 * 10 ** -ans_dec if ans_dec else 0.0)
+
+        if not std_vars:
+            std_vals = [_evaluate(f, {}) for f in std_fns]
+            ans_vals = [_evaluate(f, {}) for f in ans_fns]
+            if None in std_vals or None in ans_vals:
+                return None
+            if all(_close(a, b, 0.0) for a, b in zip(std_vals, ans_vals)):
+                return PASS
+            if all(_close(a, b, rounding) for a, b in zip(std_vals, ans_vals)):
+                return None
+            if all(_close(a, b, rounding) for a, b in zip(sorted(std_vals), sorted(ans_vals))):
+                # 顺序不同：解集可以换序，坐标不行，看不出题意
+                return None
+            return FAIL
+
+        if len(std_fns) != 1:
+            return None
+        names = sorted(std_vars)
+        agree = disagree = 0
+        for k, point in enumerate(_SAMPLE_POINTS):
+            env = {v: point + 0.29 * j for j, v in enumerate(names)}
+            a, b = _evaluate(std_fns[0], env), _evaluate(ans_fns[0], env)
+            if a is None or b is None:
+                continue
+            if _close(a, b, 1e-7 * max(1.0, abs(a))):
+                agree += 1
+            elif _close(a, b, rounding):
+                return None
+            else:
+                disagree += 1
+        if agree >= 3 and not disagree:
+            return PASS
+        if disagree >= 2 and not agree:
+            return FAIL
+        return None
+
+    def stats(self) -> dict:
+        resolved = self.local_pass + self.local_fail
+        return {"total": self.total, "local_pass": self.local_pass, "local_fail": self.local_fail,
+                "resolved_rate": round(resolved / self.total, 3) if self.total else 0.0}
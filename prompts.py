@@ -1,3 +1,8 @@
+from typing import List
+
+# 修改判题 Prompt（含批量判题 Prompt）或判题用户消息模板时同步递增，旧的判题缓存随之失效
+JUDGE_PROMPT_VERSION = "judge-v2"
+
 JUDGE_PROMPT_SYSTEM = r"""You are a rigorous academic evaluator for a mathematics tutoring system.
 Your sole responsibility is to verify the correctness of the student's answer against the provided problem.
 Analyze the mathematical validity of the student's answer. Ignore minor formatting issues but be strict about values, logic, and key steps.
@@ -7,6 +12,15 @@ If the answer is mathematically correct, output ONLY the string "PASS".
 If the answer is incorrect, output ONLY the string "FAIL".
 Do NOT output any explanation, reasoning, or other characters."""
 
+BATCH_JUDGE_PROMPT_SYSTEM = r"""You are a rigorous academic evaluator for a mathematics tutoring system.
+You will receive several numbered items. Each item contains a problem, optionally its standard answer and solution, and a student's answer.
+Judge every item independently. Analyze the mathematical validity of each student's answer. Ignore minor formatting issues but be strict about values, logic, and key steps.
+
+Output Protocol:
+Output ONLY a JSON object of the form {"results": [{"id": 1, "verdict": "PASS"}, {"id": 2, "verdict": "FAIL"}]}.
+Include exactly one entry per item, using the item's number as "id". "verdict" MUST be "PASS" if the answer is mathematically correct and "FAIL" otherwise.
+Do NOT output any explanation, reasoning, or other characters."""
+
 SYSTEM_INSTRUCTION = r"""### Role Definition
 You are an Intelligent Tutoring Agent (ITA) designed based on Constructivist Learning Theory and Scaffolding Instruction. Your goal is to guide students through their Zone of Proximal Development (ZPD) by providing adaptive hints rather than direct answers.
 
@@ -35,4 +49,47 @@ Use LaTeX format for all mathematical expressions.
 - Inline math MUST be wrapped in LaTeX delimiters: \( ... \).
 - Block math MUST be wrapped in LaTeX delimiters: \[ ... \].
 Do NOT use single or double dollar signs for math notation.
-CRITICAL: You must ALWAYS communicate and reply to the user in Chinese (简体中文)."""
\ No newline at end of file
+CRITICAL: You must ALWAYS communicate and reply to the user in Chinese (简体中文)."""
+
+SUMMARY_PROMPT_SYSTEM = r"""You compress tutoring conversations for a mathematics tutoring system.
+You will receive an optional existing summary and a batch of newer dialogue turns between a student (学生) and the tutor (辅导).
+Write an updated summary that merges both: the student's misconceptions, what they have already tried, which hints and guiding questions were already given, and where the student is currently stuck.
+Do NOT include the final answer or complete solution steps. Keep mathematical expressions in LaTeX.
+Output ONLY the summary in Chinese (简体中文), as a few short bullet points."""
+
+
+# ==================== 消息构造 ====================
+# 服务商对相同的前缀做缓存：前面的消息只放同一道题对所有学生都一样的内容（系统指令、题目、标准答案、解析），
+# 学生答案、判题结果、本轮请求等易变内容放在最后。题目块的字段顺序在判题与辅导两条路径上保持一致，
+# 这里的模板改动会让线上前缀缓存整体失效，判题模板改动还需同步递增 JUDGE_PROMPT_VERSION。
+
+
+def question_block(q: dict) -> str:
+    block = f"题目：{q['content']}"
+    if q.get("answer") or q.get("solution"):
+        block += f"\n标准答案：{q.get('answer') or ''}\n标准解析：{q.get('solution') or ''}"
+    return block
+
+
+def judge_messages(q: dict, ans: str) -> List[dict]:
+    task = "任务：请严格对照标准答案判断学生是否正确。正确输出PASS，错误输出FAIL。" if q.get("answer") or q.get("solution") \
+        else "任务：判断是否正确。正确输出PASS，错误输出FAIL。"
+    return [{"role": "system", "content": JUDGE_PROMPT_SYSTEM},
+            {"role": "user", "content": f"{question_block(q)}\n{task}"},
+            {"role": "user", "content": f"学生答案：{ans}"}]
+
+
+def batch_judge_messages(items: List[tuple]) -> List[dict]:
+    blocks = [f"【第{n}题】\n{question_block(q)}\n学生答案：{ans}" for n, (q, ans) in enumerate(items, start=1)]
+    return [{"role": "system", "content": BATCH_JUDGE_PROMPT_SYSTEM}, {"role": "user", "content": "\n\n".join(blocks)}]
+
+
+def tutor_head(system_prompt: str, q: dict, ans: str, verdict_label: str) -> List[dict]:
+    """辅导请求的固定部分：系统指令与题目块对同一题的所有学生逐字节相同，其后是该学生本题不变的作答信息。"""
+    return [{"role": "system", "content": system_prompt},
+            {"role": "user", "content": question_block(q)},
+            {"role": "user", "content": f"学生答案：{ans}\n判题：{verdict_label}"}]
+
+
+def tutor_request(query: str) -> List[dict]:
+    return [{"role": "user", "content": f"请求：{query}"}]
@@ -0,0 +1,74 @@
+import random
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from question_index import QuestionIndex, CUSTOM_ID_OFFSET, content_hash
+from questions import QUESTION_BANK
+
+# 统一题号空间：内置题库沿用 questions.py 中的 1~999，自定义题目为 CUSTOM_ID_OFFSET + custom_questions.id。
+
+
+def is_custom(qid: int) -> bool:
+    return qid > CUSTOM_ID_OFFSET
+
+
+def to_db_id(qid: int) -> int:
+    return qid - CUSTOM_ID_OFFSET
+
+
+def _freeze(q: dict) -> Mapping:
+    rec = {"id": q["id"], "category": q["category"], "content": q["content"],
+           "answer": q.get("answer", "") or "", "solution": q.get("solution", "") or ""}
+    rec["content_hash"] = content_hash(rec)
+    return MappingProxyType(rec)
+
+
+class QuestionBank:
+    """内置题库 + 数据库自定义题目的统一读取入口。
+
+    内置题库在进程启动时加载一次，冻结为只读记录并预先算好内容哈希；自定义题目走 QuestionIndex。
+    对外返回普通 dict 副本，调用方可以放心放进 session_state。
+    """
+
+    def __init__(self, index: QuestionIndex, static_bank: List[dict] = QUESTION_BANK):
+        if any(q["id"] >= CUSTOM_ID_OFFSET for q in static_bank):
+            raise ValueError("static question ids must stay below CUSTOM_ID_OFFSET")
+        self.index = index
+        self._static: Dict[int, Mapping] = {q["id"]: _freeze(q) for q in static_bank}
+        by_course: Dict[str, List[int]] = {}
+        for q in static_bank:
+            by_course.setdefault(q["category"], []).append(q["id"])
+        self._static_by_course: Dict[str, Tuple[int, ...]] = {c: tuple(ids) for c, ids in by_course.items()}
+
+    @property
+    def static_courses(self) -> List[str]:
+        return list(self._static_by_course)
+
+    def static_records(self) -> List[Mapping]:
+        return list(self._static.values())
+
+    def get(self, qid: int) -> Optional[dict]:
+        return self.get_many([qid]).get(qid)
+
+    def get_many(self, qids: Iterable[int]) -> Dict[int, dict]:
+        qids = list(qids)
+        found = {q: dict(self._static[q]) for q in qids if q in self._static}
+        custom = [q for q in qids if is_custom(q)]
+        if custom:
+            found.update({q: dict(rec) for q, rec in self.index.get_many(custom).items()})
+        return found
+
+    def category_of(self, qid: int) -> Optional[str]:
+        rec = self.get(qid)
+        return rec["category"] if rec else None
+
+    def sample(self, course: str, k: int) -> List[dict]:
+        """在内置与自定义题目的并集上做 O(k) 无放回抽样，不拼接两个数组。"""
+        static_ids = self._static_by_course.get(course, ())
+        custom_ids = self.index.course_ids(course)
+        total = len(static_ids) + len(custom_ids)
+        picks = random.sample(range(total), min(k, total))
+        picked = [self._static[static_ids[i]] if i < len(static_ids) else self.index.record(custom_ids[i - len(static_ids)])
+                  for i in picks]
+        # 抽样与管理端失效并发时自定义记录可能刚被移除，跳过即可
+        return [dict(rec) for rec in picked if rec is not None]
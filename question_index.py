@@ -0,0 +1,111 @@
+import hashlib
+import random
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Mapping, Optional
+
+from sqlalchemy import bindparam, text, Engine
+
+from db import unit_of_work
+
+CUSTOM_ID_OFFSET = 1000
+
+
+def content_hash(q: Mapping) -> str:
+    return hashlib.sha1("\x1f".join([q.get("content", ""), q.get("answer", "") or "",
+                                     q.get("solution", "") or ""]).encode('utf-8')).hexdigest()
+
+
+class QuestionIndex:
+    """进程级自定义题目索引。
+
+    每门课保存一个紧凑的全局题号数组，题目记录按题号共享；抽题用 random.sample 在下标上做 O(k) 无放回抽样，
+    不再每次 ORDER BY RAND()。管理端增删改题目 / 课程时精确失效；ttl_seconds 兜底其他进程的修改，
+    课程题号数组和按题号单独加载的记录都按它过期。
+    """
+
+    def __init__(self, engine: Engine, ttl_seconds: float = 300.0):
+        self.engine = engine
+        self.ttl_seconds = ttl_seconds
+        self._courses: Dict[str, array] = {}
+        self._loaded_at: Dict[str, float] = {}
+        self._records: Dict[int, dict] = {}
+        self._record_at: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _record(r) -> dict:
+        rec = {"id": CUSTOM_ID_OFFSET + r[0], "category": r[1], "content": r[2], "answer": r[3] or "",
+               "solution": r[4] or ""}
+        rec["content_hash"] = content_hash(rec)
+        return rec
+
+    def course_ids(self, course: str) -> array:
+        # 与 invalidate_course 并发时两个字典可能只剩一个，在锁内一并读取
+        with self._lock:
+            ids = self._courses.get(course)
+            loaded_at = self._loaded_at.get(course, 0.0)
+        if ids is not None and time.monotonic() - loaded_at < self.ttl_seconds:
+            return ids
+        with unit_of_work(self.engine) as conn:
+            rows = conn.execute(text("SELECT id, category, content, answer, solution FROM custom_questions WHERE category = :c"),
+                                {"c": course}).fetchall()
+        records = [self._record(r) for r in rows]
+        ids = array("l", (rec["id"] for rec in records))
+        now = time.monotonic()
+        with self._lock:
+            for rec in records:
+                self._records[rec["id"]] = rec
+                self._record_at[rec["id"]] = now
+            self._courses[course] = ids
+            self._loaded_at[course] = now
+        return ids
+
+    def sample(self, course: str, k: int) -> List[dict]:
+        ids = self.course_ids(course)
+        picks = random.sample(range(len(ids)), min(k, len(ids)))
+        # 抽样与管理端失效并发时记录可能刚被移除，跳过即可
+        picked = [self._records.get(ids[i]) for i in picks]
+        return [rec for rec in picked if rec is not None]
+
+    def record(self, qid: int) -> Optional[dict]:
+        return self._records.get(qid)
+
+    def get_many(self, qids: Iterable[int]) -> Dict[int, dict]:
+        qids = list(qids)
+        now = time.monotonic()
+        with self._lock:
+            missing = tuple(q - CUSTOM_ID_OFFSET for q in qids
+                            if q not in self._records or now - self._record_at.get(q, 0.0) >= self.ttl_seconds)
+        if missing:
+            with unit_of_work(self.engine) as conn:
+                rows = conn.execute(text("SELECT id, category, content, answer, solution FROM custom_questions WHERE id IN :ids")
+                                    .bindparams(bindparam("ids", expanding=True)), {"ids": missing}).fetchall()
+            now = time.monotonic()
+            with self._lock:
+                # 过期后库里已删掉的题目不再返回旧记录
+                for q in missing:
+                    self._records.pop(CUSTOM_ID_OFFSET + q, None)
+                for r in rows:
+                    rec = self._record(r)
+                    self._records[rec["id"]] = rec
+                    self._record_at[rec["id"]] = now
+        return {q: self._records[q] for q in qids if q in self._records}
+
+    def invalidate_course(self, course: str):
+        with self._lock:
+            for qid in self._courses.pop(course, array("l")):
+                self._records.pop(qid, None)
+                self._record_at.pop(qid, None)
+            self._loaded_at.pop(course, None)
+
+    def invalidate_question(self, qid: int):
+        with self._lock:
+            rec = self._records.pop(qid, None)
+            self._record_at.pop(qid, None)
+        if rec:
+            self.invalidate_course(rec["category"])
+
+    def stats(self) -> dict:
+        return {"courses": len(self._courses), "records": len(self._records)}
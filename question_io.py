@@ -0,0 +1,285 @@
+import argparse
+import ast
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import time
+import unicodedata
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from sqlalchemy import bindparam, text, Engine
+
+# 题目批量导入 / 导出：逐行流式读取与校验，按规范化内容哈希去重，分批事务写入。
+# 支持 CSV（表头 category,content,answer,solution）、JSONL（每行一个对象）、JSON 数组以及 questions.py 格式的 QUESTION_BANK 文件。
+# 去重键存在 custom_questions.dedupe_hash，与判题缓存使用的题目 content_hash（内容 + 答案 + 解析）无关。
+
+IMPORT_BATCH = 500
+EXPORT_CHUNK = 2000
+MAX_CATEGORY_LEN = 128
+MAX_TEXT_LEN = 10000
+FIELDS = ("category", "content", "answer", "solution")
+FIELD_ALIASES = {"所属课程": "category", "课程": "category", "题目内容": "content", "题目完整内容": "content",
+                 "答案": "answer", "标准答案": "answer", "解析": "solution"}
+
+
+def normalize_content(s: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", s or "")).strip()
+
+
+def dedupe_key(category: str, content: str) -> str:
+    """同一课程下规范化后内容相同的题目视为重复（全角/半角、多余空白不影响判断）。"""
+    return hashlib.sha1(f"{normalize_content(category)}\x1f{normalize_content(content)}".encode('utf-8')).hexdigest()
+
+
+def read_csv(f: TextIO) -> Iterator[Tuple[int, dict]]:
+    reader = csv.DictReader(f)
+    for line_no, row in enumerate(reader, start=2):
+        yield line_no, {FIELD_ALIASES.get(k.strip(), k.strip()): v for k, v in row.items() if k}
+
+
+def read_jsonl(f: TextIO) -> Iterator[Tuple[int, dict]]:
+    for line_no, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError as e:
+            yield line_no, {"__error__": f"JSON 解析失败: {e}"}
+            continue
+        yield line_no, obj if isinstance(obj, dict) else {"__error__": "每行必须是一个 JSON 对象"}
+
+
+def read_json(f: TextIO) -> Iterator[Tuple[int, dict]]:
+    """读取 [{...}, {...}] 形式的 JSON 数组。整个文件一次读入内存，大文件请用 JSONL。"""
+    s = f.read()
+    decoder = json.JSONDecoder()
+    ws = re.compile(r"\s*")
+    pos = ws.match(s).end()
+    if not s.startswith("[", pos):
+        yield s.count("\n", 0, pos) + 1, {"__error__": "JSON 文件必须是由题目对象组成的数组，逐行对象请使用 .jsonl"}
+        return
+    pos = ws.match(s, pos + 1).end()
+    line_no, counted = 1, 0
+    while pos < len(s) and s[pos] != "]":
+        line_no += s.count("\n", counted, pos)
+        counted = pos
+        try:
+            obj, pos = decoder.raw_decode(s, pos)
+        except ValueError as e:
+            yield line_no, {"__error__": f"JSON 解析失败: {e}"}
+            return
+        yield line_no, obj if isinstance(obj, dict) else {"__error__": "数组元素必须是 JSON 对象"}
+        pos = ws.match(s, pos).end()
+        if s.startswith(",", pos):
+            pos = ws.match(s, pos + 1).end()
+        elif not s.startswith("]", pos):
+            yield line_no + s.count("\n", counted, pos), {"__error__": "JSON 解析失败: 数组元素之间缺少逗号"}
+            return
+
+
+def read_python_bank(f: TextIO) -> Iterator[Tuple[int, dict]]:
+    """读取 questions.py 格式文件中的 QUESTION_BANK 列表。只做字面量解析，不执行文件中的代码。"""
+    tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "QUESTION_BANK" for t in node.targets):
+            for item in node.value.elts:
+                try:
+                    yield item.lineno, ast.literal_eval(item)
+                except ValueError as e:
+                    yield item.lineno, {"__error__": f"无法解析的题目字面量: {e}"}
+            return
+    raise ValueError("文件中没有找到 QUESTION_BANK 列表")
+
+
+READERS: Dict[str, Callable[[TextIO], Iterator[Tuple[int, dict]]]] = {
+    ".csv": read_csv, ".jsonl": read_jsonl, ".json": read_json, ".py": read_python_bank,
+}
+
+
+def reader_for(filename: str) -> Callable[[TextIO], Iterator[Tuple[int, dict]]]:
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in READERS:
+        raise ValueError(f"不支持的文件类型: {ext}（支持 {', '.join(READERS)}）")
+    return READERS[ext]
+
+
+def validate(row: dict) -> Tuple[Optional[dict], Optional[str]]:
+    if "__error__" in row:
+        return None, row["__error__"]
+    rec = {}
+    for field in FIELDS:
+        value = row.get(field)
+        rec[field] = "" if value is None else str(value).strip()
+    if not rec["category"]:
+        return None, "缺少所属课程 (category)"
+    if not rec["content"]:
+        return None, "缺少题目内容 (content)"
+    if len(rec["category"]) > MAX_CATEGORY_LEN:
+        return None, f"课程名超过 {MAX_CATEGORY_LEN} 个字符"
+    for field in ("content", "answer", "solution"):
+        if len(rec[field]) > MAX_TEXT_LEN:
+            return None, f"{field} 超过 {MAX_TEXT_LEN} 个字符"
+    rec["dedupe_hash"] = dedupe_key(rec["category"], rec["content"])
+    return rec, None
+
+
+def _existing_hashes(conn, hashes: List[str]) -> set:
+    if not hashes:
+        return set()
+    return {r[0] for r in conn.execute(text("SELECT dedupe_hash FROM custom_questions WHERE dedupe_hash IN :hs")
+                                       .bindparams(bindparam("hs", expanding=True)), {"hs": hashes}).fetchall()}
+
+
+def import_questions(engine: Engine, rows: Iterable[Tuple[int, dict]], batch_size: int = IMPORT_BATCH,
+                     dry_run: bool = False, skip_hashes: Iterable[str] = (),
+                     progress: Optional[Callable[[dict], None]] = None, max_errors: int = 50) -> dict:
+    """逐批校验、去重并写入 custom_questions，每批一个事务。
+
+    skip_hashes 用于排除已在内置题库中的题目；dry_run 时照常校验和查重但不写库。
+    返回统计报告，progress 在每批处理后以同一个报告字典回调。
+    """
+    report = {"read": 0, "invalid": 0, "duplicates": 0, "inserted": 0, "errors": [], "categories": set(),
+              "dry_run": dry_run, "elapsed": 0.0}
+    started = time.monotonic()
+    seen = set(skip_hashes)
+
+    def flush(conn, batch: List[dict]):
+        existing = _existing_hashes(conn, [r["dedupe_hash"] for r in batch])
+        fresh = []
+        for rec in batch:
+            if rec["dedupe_hash"] in existing or rec["dedupe_hash"] in seen:
+                report["duplicates"] += 1
+                continue
+            seen.add(rec["dedupe_hash"])
+            fresh.append(rec)
+        if fresh and not dry_run:
+            conn.execute(text(
+                "INSERT INTO custom_questions (category, content, answer, solution, dedupe_hash) VALUES (:category, :content, :answer, :solution, :dedupe_hash)"),
+                fresh)
+            conn.commit()
+        report["inserted"] += len(fresh)
+        report["categories"].update(r["category"] for r in fresh)
+        report["elapsed"] = round(time.monotonic() - started, 2)
+        if progress:
+            progress(report)
+
+    with engine.connect() as conn:
+        batch: List[dict] = []
+        for line_no, row in rows:
+            report["read"] += 1
+            rec, err = validate(row)
+            if err:
+                report["invalid"] += 1
+                if len(report["errors"]) < max_errors:
+                    report["errors"].append((line_no, err))
+                continue
+            batch.append(rec)
+            if len(batch) >= batch_size:
+                flush(conn, batch)
+                batch = []
+        flush(conn, batch)
+    return report
+
+
+def iter_export(engine: Engine, fmt: str = "jsonl", course: Optional[str] = None,
+                limit: Optional[int] = None) -> Iterator[str]:
+    """按主键分段读取自定义题目并逐段产出文本，内存占用与题库规模无关。limit 为最多导出的题数。"""
+    if fmt not in ("jsonl", "csv"):
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(FIELDS)
+    sql = "SELECT id, category, content, answer, solution FROM custom_questions WHERE id > :after"
+    if course is not None:
+        sql += " AND category = :c"
+    sql += " ORDER BY id LIMIT :n"
+    after = 0
+    with engine.connect() as conn:
+        while True:
+            n = EXPORT_CHUNK if limit is None else min(EXPORT_CHUNK, limit)
+            rows = conn.execute(text(sql), {"after": after, "c": course, "n": n}).fetchall()
+            if fmt == "csv":
+                writer.writerows((r[1], r[2], r[3] or "", r[4] or "") for r in rows)
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+            else:
+                yield "".join(json.dumps({"category": r[1], "content": r[2], "answer": r[3] or "",
+                                          "solution": r[4] or ""}, ensure_ascii=False) + "\n" for r in rows)
+            if limit is not None:
+                limit -= len(rows)
+            if len(rows) < n or limit == 0:
+                return
+            after = rows[-1][0]
+
+
+def count_questions(engine: Engine, course: Optional[str] = None) -> int:
+    sql = "SELECT COUNT(*) FROM custom_questions" + (" WHERE category = :c" if course is not None else "")
+    with engine.connect() as conn:
+        return conn.execute(text(sql), {"c": course}).scalar()
+
+
+def backfill_content_hash(conn):
+    """为已有题目补算去重键（迁移 6 的步骤，列当时名为 content_hash，迁移 10 改名为 dedupe_hash），按 id 分段提交。"""
+    after = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, category, content FROM custom_questions WHERE id > :after ORDER BY id LIMIT :n"),
+            {"after": after, "n": EXPORT_CHUNK}).fetchall()
+        if rows:
+            conn.execute(text("UPDATE custom_questions SET content_hash = :h WHERE id = :id"),
+                         [{"h": dedupe_key(r[1], r[2]), "id": r[0]} for r in rows])
+            conn.commit()
+        if len(rows) < EXPORT_CHUNK:
+            return
+        after = rows[-1][0]
+
+
+def format_report(report: dict) -> str:
+    verb = "将导入" if report["dry_run"] else "已导入"
+    return (f"读取 {report['read']} 行，{verb} {report['inserted']} 题，重复 {report['duplicates']} 题，"
+            f"无效 {report['invalid']} 行，用时 {report['elapsed']} 秒")
+
+
+if __name__ == "__main__":
+    # 用法：python question_io.py import 文件 [--dry-run] [--batch 500]
+    #       python question_io.py export 文件.jsonl|文件.csv [--course 课程名]
+    from dotenv import load_dotenv
+    import migrations
+    from db import engine_from_env
+    from question_bank import QuestionBank
+    from question_index import QuestionIndex
+
+    parser = argparse.ArgumentParser(description="题目批量导入 / 导出")
+    parser.add_argument("cmd", choices=["import", "export"])
+    parser.add_argument("path")
+    parser.add_argument("--dry-run", action="store_true", help="只校验和查重，不写入数据库")
+    parser.add_argument("--batch", type=int, default=IMPORT_BATCH)
+    parser.add_argument("--course", default=None, help="只导出指定课程")
+    args = parser.parse_args()
+
+    load_dotenv()
+    engine = engine_from_env()
+    migrations.upgrade(engine)
+
+    if args.cmd == "import":
+        static_hashes = {dedupe_key(q["category"], q["content"])
+                         for q in QuestionBank(QuestionIndex(engine)).static_records()}
+        with open(args.path, encoding="utf-8-sig", newline="") as f:
+            result = import_questions(engine, reader_for(args.path)(f), batch_size=args.batch, dry_run=args.dry_run,
+                                      skip_hashes=static_hashes,
+                                      progress=lambda r: print(f"\r已处理 {r['read']} 行...", end="", flush=True))
+        print()
+        for line_no, err in result["errors"]:
+            print(f"  第 {line_no} 行: {err}")
+        print(("🔍 " if args.dry_run else "✅ ") + format_report(result))
+    else:
+        fmt = "csv" if args.path.lower().endswith(".csv") else "jsonl"
+        with open(args.path, "w", encoding="utf-8-sig" if fmt == "csv" else "utf-8", newline="") as f:
+            for chunk in iter_export(engine, fmt, args.course):
+                f.write(chunk)
+        print(f"✅ 已导出到 {args.path}")
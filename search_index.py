@@ -0,0 +1,254 @@
+import bisect
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from sqlalchemy import text, Engine
+
+from question_index import CUSTOM_ID_OFFSET
+
+# 字段权重：课程名命中最重要，答案/解析只作补充
+FIELD_WEIGHTS = (("category", 2.0), ("content", 1.0), ("answer", 0.5), ("solution", 0.5))
+MAX_PREFIX_EXPANSION = 64
+LOAD_CHUNK = 5000
+
+_TOKEN_RE = re.compile(r"\\[A-Za-z]+|[A-Za-z]+|\d+(?:\.\d+)?|[\u4e00-\u9fff]+|\S")
+
+
+def _is_math_symbol(ch: str) -> bool:
+    # ∫ ∑ ≤ 这类数学符号与希腊字母单独成词，其余标点丢弃
+    return unicodedata.category(ch) == "Sm" or "\u0370" <= ch <= "\u03ff" or ch in "^_=<>|!'"
+
+
+def tokenize(s: str) -> List[str]:
+    """中文按单字 + 相邻二字切分，LaTeX 命令保留反斜杠（\\lim、\\iint），英文单词小写，数学符号单独成词。"""
+    tokens = []
+    for m in _TOKEN_RE.finditer(unicodedata.normalize("NFKC", s or "")):
+        tok = m.group()
+        if tok[0] == "\\" or tok[0].isascii() and tok[0].isalnum():
+            tokens.append(tok.lower() if tok[0] != "\\" else tok)
+        elif "\u4e00" <= tok[0] <= "\u9fff":
+            tokens.extend(tok)
+            tokens.extend(tok[i:i + 2] for i in range(len(tok) - 1))
+        elif _is_math_symbol(tok):
+            tokens.append(tok)
+    return tokens
+
+
+def _query_terms(query: str) -> List[Tuple[str, bool]]:
+    """查询词：中文连续段取二字词（单字段取单字），英文 / LaTeX 命令按前缀匹配。返回 (词, 是否前缀匹配)。"""
+    terms = []
+    for m in _TOKEN_RE.finditer(unicodedata.normalize("NFKC", query or "")):
+        tok = m.group()
+        if tok[0] == "\\" or tok[0].isascii() and tok[0].isalpha():
+            terms.append((tok if tok[0] == "\\" else tok.lower(), True))
+        elif tok[0].isdigit():
+            terms.append((tok, False))
+        elif "\u4e00" <= tok[0] <= "\u9fff":
+            terms.extend((tok[i:i + 2], False) for i in range(max(len(tok) - 1, 1)))
+        elif _is_math_symbol(tok):
+            terms.append((tok, False))
+    return terms
+
+
+class SearchIndex:
+    """题库倒排索引：词 -> {题号: 加权词频}，另维护有序词表做前缀展开。
+
+    查询只访问命中词的倒排表，与题库规模无关；管理端增删改题目时 add / remove 增量维护。
+    其他进程的修改由 max_age 兜底：过期后在后台线程重建，重建期间继续用旧索引服务，
+    期间的 add / remove 记下来，替换前在新索引上重放一遍。首次查询同样交给后台线程构建，
+    并发的首批查询只触发一次构建并等待它完成。
+    """
+
+    def __init__(self, engine: Engine, static_records: Iterable[Mapping] = (), max_age: float = 600.0):
+        self.engine = engine
+        self.max_age = max_age
+        self._static = list(static_records)
+        self._lock = threading.RLock()
+        self._reset()
+        # 每个进行中的 load 一份操作记录
+        self._journals: List[List[Tuple[str, object]]] = []
+        self._rebuilding = False
+        self._rebuild_done = threading.Event()
+        self._rebuild_done.set()
+        # 全量构建时新词直接追加，构建完再统一排序，避免每个新词 O(T) 的 insort
+        self._bulk_loading = False
+        self.queries = 0
+        self.total_ms = 0.0
+
+    def _reset(self):
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._terms: List[str] = []
+        self._docs: Dict[int, Counter] = {}
+        self._meta: Dict[int, Tuple[str, str]] = {}
+        self.built_at = 0.0
+
+    def _doc_terms(self, rec: Mapping) -> Counter:
+        weights = Counter()
+        for field, w in FIELD_WEIGHTS:
+            for tok in tokenize(rec.get(field) or ""):
+                weights[tok] += w
+        return weights
+
+    def add(self, rec: Mapping):
+        qid = rec["id"]
+        weights = self._doc_terms(rec)
+        with self._lock:
+            self._remove_locked(qid)
+            for tok, w in weights.items():
+                posting = self._postings.get(tok)
+                if posting is None:
+                    posting = self._postings[tok] = {}
+                    if self._bulk_loading:
+                        self._terms.append(tok)
+                    else:
+                        bisect.insort(self._terms, tok)
+                posting[qid] = w
+            self._docs[qid] = weights
+            self._meta[qid] = (rec.get("category") or "", (rec.get("content") or "")[:30])
+            for journal in self._journals:
+                journal.append(("add", rec))
+
+    def remove(self, qid: int):
+        with self._lock:
+            self._remove_locked(qid)
+            for journal in self._journals:
+                journal.append(("remove", qid))
+
+    def _remove_locked(self, qid: int):
+        weights = self._docs.pop(qid, None)
+        self._meta.pop(qid, None)
+        if not weights:
+            return
+        for tok in weights:
+            posting = self._postings.get(tok)
+            if posting is None:
+                continue
+            posting.pop(qid, None)
+            if not posting:
+                del self._postings[tok]
+                i = bisect.bisect_left(self._terms, tok)
+                if i < len(self._terms) and self._terms[i] == tok:
+                    del self._terms[i]
+
+    def load(self):
+        """全量构建：内置题库 + 按主键分段读取的自定义题目。构建完成后一次性替换。"""
+        journal: List[Tuple[str, object]] = []
+        with self._lock:
+            self._journals.append(journal)
+        try:
+            fresh = SearchIndex(self.engine, max_age=self.max_age)
+            fresh._bulk_loading = True
+            for rec in self._static:
+                fresh.add(rec)
+            after = 0
+            with self.engine.connect() as conn:
+                while True:
+                    rows = conn.execute(text(
+                        "SELECT id, category, content, answer, solution FROM custom_questions WHERE id > :after ORDER BY id LIMIT :n"),
+                        {"after": after, "n": LOAD_CHUNK}).fetchall()
+                    for r in rows:
+                        fresh.add({"id": CUSTOM_ID_OFFSET + r[0], "category": r[1], "content": r[2], "answer": r[3],
+                                   "solution": r[4]})
+                    if len(rows) < LOAD_CHUNK:
+                        break
+                    after = rows[-1][0]
+            fresh._terms.sort()
+            fresh._bulk_loading = False
+            with self._lock:
+                # 读库期间的增量修改可能没读到，按发生顺序重放（add / remove 都是幂等的）
+                for op, arg in journal:
+                    if op == "add":
+                        fresh.add(arg)
+                    else:
+                        fresh.remove(arg)
+                self._postings, self._terms, self._docs, self._meta = fresh._postings, fresh._terms, fresh._docs, fresh._meta
+                self.built_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._journals = [j for j in self._journals if j is not journal]
+
+    def _refresh_in_background(self):
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                logging.error(f"Search index rebuild error: {e}")
+            finally:
+                with self._lock:
+                    self._rebuilding = False
+                    self._rebuild_done.set()
+
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+            self._rebuild_done.clear()
+        threading.Thread(target=run, daemon=True, name="search-index-rebuild").start()
+
+    def _ensure_fresh(self):
+        if not self.built_at:
+            # 首次构建也只起一个后台线程，其余查询等它完成；构建失败时按空索引返回，下次查询再试
+            self._refresh_in_background()
+            self._rebuild_done.wait()
+        elif time.monotonic() - self.built_at > self.max_age:
+            self._refresh_in_background()
+
+    def _expand(self, term: str) -> List[Tuple[str, float]]:
+        i = bisect.bisect_left(self._terms, term)
+        out = []
+        while i < len(self._terms) and self._terms[i].startswith(term) and len(out) < MAX_PREFIX_EXPANSION:
+            t = self._terms[i]
+            out.append((t, 1.0 if t == term else 0.7))
+            i += 1
+        return out
+
+    def search(self, query: str, k: int = 20, course: Optional[str] = None, custom_only: bool = False,
+               exclude: Iterable[int] = ()) -> List[Tuple[int, float]]:
+        """按相关度返回 [(题号, 得分)]。得分为 idf 加权词频之和，命中查询词越多越靠前。"""
+        started = time.perf_counter()
+        self._ensure_fresh()
+        terms = _query_terms(query)
+        scores: Dict[int, float] = {}
+        hits: Counter = Counter()
+        with self._lock:
+            n_docs = len(self._docs) or 1
+            for term, prefix in terms:
+                matched: Dict[int, float] = {}
+                candidates = [(term, 1.0)]
+                if prefix:
+                    # 英文词同时匹配同名 LaTeX 命令：输入 sin 也能找到 \sin
+                    candidates = self._expand(term) + (self._expand("\\" + term) if term[0] != "\\" else [])
+                for tok, factor in candidates:
+                    posting = self._postings.get(tok)
+                    if not posting:
+                        continue
+                    idf = math.log(1 + n_docs / len(posting))
+                    for qid, w in posting.items():
+                        s = factor * idf * w / (1 + w)
+                        if s > matched.get(qid, 0.0):
+                            matched[qid] = s
+                for qid, s in matched.items():
+                    scores[qid] = scores.get(qid, 0.0) + s
+                    hits[qid] += 1
+            excluded = set(exclude)
+            ranked = [(qid, round(s * hits[qid] / max(len(terms), 1), 4)) for qid, s in scores.items()
+                      if qid not in excluded and (not custom_only or qid > CUSTOM_ID_OFFSET)
+                      and (course is None or self._meta[qid][0] == course)]
+        ranked.sort(key=lambda x: -x[1])
+        self.queries += 1
+        self.total_ms += (time.perf_counter() - started) * 1000
+        return ranked[:k]
+
+    def label(self, qid: int) -> str:
+        category, snippet = self._meta.get(qid, ("", ""))
+        return f"[{category}] {snippet}..."
+
+    def stats(self) -> dict:
+        return {"docs": len(self._docs), "terms": len(self._terms), "queries": self.queries,
+                "avg_ms": round(self.total_ms / self.queries, 2) if self.queries else 0.0}
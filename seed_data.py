@@ -0,0 +1,196 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from dotenv import load_dotenv
+from sqlalchemy import text, Engine
+from werkzeug.security import generate_password_hash
+
+import analytics
+import migrations
+from db import engine_from_env
+from grading import VERDICT_LABELS, PASS, FAIL, UNGRADED
+from mock_llm import TUTOR_SENTENCES
+from question_bank import QuestionBank, CUSTOM_ID_OFFSET
+from question_index import QuestionIndex
+from question_io import dedupe_key
+from questions import QUESTION_BANK
+
+# 压测数据生成：按固定随机种子向现有表结构写入接近生产规模的数据，用于 bench_queries.py 的基准测试。
+# 用户活跃度按帕累托分布（少数学生贡献大部分记录），题目热度按 Zipf 分布，
+# 每次学习会话包含一次登录、10 道交卷记录和若干辅导记录，时间均匀分布在最近 --days 天内。
+# 生成的账号统一以 seed_ 开头，--reset 会先删除上一次生成的数据。
+
+SEED_PREFIX = "seed_"
+SEED_COURSE_PREFIX = "压测课程"
+QUESTIONS_PER_SESSION = 10
+TUTOR_QUERIES = ["这一步怎么化简？", "我不知道从哪里入手", "为什么我的答案是错的？", "能给点提示吗", "这个公式什么时候能用？",
+                 "可以换一种思路吗", "极限这里为什么不能直接代入", "特征值怎么求"]
+
+
+class BatchInserter:
+    def __init__(self, conn, sql: str, batch_size: int):
+        self.conn = conn
+        self.sql = text(sql)
+        self.batch_size = batch_size
+        self.rows: List[dict] = []
+        self.written = 0
+
+    def add(self, row: dict):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.conn.execute(self.sql, self.rows)
+            self.conn.commit()
+            self.written += len(self.rows)
+            self.rows = []
+
+
+def reset_seed_data(engine: Engine):
+    with engine.connect() as conn:
+        for sql in ["DELETE FROM interaction_logs WHERE student_id LIKE :p",
+                    "DELETE FROM study_sessions WHERE username LIKE :p",
+                    "DELETE FROM login_logs WHERE username LIKE :p",
+                    "DELETE FROM users WHERE username LIKE :p"]:
+            conn.execute(text(sql), {"p": f"{SEED_PREFIX}%"})
+            conn.commit()
+        ids = [r[0] for r in conn.execute(text("SELECT course_name FROM custom_courses WHERE course_name LIKE :c"),
+                                          {"c": f"{SEED_COURSE_PREFIX}%"}).fetchall()]
+        for course in ids:
+            conn.execute(text("DELETE FROM custom_questions WHERE category = :c"), {"c": course})
+            conn.execute(text("DELETE FROM custom_courses WHERE course_name = :c"), {"c": course})
+            conn.commit()
+
+
+def seed_questions(engine: Engine, rng: random.Random, n_courses: int, n_questions: int, batch: int) -> Dict[str, List[int]]:
+    """写入自定义课程与题目，返回 课程 -> 统一题号列表（含内置题库）。"""
+    pool: Dict[str, List[int]] = {}
+    for q in QUESTION_BANK:
+        pool.setdefault(q["category"], []).append(q["id"])
+    courses = [f"{SEED_COURSE_PREFIX}{i + 1:02d}" for i in range(n_courses)]
+    with engine.connect() as conn:
+        if courses:
+            conn.execute(text("INSERT INTO custom_courses (course_name, description) VALUES (:n, :d)"),
+                         [{"n": c, "d": "自动生成的压测课程"} for c in courses])
+            conn.commit()
+            ins = BatchInserter(conn, "INSERT INTO custom_questions (category, content, answer, solution, dedupe_hash) VALUES (:category, :content, :answer, :solution, :dedupe_hash)", batch)
+            for i in range(n_questions):
+                course = courses[i % len(courses)]
+                a, b = rng.randint(1, 99), rng.randint(1, 99)
+                content = f"第 {i + 1} 题：计算 \\( {a} \\times x + {b} = {a * 3 + b} \\) 中的 \\( x \\)，并说明每一步的依据。"
+                ins.add({"category": course, "content": content, "answer": "3", "solution": "移项后两边同除以系数。",
+                         "dedupe_hash": dedupe_key(course, content)})
+            ins.flush()
+        rows = conn.execute(text("SELECT id, category FROM custom_questions WHERE category LIKE :c"),
+                            {"c": f"{SEED_COURSE_PREFIX}%"}).fetchall()
+    for qid, course in rows:
+        pool.setdefault(course, []).append(CUSTOM_ID_OFFSET + qid)
+    return pool
+
+
+def seed_users(engine: Engine, n_users: int, batch: int) -> List[str]:
+    names = [f"{SEED_PREFIX}u{i:06d}" for i in range(n_users)]
+    # 所有压测账号共用一个哈希，避免生成阶段被密码哈希拖慢
+    pw_hash = generate_password_hash("seed")
+    with engine.connect() as conn:
+        ins = BatchInserter(conn, "INSERT INTO users (username, password_hash, role) VALUES (:u, :p, 'student')", batch)
+        for u in names:
+            ins.add({"u": u, "p": pw_hash})
+        ins.flush()
+    return names
+
+
+def zipf_pick(rng: random.Random, items: List[int], s: float = 1.1) -> int:
+    # 近似 Zipf：下标按 pareto 抽样后截断，越靠前的题目越热门
+    return items[min(len(items) - 1, int(rng.paretovariate(s)) - 1)]
+
+
+def seed_activity(engine: Engine, rng: random.Random, users: List[str], pool: Dict[str, List[int]],
+                  n_interactions: int, days: int, batch: int, progress_every: int = 200000):
+    """按学习会话生成 login_logs、study_sessions 与 interaction_logs，直到交互记录数达到 n_interactions。"""
+    now = datetime.now().replace(microsecond=0)
+    courses = list(pool)
+    skills = [rng.betavariate(4, 3) for _ in users]
+    # 帕累托权重：前 20% 的学生大约贡献 80% 的会话，截断避免个别账号占比过高
+    weights = [min(rng.paretovariate(1.16), 50.0) for _ in users]
+    with engine.connect() as conn:
+        next_session = (conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM study_sessions")).scalar() or 0) + 1
+        logins = BatchInserter(conn, "INSERT INTO login_logs (username, login_time) VALUES (:u, :t)", batch)
+        sessions = BatchInserter(conn, "INSERT INTO study_sessions (id, username, course_name, start_time, end_time, duration_seconds) VALUES (:id, :u, :c, :s, :e, :d)", batch)
+        logs = BatchInserter(conn, "INSERT INTO interaction_logs (question_id, qid, student_id, kind, is_correct, session_id, user_query, ai_response, is_leaking_answer, created_at) VALUES (:qid, :qid, :sid, :kind, :ok, :sess, :qry, :rsp, 0, :t)", batch)
+        started = time.monotonic()
+        emitted, next_report = 0, progress_every
+        picks = rng.choices(range(len(users)), weights=weights, k=max(1, n_interactions // QUESTIONS_PER_SESSION))
+        for ui in picks:
+            if emitted >= n_interactions:
+                break
+            user, course = users[ui], rng.choice(courses)
+            start = now - timedelta(seconds=rng.randint(0, days * 86400))
+            duration = int(rng.lognormvariate(6.8, 0.6))
+            sid = next_session
+            next_session += 1
+            logins.add({"u": user, "t": start - timedelta(seconds=rng.randint(5, 120))})
+            sessions.add({"id": sid, "u": user, "c": course, "s": start, "e": start + timedelta(seconds=duration),
+                          "d": duration})
+            wrong = []
+            for k in range(QUESTIONS_PER_SESSION):
+                qid = zipf_pick(rng, pool[course])
+                r = rng.random()
+                verdict = UNGRADED if r > 0.995 else PASS if r < skills[ui] else FAIL
+                ok = None if verdict == UNGRADED else int(verdict == PASS)
+                if ok == 0:
+                    wrong.append(qid)
+                logs.add({"qid": qid, "sid": user, "kind": "submission", "ok": ok, "sess": sid,
+                          "qry": f"【答案提交】{rng.randint(0, 999)}", "rsp": VERDICT_LABELS[verdict],
+                          "t": start + timedelta(seconds=duration * (k + 1) // (QUESTIONS_PER_SESSION + 2))})
+            emitted += QUESTIONS_PER_SESSION
+            for turn in range(min(len(wrong) * 2, int(rng.expovariate(0.5)))):
+                logs.add({"qid": rng.choice(wrong), "sid": user, "kind": "tutoring", "ok": None, "sess": sid,
+                          "qry": f"【辅导】{rng.choice(TUTOR_QUERIES)}",
+                          "rsp": "".join(rng.choice(TUTOR_SENTENCES) for _ in range(rng.randint(2, 6))),
+                          "t": start + timedelta(seconds=duration - 60 + turn)})
+                emitted += 1
+            if emitted >= next_report:
+                next_report += progress_every
+                rate = emitted / max(1e-6, time.monotonic() - started)
+                print(f"\r交互记录 {emitted}/{n_interactions}（{rate:.0f} 行/秒）", end="", flush=True)
+        for ins in (logins, sessions, logs):
+            ins.flush()
+    print(f"\n已写入 登录 {logins.written}，学习会话 {sessions.written}，交互记录 {logs.written}")
+
+
+if __name__ == "__main__":
+    # 用法：python seed_data.py --users 50000 --interactions 10000000 --custom-questions 5000 --reset
+    #       小规模试跑：python seed_data.py --users 500 --interactions 50000 --custom-questions 200 --reset
+    parser = argparse.ArgumentParser(description="生成压测数据")
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--interactions", type=int, default=10_000_000)
+    parser.add_argument("--custom-courses", type=int, default=8)
+    parser.add_argument("--custom-questions", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=180, help="数据分布在最近多少天内")
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=20240601)
+    parser.add_argument("--reset", action="store_true", help="先删除上一次生成的 seed_ 数据")
+    parser.add_argument("--no-rollup", action="store_true", help="生成后不重建看板预聚合表")
+    args = parser.parse_args()
+
+    load_dotenv()
+    engine = engine_from_env()
+    migrations.upgrade(engine)
+    rng = random.Random(args.seed)
+    t0 = time.monotonic()
+    if args.reset:
+        reset_seed_data(engine)
+    pool = seed_questions(engine, rng, args.custom_courses, args.custom_questions, args.batch)
+    users = seed_users(engine, args.users, args.batch)
+    print(f"已写入 {len(users)} 个学生账号，{sum(len(v) for v in pool.values())} 道题目（{len(pool)} 门课程）")
+    seed_activity(engine, rng, users, pool, args.interactions, args.days, args.batch)
+    if not args.no_rollup:
+        analytics.rebuild(engine, QuestionBank(QuestionIndex(engine)))
+        print("已重建看板预聚合表")
+    print(f"✅ 完成，用时 {time.monotonic() - t0:.0f} 秒")
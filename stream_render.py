@@ -0,0 +1,148 @@
+import time
+from typing import Any, Callable, List
+
+# 流式辅导回复的增量渲染：公式定界符逐块转换 + 按帧率 / 块数节流推送，完成的段落定稿后不再重发。
+
+
+class MathStreamFormatter:
+    """format_math 的增量版本：把 \\( \\) 转为 $、\\[ \\] 转为 $$，并去掉定界符内侧的空白。
+
+    跨块边界的定界符（上一块以反斜杠结尾）和右定界符前的空白会暂存到下一块再决定，
+    所以逐块 feed 的输出拼起来与对完整文本调用 format_math 一致，每个字符只处理一次。
+    """
+
+    def __init__(self):
+        self._held = ""
+        self._skip_ws = False
+
+    def feed(self, chunk: str) -> str:
+        s = self._held + chunk
+        self._held = ""
+        out: List[str] = []
+        ws_start = -1
+        i, n = 0, len(s)
+        while i < n:
+            c = s[i]
+            if self._skip_ws:
+                if c.isspace():
+                    i += 1
+                    continue
+                self._skip_ws = False
+            if c.isspace():
+                if ws_start < 0:
+                    ws_start = i
+                i += 1
+                continue
+            if c == "\\":
+                if i + 1 == n:
+                    self._held = s[ws_start:] if ws_start >= 0 else "\\"
+                    return "".join(out)
+                nxt = s[i + 1]
+                if nxt in ")]":
+                    out.append("$" if nxt == ")" else "$$")
+                    ws_start = -1
+                    i += 2
+                    continue
+                if ws_start >= 0:
+                    out.append(s[ws_start:i])
+                    ws_start = -1
+                if nxt in "([":
+                    out.append("$" if nxt == "(" else "$$")
+                    self._skip_ws = True
+                    i += 2
+                    continue
+                out.append(c)
+                i += 1
+                continue
+            if ws_start >= 0:
+                out.append(s[ws_start:i])
+                ws_start = -1
+            out.append(c)
+            i += 1
+        if ws_start >= 0:
+            self._held = s[ws_start:]
+        return "".join(out)
+
+    def close(self) -> str:
+        held, self._held = self._held, ""
+        return held
+
+
+def last_safe_break(s: str) -> int:
+    """返回最后一个可以断开的空行位置（不在公式块 / 代码块内部），没有则返回 -1。"""
+    fence = display = inline = False
+    best = -1
+    i, n = 0, len(s)
+    while i < n:
+        if s.startswith("```", i) and (i == 0 or s[i - 1] == "\n"):
+            fence = not fence
+            i += 3
+            continue
+        if not fence:
+            if s.startswith("$$", i):
+                display = not display
+                i += 2
+                continue
+            if s[i] == "$":
+                inline = not inline
+            elif s.startswith("\n\n", i) and not (display or inline):
+                best = i + 2
+        i += 1
+    return best
+
+
+class StreamRenderer:
+    """节流渲染器：距上次推送超过 min_interval 秒或累计 max_chunks 块才刷新一次。
+
+    new_placeholder 每次返回一个带 markdown() 的空占位（例如 st.container().empty）；
+    已经完整的段落写入当前占位后定稿，后续文字换到新占位，每次刷新只重发最后一段。
+    """
+
+    def __init__(self, new_placeholder: Callable[[], Any], min_interval: float = 0.1, max_chunks: int = 40,
+                 cursor: str = "▌"):
+        self.new_placeholder = new_placeholder
+        self.min_interval = min_interval
+        self.max_chunks = max_chunks
+        self.cursor = cursor
+        self._fmt = MathStreamFormatter()
+        self._placeholder = new_placeholder()
+        self._done: List[str] = []
+        self._tail: List[str] = []
+        self._chunks_since = 0
+        self._last_push = 0.0
+        self.chunks = 0
+        self.renders = 0
+
+    def feed(self, chunk: str):
+        if not chunk:
+            return
+        self.chunks += 1
+        self._chunks_since += 1
+        piece = self._fmt.feed(chunk)
+        if piece:
+            self._tail.append(piece)
+        if self._chunks_since >= self.max_chunks or time.monotonic() - self._last_push >= self.min_interval:
+            self._push(final=False)
+
+    def _push(self, final: bool):
+        tail = "".join(self._tail)
+        cut = last_safe_break(tail)
+        if cut > 0 and cut < len(tail):
+            self._placeholder.markdown(tail[:cut])
+            self._done.append(tail[:cut])
+            self._placeholder = self.new_placeholder()
+            tail = tail[cut:]
+            self.renders += 1
+        self._tail = [tail]
+        self._placeholder.markdown(tail if final else tail + self.cursor)
+        self.renders += 1
+        self._chunks_since = 0
+        self._last_push = time.monotonic()
+
+    def close(self) -> str:
+        """推送最后一帧并返回完整的格式化文本。"""
+        rest = self._fmt.close()
+        if rest:
+            self._tail.append(rest)
+        self._push(final=True)
+        return "".join(self._done) + "".join(self._tail)
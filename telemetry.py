@@ -0,0 +1,96 @@
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+from sqlalchemy import text
+
+from grading import CALL_ATTEMPT, percentile
+
+# 大模型调用指标：每次 chat completion 一条记录，进程内保留最近 ring_size 条供实时查看，
+# 同时交给 sink（LogWriter 写 llm_call_metrics 表）持久化，管理端按时间桶画分位数曲线。
+
+
+class Telemetry:
+    def __init__(self, sink: Optional[Callable[[dict], None]] = None, ring_size: int = 2000):
+        self.sink = sink
+        self._ring: deque = deque(maxlen=ring_size)
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, latency_ms: float, course: Optional[str] = None, prompt_version: Optional[str] = None,
+               model: Optional[str] = None, ttft_ms: Optional[float] = None, tokens_per_sec: Optional[float] = None,
+               prompt_tokens: int = 0, completion_tokens: int = 0, cached_tokens: int = 0,
+               retries: Optional[int] = None, error: Optional[str] = None) -> dict:
+        row = {"created_at": datetime.now(), "kind": kind, "course": (course or "")[:128] or None,
+               "prompt_version": prompt_version, "model": model, "latency_ms": int(latency_ms),
+               "ttft_ms": None if ttft_ms is None else int(ttft_ms),
+               "tokens_per_sec": None if tokens_per_sec is None else round(tokens_per_sec, 1),
+               "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "cached_tokens": cached_tokens,
+               "retries": CALL_ATTEMPT.get() if retries is None else retries, "error": error}
+        with self._lock:
+            self._ring.append(row)
+        if self.sink:
+            self.sink(row)
+        return row
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            return list(self._ring)
+
+    def summary(self) -> Dict[str, dict]:
+        """按调用类型汇总内存中的最近记录。"""
+        by_kind: Dict[str, List[dict]] = {}
+        for row in self.snapshot():
+            by_kind.setdefault(row["kind"], []).append(row)
+        out = {}
+        for kind, rows in by_kind.items():
+            lat = [r["latency_ms"] for r in rows if not r["error"]]
+            ttft = [r["ttft_ms"] for r in rows if r["ttft_ms"] is not None]
+            tps = [r["tokens_per_sec"] for r in rows if r["tokens_per_sec"]]
+            prompt = sum(r["prompt_tokens"] for r in rows)
+            out[kind] = {"calls": len(rows), "errors": sum(1 for r in rows if r["error"]),
+                         "p50": percentile(lat, 50), "p95": percentile(lat, 95), "p99": percentile(lat, 99),
+                         "ttft_p50": percentile(ttft, 50), "ttft_p95": percentile(ttft, 95),
+                         "tps_avg": round(sum(tps) / len(tps), 1) if tps else 0.0,
+                         "cache_hit": round(sum(r["cached_tokens"] for r in rows) / prompt, 3) if prompt else 0.0}
+        return out
+
+
+def load_metrics(conn, hours: int = 24, kind: Optional[str] = None) -> pd.DataFrame:
+    sql = "SELECT created_at, kind, course, prompt_version, latency_ms, ttft_ms, tokens_per_sec, prompt_tokens, completion_tokens, cached_tokens, retries, error FROM llm_call_metrics WHERE created_at >= :since"
+    params = {"since": datetime.now() - timedelta(hours=hours)}
+    if kind:
+        sql += " AND kind = :k"
+        params["k"] = kind
+    return pd.read_sql(text(sql), conn, params=params, parse_dates=["created_at"])
+
+
+def latency_percentiles(df: pd.DataFrame, field: str = "latency_ms", freq: str = "5min") -> pd.DataFrame:
+    """按时间桶计算 p50 / p95 / p99，返回以时间为索引、三列分位数的宽表。"""
+    ok = df[df["error"].isna() & df[field].notna()]
+    if ok.empty:
+        return pd.DataFrame(columns=["p50", "p95", "p99"])
+    grouped = ok.set_index("created_at")[field].astype(float).resample(freq)
+    return pd.DataFrame({"p50": grouped.quantile(0.5), "p95": grouped.quantile(0.95),
+                         "p99": grouped.quantile(0.99)}).dropna()
+
+
+def kind_summary(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty:
+        return df
+    g = df.groupby("kind")
+    ok = df[df["error"].isna()].groupby("kind")
+    out = pd.DataFrame({
+        "调用数": g.size(),
+        "错误率(%)": (g["error"].apply(lambda s: s.notna().mean()) * 100).round(1),
+        "延迟p50(ms)": ok["latency_ms"].quantile(0.5),
+        "延迟p95(ms)": ok["latency_ms"].quantile(0.95),
+        "延迟p99(ms)": ok["latency_ms"].quantile(0.99),
+        "首字p50(ms)": ok["ttft_ms"].quantile(0.5),
+        "首字p95(ms)": ok["ttft_ms"].quantile(0.95),
+        "生成速度(tok/s)": ok["tokens_per_sec"].mean().round(1),
+        "重试次数": g["retries"].sum(),
+        "前缀缓存命中(%)": (g["cached_tokens"].sum() / g["prompt_tokens"].sum().replace(0, float("nan")) * 100).round(1),
+    })
+    return out.reset_index().rename(columns={"kind": "调用类型"})
@@ -0,0 +1,116 @@
+import hashlib
+import math
+import re
+from typing import Callable, List, Optional, Tuple
+
+# 辅导对话上下文：在 token 预算内带上最近几轮对话，更早的轮次压缩成滚动摘要。
+
+MESSAGE_OVERHEAD = 4
+_TOKEN_RE = re.compile(r"[一-鿿　-〿＀-￯]|[A-Za-z]+|\d+|\S")
+
+
+def count_tokens(text: str) -> int:
+    """本地估算 token 数，不调用分词服务：中文与全角字符按 1 个计，英文单词按每 4 个字母 1 个计，数字与符号逐段计。"""
+    n = 0
+    for m in _TOKEN_RE.finditer(text or ""):
+        tok = m.group()
+        if tok[0].isascii() and tok[0].isalpha():
+            n += math.ceil(len(tok) / 4)
+        elif tok[0].isdigit():
+            n += math.ceil(len(tok) / 3)
+        else:
+            n += 1
+    return n
+
+
+def message_tokens(messages: List[dict]) -> int:
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+
+
+def turns_key(turns: List[dict]) -> str:
+    h = hashlib.sha1()
+    for m in turns:
+        h.update(f"{m['role']}\x1f{m['content']}\x1e".encode('utf-8'))
+    return h.hexdigest()
+
+
+def compact_turns(turns: List[dict], max_tokens: int) -> str:
+    """摘要服务不可用时的本地兜底：每轮只保留开头一段，整体不超过 max_tokens。"""
+    if not turns:
+        return ""
+    per_turn = max(max_tokens // len(turns), 8)
+    lines = []
+    for m in turns:
+        who = "学生" if m["role"] == "user" else "辅导"
+        text = re.sub(r"\s+", " ", m["content"]).strip()
+        cut = len(text)
+        while cut > 0 and count_tokens(text[:cut]) > per_turn:
+            cut = cut * 3 // 4
+        lines.append(f"{who}：{text[:cut]}{'…' if cut < len(text) else ''}")
+    return "\n".join(lines)
+
+
+class ContextBuilder:
+    """按预算组装辅导请求的 messages。
+
+    从最新一轮往前装入历史，装不下的部分交给摘要；摘要边界按 segment 条消息对齐，
+    所以同一段对话只在越过一个分段时才重新摘要一次，其余轮次直接复用缓存的摘要。
+    summarize(上一段摘要, 新增轮次) 返回新的摘要文本，失败时退回本地截断。
+    """
+
+    def __init__(self, budget_tokens: int, summary_tokens: int, segment: int,
+                 summarize: Optional[Callable[[str, List[dict]], str]] = None):
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.segment = max(2, segment - segment % 2)
+        self.summarize = summarize
+        self.summaries_built = 0
+
+    def _summary_for(self, prior: List[dict], upto: int, state: Optional[dict]) -> dict:
+        covered = prior[:upto]
+        key = turns_key(covered)
+        if state and state.get("key") == key:
+            return state
+        prev_text, start = "", 0
+        if state and 0 < state["upto"] <= upto and state.get("key") == turns_key(prior[:state["upto"]]):
+            prev_text, start = state["text"], state["upto"]
+        text = ""
+        if self.summarize:
+            try:
+                text = self.summarize(prev_text, prior[start:upto]) or ""
+            except Exception:
+                text = ""
+        if not text.strip():
+            text = "\n".join(filter(None, [prev_text, compact_turns(prior[start:upto], self.summary_tokens)]))
+        while len(text) > 8 and count_tokens(text) > self.summary_tokens:
+            text = text[len(text) // 4:]
+        self.summaries_built += 1
+        return {"key": key, "upto": upto, "text": text}
+
+    def build(self, head: List[dict], prior: List[dict], tail: List[dict],
+              summary_state: Optional[dict] = None) -> Tuple[List[dict], Optional[dict], dict]:
+        """head 为系统提示等固定消息，prior 为之前的对话轮次，tail 为本轮请求。
+
+        返回 (messages, 新的摘要状态, 统计)。摘要状态由调用方按题目保存，下一轮原样传回。
+        """
+        fixed = message_tokens(head) + message_tokens(tail)
+        avail = self.budget_tokens - fixed - self.summary_tokens - MESSAGE_OVERHEAD
+        used, cut = 0, len(prior)
+        while cut > 0:
+            cost = count_tokens(prior[cut - 1]["content"]) + MESSAGE_OVERHEAD
+            if used + cost > avail:
+                break
+            used += cost
+            cut -= 1
+        summary = None
+        if cut:
+            upto = min(len(prior), math.ceil(cut / self.segment) * self.segment)
+            summary = self._summary_for(prior, upto, summary_state)
+            recent = prior[upto:]
+        else:
+            recent = prior
+        memory = [{"role": "system", "content": f"此前辅导对话摘要：\n{summary['text']}"}] if summary else []
+        messages = head + memory + recent + tail
+        stats = {"prompt_tokens_est": message_tokens(messages), "history_turns": len(recent),
+                 "summarized_turns": summary["upto"] if summary else 0}
+        return messages, summary if summary else summary_state, stats